@@ -1,19 +1,106 @@
 import base64
 import json
 import logging
+import math
+import time
 from dataclasses import dataclass
-from typing import List, Optional
+from typing import List, Optional, Tuple, Union
 
 import aiohttp
 
+from services.metrics import Counter, Histogram
+from services.tracing import span
+
 logger = logging.getLogger("VetBot.AI")
 
+AI_REQUEST_SECONDS = Histogram(
+    "ai_request_seconds", "Запросы к AI-провайдеру", ("model", "status"),
+    buckets=(0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 180.0),
+)
+AI_TOKENS_TOTAL = Counter("ai_tokens_total", "Токены AI по данным провайдера (usage)", ("model", "type"))
+
+
+@dataclass(frozen=True)
+class ImagePolicy:
+    """
+    Политика подготовки изображений под тайлинг vision-модели.
+    Картинка уменьшается так, чтобы после масштабирования провайдером
+    (вписать в 2048, короткая сторона до 768) уложиться в сетку тайлов:
+    tile_grid — для сканов документов (нужен мелкий текст), photo_tile_grid — для фото симптомов.
+    Прежний путь (2048 px) давал фото 4:3 сетку 2x2, а скану A4 — 2x3.
+    """
+    tile_grid: Tuple[int, int] = (2, 2)  # (тайлов по длинной стороне, по короткой)
+    photo_tile_grid: Tuple[int, int] = (2, 1)
+    tile_size: int = 512
+    max_side: int = 1024
+    quality: int = 80
+    detail: str = "high"  # 'low' | 'high' | 'auto' — уходит в image_url.detail
+    grayscale_documents: bool = True
+    autocrop_documents: bool = True
+    base_tokens: int = 85
+    tile_tokens: int = 170
+
+    def target_size(self, width: int, height: int, is_document: bool = True) -> Tuple[int, int]:
+        """
+        Размер, до которого стоит уменьшить картинку перед отправкой.
+        По умолчанию — по сетке документа (самый крупный вариант: подходит для draft-декодирования,
+        пока тип снимка еще не известен).
+        """
+        if width <= 0 or height <= 0:
+            return width, height
+        long_tiles, short_tiles = self.tile_grid if is_document else self.photo_tile_grid
+        long_side, short_side = max(width, height), min(width, height)
+        scale = min(
+            1.0,
+            self.max_side / long_side,
+            (long_tiles * self.tile_size) / long_side,
+            (short_tiles * self.tile_size) / short_side,
+        )
+        return max(1, int(width * scale)), max(1, int(height * scale))
+
+    def estimate_tokens(self, width: int, height: int) -> int:
+        """Оценка стоимости картинки в токенах по правилам тайлинга OpenAI-совместимых моделей"""
+        if width <= 0 or height <= 0:
+            return 0
+        if self.detail == "low":
+            return self.base_tokens
+        w, h = float(width), float(height)
+        if max(w, h) > 2048:
+            k = 2048 / max(w, h)
+            w, h = w * k, h * k
+        if min(w, h) > 768:
+            k = 768 / min(w, h)
+            w, h = w * k, h * k
+        tiles = math.ceil(w / self.tile_size) * math.ceil(h / self.tile_size)
+        return self.base_tokens + self.tile_tokens * tiles
+
+
+# Стоимость тайлов и сетки по моделям (у gpt-4o-mini тайл ~в 33 раза «дороже» в токенах).
+# Против прежнего пути (2048 px): фото 4:3 — 2x1 вместо 2x2 (4 -> 2 тайла),
+# скан A4 — 2x2 вместо 2x3 (6 -> 4), скриншот 9:19.5 — 2x1 вместо 4x2 (8 -> 2).
+_IMAGE_POLICIES = {
+    "gpt-4o-mini": ImagePolicy(
+        base_tokens=2833, tile_tokens=5667, tile_grid=(2, 2), photo_tile_grid=(2, 1), max_side=1024
+    ),
+    "gpt-4o": ImagePolicy(tile_grid=(2, 2), photo_tile_grid=(2, 1), max_side=1024),
+}
+
+
+def image_policy_for(model: str) -> ImagePolicy:
+    """Подбирает ImagePolicy по имени vision-модели (самое длинное совпадение)"""
+    name = (model or "").lower()
+    for key in sorted(_IMAGE_POLICIES, key=len, reverse=True):
+        if key in name:
+            return _IMAGE_POLICIES[key]
+    return ImagePolicy()
+
 
 @dataclass(frozen=True)
 class ModelConfig:
     model: str
     temperature: float = 0.3
     max_tokens: int = 800
+    image: Optional[ImagePolicy] = None  # Только для vision-моделей
 
 
 class VseGPTClient:
@@ -35,7 +122,7 @@ class VseGPTClient:
         user_prompt: str,
         history: List[dict],
         cfg: ModelConfig,
-        image_bytes: Optional[bytes] = None,
+        image_bytes: Optional[Union[bytes, List[bytes]]] = None,
     ) -> str:
         if not self.enabled:
             return "❌ AI API key не настроен. Добавьте AI_API_KEY или VSEGPT_API_KEY в .env"
@@ -49,18 +136,17 @@ class VseGPTClient:
         messages: List[dict] = [{"role": "system", "content": system_prompt}]
         messages.extend(history or [])
 
-        if image_bytes:
-            b64 = base64.b64encode(image_bytes).decode("utf-8")
+        images = image_bytes if isinstance(image_bytes, list) else ([image_bytes] if image_bytes else [])
+        if images:
             # OpenAI multimodal format (most OpenAI-compatible gateways support it)
-            messages.append(
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": user_prompt},
-                        {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{b64}"}},
-                    ],
-                }
-            )
+            content: List[dict] = [{"type": "text", "text": user_prompt}]
+            for data in images:
+                b64 = base64.b64encode(data).decode("utf-8")
+                image_url = {"url": f"data:image/jpeg;base64,{b64}"}
+                if cfg.image and cfg.image.detail:
+                    image_url["detail"] = cfg.image.detail
+                content.append({"type": "image_url", "image_url": image_url})
+            messages.append({"role": "user", "content": content})
         else:
             messages.append({"role": "user", "content": user_prompt})
 
@@ -73,20 +159,33 @@ class VseGPTClient:
         }
 
         timeout = aiohttp.ClientTimeout(total=180)
+        started = time.perf_counter()
+        status = "error"
         try:
-            async with aiohttp.ClientSession(timeout=timeout) as sess:
-                async with sess.post(url, headers=headers, json=payload) as r:
-                    raw = await r.text()
-                    if r.status != 200:
-                        logger.error("AI provider error %s: %s", r.status, raw[:2000])
-                        return f"❌ Ошибка модели: {r.status}\n{raw[:1500]}"
-                    try:
-                        data = json.loads(raw)
-                    except Exception:
-                        return raw
+            with span("ai.chat", model=cfg.model, images=len(images)) as sp:
+                async with aiohttp.ClientSession(timeout=timeout) as sess:
+                    async with sess.post(url, headers=headers, json=payload) as r:
+                        raw = await r.text()
+                        status = str(r.status)
+                        sp.set("status", r.status)
+                        if r.status != 200:
+                            logger.error("AI provider error %s: %s", r.status, raw[:2000])
+                            return f"❌ Ошибка модели: {r.status}\n{raw[:1500]}"
+                        try:
+                            data = json.loads(raw)
+                        except Exception:
+                            return raw
         except Exception as e:
             logger.exception("AI provider request failed: %s", e)
             return "❌ Ошибка подключения к AI-провайдеру. Проверьте интернет/ключ/доступ."
+        finally:
+            AI_REQUEST_SECONDS.observe(time.perf_counter() - started, model=cfg.model, status=status)
+
+        usage = data.get("usage") if isinstance(data, dict) else None
+        if isinstance(usage, dict):
+            for kind in ("prompt_tokens", "completion_tokens"):
+                if usage.get(kind):
+                    AI_TOKENS_TOTAL.inc(usage[kind], model=cfg.model, type=kind.split("_")[0])
 
         try:
             return (data["choices"][0]["message"]["content"] or "").strip()
@@ -5,7 +5,8 @@ import asyncio
 import logging
 import json
 import re
-from typing import List, Optional
+import signal
+from typing import Awaitable, Callable, List, Optional, Union
 
 from aiogram import Bot, Dispatcher, Router, F
 from aiogram.types import Message, BotCommand, BotCommandScopeDefault
@@ -16,7 +17,7 @@ from dotenv import load_dotenv
 # Подключаем модули проекта
 import storage as st
 import config
-from handlers.ocr import router as ocr_router, register_answer_callback
+from handlers.ocr import router as ocr_router, register_answer_callback, register_vision_config, run_uploads_job
 from handlers.core import router as core_router
 from handlers.medcard import router as medcard_router
 from handlers.menu import router as menu_router
@@ -25,7 +26,23 @@ from handlers.feedback import router as feedback_router
 from handlers.promo import router as promo_router
 from handlers.admin import router as admin_router
 from middlewares.logger_middleware import LoggingMiddleware
-from ai_client import VseGPTClient, ModelConfig
+from middlewares.metrics_middleware import setup_metrics
+from middlewares.user_lock_middleware import setup_user_lock
+from middlewares.antiflood_middleware import setup_antiflood
+from services.http_server import build_app, start_http_server
+from services.payment_tracker import pending_payments_loop
+from services.broadcast import resume_broadcasts
+from services.delivery import DeliveryStateMiddleware, reprobe_blocked_loop
+from services.reminders import reminder_scheduler
+from services.leader import run_singleton
+from services.inflight import run_ai, setup_supersede
+from services.job_queue import JOB_QUEUE_ENABLED, QueueFull, enqueue, register_job_handler
+from services.admission import BUSY_TEXT, shed, track
+from services.loop_monitor import run_loop_monitor
+from services.lifecycle import is_draining, setup_update_tracker, shutdown
+from services.tracing import setup_tracing
+from services.telegram_webhook import register_webhook, setup_telegram_webhook
+from ai_client import VseGPTClient, ModelConfig, image_policy_for
 from check_env import validate_required_env
 
 # Настройка логирования
@@ -162,7 +179,8 @@ async def get_model_for_user(user_id: int, has_image: bool) -> ModelConfig:
     """
     if has_image:
         # Vision везде используем vis-openai/gpt-4o-mini
-        return ModelConfig(model="vis-openai/gpt-4o-mini", temperature=0.2, max_tokens=MAX_TOKENS_PRO_VISION)
+        model = "vis-openai/gpt-4o-mini"
+        return ModelConfig(model=model, temperature=0.2, max_tokens=MAX_TOKENS_PRO_VISION, image=image_policy_for(model))
     
     # Проверяем, является ли пользователь платным
     has_sub = await st.has_active_subscription(user_id)
@@ -187,7 +205,7 @@ def _model_cfg_for(tier: str, has_image: bool) -> ModelConfig:
             model = MODEL_PLUS_VISION
         else:
             model = MODEL_FREE_VISION
-        return ModelConfig(model=model, temperature=0.2, max_tokens=MAX_TOKENS_PRO_VISION)
+        return ModelConfig(model=model, temperature=0.2, max_tokens=MAX_TOKENS_PRO_VISION, image=image_policy_for(model))
     if tier == "pro":
         return ModelConfig(model=MODEL_PRO_CHAT, temperature=0.3, max_tokens=MAX_TOKENS_PRO)
     if tier == "plus":
@@ -255,16 +273,25 @@ async def build_context(user_id: int) -> List[dict]:
 
 # === ОБРАБОТЧИК СООБЩЕНИЙ ===
 
-async def unified_ai_entry(message: Message, prompt: str, image_bytes: Optional[bytes] = None, is_analysis_document: bool = False):
+async def _admit_ai_request(
+    message: Message,
+    prompt: str,
+    image_bytes: Optional[Union[bytes, List[bytes]]] = None,
+) -> Optional[dict]:
+    """
+    Проверки и списание лимита до обращения к AI.
+    None — пользователю уже ответили отказом; иначе {"refund": функция возврата квоты или None}.
+    """
     user_id = message.from_user.id
     pet = await st.get_active_pet(user_id)
     if not pet:
         from handlers.medcard import show_medcard_menu
         await message.answer("⚠️ **Я не знаю, кого мы лечим.**\nПожалуйста, создайте профиль питомца.")
         await show_medcard_menu(message)
-        return
+        return None
 
     tier = "pro" if user_id in ADMIN_IDS else None
+    refund = None
     if user_id not in ADMIN_IDS:
         # Для текстовых сообщений используем новую логику check_text_limits
         if not image_bytes:
@@ -282,7 +309,11 @@ async def unified_ai_entry(message: Message, prompt: str, image_bytes: Optional[
                     "• 🔄 Подписка PLUS/PRO — безлимит\n\n"
                     "Оформить: /buy"
                 )
-                return
+                return None
+
+            # Перегрузка: бесплатный запрос отклоняем до списания лимита
+            if await shed(message, paid=text_limit.get("reason") != "free"):
+                return None
             
             # Определяем tier для проверки длины сообщения
             # Используем get_effective_tier, который проверяет активную подписку
@@ -304,7 +335,7 @@ async def unified_ai_entry(message: Message, prompt: str, image_bytes: Optional[
             )
             if not limit["allowed"]:
                 await message.answer("⛔ Лимит вопросов на сегодня исчерпан.\nОформите подписку: /buy")
-                return
+                return None
             tier = limit.get("tier") or "free"
 
         max_chars = _max_chars_for(tier)
@@ -314,17 +345,19 @@ async def unified_ai_entry(message: Message, prompt: str, image_bytes: Optional[
                 f"Максимум: **{max_chars}** символов.\n\n"
                 "Сократите текст или оформите подписку: /buy"
             )
-            return
+            return None
         
         # Списываем лимит (после всех валидаций)
         if not image_bytes:
             # Для текстовых сообщений используем check_text_limits
-            await st.check_text_limits(
+            consumed = await st.check_text_limits(
                 user_id,
                 message.from_user.username or "Unknown",
                 FREE_DAILY_TEXT_LIMIT,
                 consume=True,
             )
+            if consumed.get("reason") == "free":
+                refund = lambda: st.refund_text_usage(user_id)
         else:
             # Для фото/OCR используем старую логику
             await st.check_user_limits(
@@ -334,6 +367,72 @@ async def unified_ai_entry(message: Message, prompt: str, image_bytes: Optional[
                 consume=True,
             )
 
+    return {"refund": refund}
+
+
+async def unified_ai_entry(
+    message: Message,
+    prompt: str,
+    image_bytes: Optional[Union[bytes, List[bytes]]] = None,
+    is_analysis_document: bool = False,
+):
+    admission = await _admit_ai_request(message, prompt, image_bytes)
+    if admission is None:
+        return
+
+    if JOB_QUEUE_ENABLED and not image_bytes:
+        # Текст генерирует воркер (фото сюда приходят уже из воркера, см. handlers/ocr)
+        try:
+            await enqueue("answer", message, prompt=prompt, is_analysis_document=is_analysis_document)
+            await message.bot.send_chat_action(message.chat.id, "typing")
+            return
+        except QueueFull:
+            if admission["refund"]:
+                await admission["refund"]()
+            await message.answer(BUSY_TEXT)
+            return
+        except Exception as e:
+            # Redis недоступен — отвечаем сами, чем не ответить вовсе
+            logger.error(f"Error in unified_ai_entry enqueue: {e}")
+
+    await generate_answer(message, prompt, image_bytes, is_analysis_document, refund=admission["refund"])
+
+
+async def _resume_after_restart(
+    message: Message,
+    prompt: str,
+    is_analysis_document: bool,
+    refund: Optional[Callable[[], Awaitable]],
+):
+    """Ответ не успел до остановки бота: с очередью — отдаем воркеру, иначе возвращаем лимит"""
+    if JOB_QUEUE_ENABLED:
+        try:
+            await enqueue("answer", message, prompt=prompt, is_analysis_document=is_analysis_document)
+            return
+        except Exception as e:
+            logger.error(f"Error in _resume_after_restart enqueue: {e}")
+    try:
+        if refund:
+            await refund()
+        await message.answer(
+            "🔄 Бот перезапускается и не успел ответить."
+            + (" Лимит возвращен." if refund else "")
+            + " Повторите вопрос через минуту."
+        )
+    except Exception as e:
+        logger.error(f"Error in _resume_after_restart: {e}")
+
+
+async def generate_answer(
+    message: Message,
+    prompt: str,
+    image_bytes: Optional[Union[bytes, List[bytes]]] = None,
+    is_analysis_document: bool = False,
+    refund: Optional[Callable[[], Awaitable]] = None,
+):
+    """Запрос к AI, очистка ответа, сохранение в историю и отправка (в боте или в воркере)"""
+    user_id = message.from_user.id
+
     await message.bot.send_chat_action(message.chat.id, "typing")
     
     # Используем новую функцию выбора модели
@@ -342,7 +441,20 @@ async def unified_ai_entry(message: Message, prompt: str, image_bytes: Optional[
     # Выбираем промпт: для анализов используем "Светофор", иначе обычный
     system_prompt = ANALYSIS_PROMPT if is_analysis_document else DEFAULT_PROMPT
     
-    reply = await client.chat(system_prompt, prompt, await build_context(user_id), cfg, image_bytes=image_bytes)
+    reply_coro = client.chat(system_prompt, prompt, await build_context(user_id), cfg, image_bytes=image_bytes)
+    if image_bytes:
+        reply = await reply_coro
+    else:
+        # Текстовый запрос можно отменить уточнением пользователя (квота возвращается)
+        async with track("text"):
+            try:
+                reply = await run_ai(user_id, reply_coro, refund=refund)
+            except asyncio.CancelledError:
+                if is_draining():
+                    await _resume_after_restart(message, prompt, is_analysis_document, refund)
+                raise
+        if reply is None:
+            return
     
     # === ОЧИСТКА ОТ ДУБЛЕЙ И ЗАГОЛОВКОВ ===
     # Убираем заголовки, если модель их сгенерировала
@@ -379,7 +491,11 @@ async def unified_ai_entry(message: Message, prompt: str, image_bytes: Optional[
     if "⚠️ Я ИИ-ассистент" not in reply:
         reply += LEGAL_DISCLAIMER
     
-    entry_id = await st.save_entry(user_id, prompt if not image_bytes else "[📸]", reply)
+    if isinstance(image_bytes, list) and len(image_bytes) > 1:
+        user_text = f"[📸 x{len(image_bytes)}]"
+    else:
+        user_text = prompt if not image_bytes else "[📸]"
+    entry_id = await st.save_entry(user_id, user_text, reply)
 
     last_msg = await send_long_message(message, reply)
     if last_msg:
@@ -393,37 +509,62 @@ async def unified_ai_entry(message: Message, prompt: str, image_bytes: Optional[
 async def free_text(message: Message):
     await unified_ai_entry(message, message.text)
 
-async def reminder_loop(bot: Bot):
-    while True:
-        try:
-            notifications = await st.check_reminders_today()
-            for uid, text in notifications:
-                try:
-                    await bot.send_message(uid, text)
-                except Exception as e:
-                    logger.error(f"Error in reminder_loop send_message: {e}")
-            await asyncio.sleep(60 * 60 * 24) 
-        except Exception as e:
-            logger.error(f"Error in reminder_loop: {e}")
-            await asyncio.sleep(60)
+
+async def _answer_job(message: Message, prompt: str, is_analysis_document: bool = False):
+    """Задание очереди: лимит уже списан ботом, воркеру остается сгенерировать и отправить ответ"""
+    await generate_answer(message, prompt, is_analysis_document=is_analysis_document)
+
+
+def setup_ai():
+    """AI-клиент и обработчики заданий — общие для бота и worker.py"""
+    global client
+    client = VseGPTClient(VSEGPT_API_KEY, VSEGPT_BASE_URL)
+    register_answer_callback(unified_ai_entry)
+    register_vision_config(lambda user_id: get_model_for_user(user_id, has_image=True))
+    register_job_handler("answer", _answer_job)
+    register_job_handler("uploads", run_uploads_job)
 
 # === ЗАПУСК ===
+async def _wait_for_stop_signal():
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            # Windows: остается KeyboardInterrupt
+            pass
+    await stop.wait()
+    logger.info("🛑 Получен сигнал остановки")
+
+
 async def main():
-    global client
     load_dotenv()
     validate_required_env()
     await st.init_db()  # Async инициализация БД
 
-    client = VseGPTClient(VSEGPT_API_KEY, VSEGPT_BASE_URL)
+    setup_ai()
     bot = Bot(token=TELEGRAM_BOT_TOKEN, default=DefaultBotProperties(parse_mode="Markdown"))
+    # Помечаем заблокировавших бота на любом пути отправки
+    bot.session.middleware(DeliveryStateMiddleware())
     storage = RedisStorage.from_url(config.REDIS_URL)
     dp = Dispatcher(storage=storage)
     
+    # Трассировка апдейтов и вызовов Bot API (TRACE_SAMPLE_RATE)
+    setup_tracing(dp, bot)
+    # Метрики: поток апдейтов по типам, время хендлеров (GET /metrics)
+    setup_metrics(dp)
+    # Учет апдейтов в обработке — их дожидается плавная остановка
+    setup_update_tracker(dp)
+    # Лишние апдейты отбрасываем сразу, до FSM, БД и AI
+    setup_antiflood(dp)
+    # Уточнение отменяет предыдущий текстовый запрос к AI (если включено)
+    setup_supersede(dp)
+    # Апдейты одного пользователя — по очереди, разных пользователей — параллельно
+    setup_user_lock(dp)
     # Подключаем middleware для логирования действий пользователей
     dp.update.outer_middleware(LoggingMiddleware())
     
-    register_answer_callback(unified_ai_entry)
-    
     dp.include_router(core_router)
     dp.include_router(pay_router)
     dp.include_router(medcard_router)
@@ -434,12 +575,36 @@ async def main():
     dp.include_router(admin_router)
     dp.include_router(ai_router)
     
-    await bot.delete_webhook(drop_pending_updates=True)
-    asyncio.create_task(reminder_loop(bot))
-    asyncio.create_task(yookassa_polling_loop(bot))
+    # HTTP: вебхук YooKassa, health-check и /metrics (+ апдейты Telegram в режиме webhook)
+    app = build_app(bot)
+    if config.BOT_MODE == "webhook":
+        setup_telegram_webhook(app, dp, bot)
+    http_runner = await start_http_server(app)
+
+    if config.BOT_MODE == "webhook":
+        await register_webhook(bot, dp)
+    else:
+        await bot.delete_webhook(drop_pending_updates=True)
+    # Фоновые циклы-синглтоны: при нескольких репликах каждый работает только на лидере
+    background = [
+        asyncio.create_task(run_loop_monitor()),
+        asyncio.create_task(run_singleton("reminders", lambda: reminder_scheduler(bot))),
+        asyncio.create_task(run_singleton("yookassa-reconcile", lambda: yookassa_polling_loop(bot))),
+        asyncio.create_task(run_singleton("pending-payments", lambda: pending_payments_loop(bot))),
+        asyncio.create_task(run_singleton("delivery-reprobe", lambda: reprobe_blocked_loop(bot))),
+        asyncio.create_task(run_singleton("broadcast-resume", lambda: resume_broadcasts(bot))),
+    ]
     
-    print("✅ VET-BOT ЗАПУЩЕН! (v6.2 Stable + Async Storage)")
-    await dp.start_polling(bot)
+    print(f"✅ VET-BOT ЗАПУЩЕН! (v6.2 Stable + Async Storage, режим: {config.BOT_MODE})")
+    try:
+        if config.BOT_MODE == "webhook":
+            # Вебхук не снимаем при остановке: апдейты копятся у Telegram и достаются другим репликам
+            await _wait_for_stop_signal()
+        else:
+            # SIGTERM/SIGINT останавливает polling; сессию бота закрываем сами — после дренажа
+            await dp.start_polling(bot, close_bot_session=False)
+    finally:
+        await shutdown(bot, dp, http_runner, background)
 
 if __name__ == "__main__":
     try:
@@ -13,6 +13,8 @@ def validate_required_env() -> None:
     """
     load_dotenv()
     missing = [name for name in REQUIRED_VARS if not str(os.getenv(name, "")).strip()]
+    if os.getenv("BOT_MODE", "polling").strip().lower() == "webhook":
+        missing += [name for name in ("WEBHOOK_BASE_URL", "WEBHOOK_SECRET") if not str(os.getenv(name, "")).strip()]
     if missing:
         formatted = ", ".join(missing)
         raise RuntimeError(
@@ -7,6 +7,7 @@ from aiogram.filters import Command, CommandObject
 from aiogram.fsm.context import FSMContext
 from dotenv import load_dotenv
 import storage as st
+from services.broadcast import start_broadcast
 from handlers.states import AdminPromoState, AdminBroadcastState, AdminSearchState
 from keyboards.admin_kb import admin_keyboard
 from keyboards.main_kb import main_reply_kb
@@ -58,7 +59,8 @@ async def btn_stats(message: Message):
         f"- новых сегодня: **{s['users_today']}**\n"
         f"- новых за неделю: **{user_stats['users_week']}**\n"
         f"- новых за месяц: **{user_stats['users_month']}**\n"
-        f"- активных за 24ч: **{user_stats['active_24h']}**\n\n"
+        f"- активных за 24ч: **{user_stats['active_24h']}**\n"
+        f"- недоставляемые (заблокировали бота): **{s['users_blocked']}** ({s['users_blocked_pct']}%)\n\n"
         f"💬 **Сообщения:**\n"
         f"- всего: **{s['msgs_total']}**\n"
         f"- сегодня: **{s['msgs_today']}**\n\n"
@@ -298,32 +300,39 @@ async def cancel_broadcast(message: Message, state: FSMContext):
     await message.answer("❌ Рассылка отменена.", reply_markup=admin_keyboard())
 
 
+# Готовые сегменты аудитории (фильтры выполняются в SQL)
+BROADCAST_AUDIENCES = {
+    "👥 Все": st.AudienceFilter(),
+    "🆓 Только free": st.AudienceFilter(tiers=("free",)),
+    "💎 Подписчики": st.AudienceFilter(tiers=("plus", "pro")),
+    "🔥 Активные за 30 дней": st.AudienceFilter(active_days=30),
+    "🐶 Владельцы собак": st.AudienceFilter(species=("dog",)),
+    "🐱 Владельцы кошек": st.AudienceFilter(species=("cat",)),
+    "🐾 Без питомца": st.AudienceFilter(has_pets=False),
+}
+
+
+def _audience_keyboard() -> ReplyKeyboardMarkup:
+    labels = list(BROADCAST_AUDIENCES)
+    rows = [[KeyboardButton(text=label) for label in labels[i:i + 2]] for i in range(0, len(labels), 2)]
+    rows.append([KeyboardButton(text="❌ Отмена")])
+    return ReplyKeyboardMarkup(resize_keyboard=True, keyboard=rows, one_time_keyboard=True)
+
+
+async def _ask_broadcast_audience(message: Message, state: FSMContext):
+    """Выбор аудитории после ввода контента"""
+    await message.answer("🎯 Кому отправить?", reply_markup=_audience_keyboard())
+    await state.set_state(AdminBroadcastState.waiting_for_audience)
+
+
 @router.message(AdminBroadcastState.waiting_for_content, F.text)
 async def process_broadcast_text(message: Message, state: FSMContext):
     """Обработка текста для рассылки"""
     if not is_admin(message.from_user.id):
         await state.clear()
         return
-    content = message.text
-    await state.update_data(content=content, has_photo=False)
-    
-    confirm_kb = ReplyKeyboardMarkup(
-        resize_keyboard=True,
-        keyboard=[
-            [KeyboardButton(text="✅ Отправить"), KeyboardButton(text="❌ Отмена")]
-        ],
-        one_time_keyboard=True
-    )
-    
-    users_count = len(await st.get_all_users())
-    await message.answer(
-        f"📋 **Превью рассылки:**\n\n{content}\n\n"
-        f"👥 Будет отправлено **{users_count}** пользователям.\n\n"
-        f"Подтвердите отправку:",
-        parse_mode="Markdown",
-        reply_markup=confirm_kb
-    )
-    await state.set_state(AdminBroadcastState.waiting_for_confirm)
+    await state.update_data(content=message.text, has_photo=False)
+    await _ask_broadcast_audience(message, state)
 
 
 @router.message(AdminBroadcastState.waiting_for_content, F.photo)
@@ -340,6 +349,27 @@ async def process_broadcast_photo(message: Message, state: FSMContext):
         content=caption,
         has_photo=True
     )
+    await _ask_broadcast_audience(message, state)
+
+
+@router.message(AdminBroadcastState.waiting_for_audience, F.text == "❌ Отмена")
+async def cancel_broadcast_audience(message: Message, state: FSMContext):
+    """Отмена рассылки на этапе выбора аудитории"""
+    await state.clear()
+    if is_admin(message.from_user.id):
+        await message.answer("❌ Рассылка отменена.", reply_markup=admin_keyboard())
+
+
+@router.message(AdminBroadcastState.waiting_for_audience, F.text.in_(BROADCAST_AUDIENCES))
+async def process_broadcast_audience(message: Message, state: FSMContext):
+    """Превью с размером аудитории (COUNT, без выгрузки id)"""
+    if not is_admin(message.from_user.id):
+        await state.clear()
+        return
+    audience_label = message.text
+    await state.update_data(audience=audience_label)
+    data = await state.get_data()
+    content = data.get("content", "")
     
     confirm_kb = ReplyKeyboardMarkup(
         resize_keyboard=True,
@@ -349,10 +379,11 @@ async def process_broadcast_photo(message: Message, state: FSMContext):
         one_time_keyboard=True
     )
     
-    users_count = len(await st.get_all_users())
+    users_count = await st.count_users(BROADCAST_AUDIENCES[audience_label])
+    body = f"📸 Фото + текст: {content or '(без текста)'}" if data.get("has_photo") else content
     await message.answer(
-        f"📋 **Превью рассылки:**\n\n"
-        f"📸 Фото + текст: {caption or '(без текста)'}\n\n"
+        f"📋 **Превью рассылки:**\n\n{body}\n\n"
+        f"🎯 Аудитория: {audience_label}\n"
         f"👥 Будет отправлено **{users_count}** пользователям.\n\n"
         f"Подтвердите отправку:",
         parse_mode="Markdown",
@@ -361,6 +392,15 @@ async def process_broadcast_photo(message: Message, state: FSMContext):
     await state.set_state(AdminBroadcastState.waiting_for_confirm)
 
 
+@router.message(AdminBroadcastState.waiting_for_audience)
+async def unknown_broadcast_audience(message: Message, state: FSMContext):
+    """Любой другой ввод на шаге аудитории — не в AI, а повтор выбора"""
+    if not is_admin(message.from_user.id):
+        await state.clear()
+        return
+    await message.answer("🎯 Выберите аудиторию кнопкой ниже или нажмите «❌ Отмена».", reply_markup=_audience_keyboard())
+
+
 @router.message(AdminBroadcastState.waiting_for_confirm, F.text == "❌ Отмена")
 async def cancel_broadcast_confirm(message: Message, state: FSMContext):
     """Отмена рассылки на этапе подтверждения"""
@@ -381,29 +421,20 @@ async def confirm_broadcast(message: Message, state: FSMContext, bot: Bot):
     content = data.get("content", "")
     has_photo = data.get("has_photo", False)
     photo_file_id = data.get("photo_file_id")
-    
-    users = await st.get_all_users()
-    sent = 0
-    failed = 0
-    
-    await message.answer("📤 Начинаю рассылку...", reply_markup=admin_keyboard())
-    
-    for user_id in users:
-        try:
-            if has_photo and photo_file_id:
-                await bot.send_photo(user_id, photo_file_id, caption=content, parse_mode="Markdown")
-            else:
-                await bot.send_message(user_id, content, parse_mode="Markdown")
-            sent += 1
-        except Exception:
-            failed += 1
+    audience = BROADCAST_AUDIENCES.get(data.get("audience"), st.AudienceFilter())
     
     await state.clear()
+    job_id = await start_broadcast(
+        bot,
+        admin_id=message.from_user.id,
+        chat_id=message.chat.id,
+        content=content,
+        photo_file_id=photo_file_id if has_photo else None,
+        audience=audience,
+    )
     await message.answer(
-        f"✅ **Рассылка завершена!**\n\n"
-        f"✅ Отправлено: **{sent}**\n"
-        f"❌ Ошибок: **{failed}**",
-        parse_mode="Markdown",
+        f"📤 Рассылка #{job_id} запущена в фоне.\n"
+        f"Прогресс будет обновляться в сообщении выше.",
         reply_markup=admin_keyboard()
     )
 
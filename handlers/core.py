@@ -8,6 +8,7 @@ from aiogram.types import Message, CallbackQuery
 from aiogram.filters import CommandStart, Command, CommandObject
 from dotenv import load_dotenv
 import storage as st
+from services.broadcast import start_broadcast
 from keyboards.main_kb import main_reply_kb
 
 router = Router()
@@ -245,7 +246,8 @@ async def cmd_stats(message: Message):
         "📊 **Статистика Vet‑bot**\n\n"
         f"👥 **Пользователи:**\n"
         f"- всего: **{s['users_total']}**\n"
-        f"- новых сегодня: **{s['users_today']}**\n\n"
+        f"- новых сегодня: **{s['users_today']}**\n"
+        f"- недоставляемые (заблокировали бота): **{s['users_blocked']}** ({s['users_blocked_pct']}%)\n\n"
         f"💬 **Сообщения:**\n"
         f"- всего: **{s['msgs_total']}**\n"
         f"- сегодня: **{s['msgs_today']}**\n\n"
@@ -270,10 +272,5 @@ async def cmd_stats(message: Message):
 async def cmd_broadcast(message: Message, command: CommandObject):
     if message.from_user.id not in ADMIN_IDS: return
     if not command.args: return
-    users = await st.get_all_users()
-    for uid in users:
-        try:
-            await message.bot.send_message(uid, command.args, parse_mode="Markdown")
-        except Exception as e:
-            logger.error(f"Error in cmd_broadcast: {e}")
-    await message.answer("Рассылка завершена.")
\ No newline at end of file
+    job_id = await start_broadcast(message.bot, message.from_user.id, message.chat.id, command.args)
+    await message.answer(f"Рассылка #{job_id} запущена.")
\ No newline at end of file
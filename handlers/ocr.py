@@ -3,13 +3,25 @@
 import asyncio
 import io
 import logging
-from typing import Callable, Awaitable, Optional
+from contextlib import nullcontext
+from dataclasses import asdict, dataclass, replace
+from typing import BinaryIO, Callable, Awaitable, Optional, Union
 
 from aiogram import Router, F
 from aiogram.types import Message
 from PIL import Image
 import fitz  # PyMuPDF для PDF
 import storage as st # Подключаем базу для проверки тарифа
+from ai_client import ImagePolicy, ModelConfig
+from middlewares.user_lock_middleware import hold_user_lock
+from services import admission, albums, job_queue
+from services.albums import AlbumItem
+from services.downloads import (
+    FileTooLarge, MAX_DOWNLOAD_BYTES, SPOOL_MAX_MEMORY, download_to_spool, upload_budget,
+)
+from services.metrics import Histogram
+from services.preflight import PreflightResult, preflight_image, REJECT_MESSAGES
+from services.tracing import span
 import os
 
 router = Router()
@@ -20,153 +32,490 @@ PLUS_PHOTOS_PER_MONTH = int(os.getenv("PLUS_PHOTOS_PER_MONTH", "10"))
 PRO_PHOTOS_PER_MONTH_RAW = os.getenv("PRO_PHOTOS_PER_MONTH", "20")
 PRO_PHOTOS_PER_MONTH = None if not PRO_PHOTOS_PER_MONTH_RAW.strip() else int(PRO_PHOTOS_PER_MONTH_RAW)
 
-AnswerCallback = Callable[[Message, str, Optional[bytes], bool], Awaitable[None]]
+AnswerCallback = Callable[[Message, str, Optional[Union[bytes, list[bytes]]], bool], Awaitable[None]]
 _ANSWER_CALLBACK: Optional[AnswerCallback] = None
+VisionConfigResolver = Callable[[int], Awaitable[ModelConfig]]
+_VISION_CONFIG: Optional[VisionConfigResolver] = None
 
 def register_answer_callback(func: AnswerCallback):
     global _ANSWER_CALLBACK
     _ANSWER_CALLBACK = func
 
-def _process_pdf_sync(buf: io.BytesIO) -> Optional[Image.Image]:
-    """Синхронная обработка PDF (выполняется в отдельном потоке)"""
+def register_vision_config(func: VisionConfigResolver):
+    """Регистрирует функцию выбора vision-модели (от нее зависит политика разрешения)"""
+    global _VISION_CONFIG
+    _VISION_CONFIG = func
+
+# Потолок пикселей для декодирования (после draft-уменьшения JPEG)
+MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS", "40000000"))
+
+# Прежний потолок (до ImagePolicy) — база для отчета об экономии
+LEGACY_MAX_DIM = 2048
+# Потолок плотности рендера PDF: мелкие страницы не раздуваем сверх 200 dpi
+PDF_MAX_DPI = 200
+# Пиксели светлее порога считаем полями скана
+AUTOCROP_WHITE_THRESHOLD = 235
+AUTOCROP_PADDING = 16
+# Черновой рендер PDF для поиска полей (дешево: A4 при 36 dpi — ~300x420) и отступ вокруг содержимого, pt
+PDF_PREVIEW_DPI = 36
+PDF_CLIP_PADDING = 8
+
+# download — загрузка из Telegram; decode/render — растр; preflight — локальная проверка; encode — JPEG
+OCR_STAGE_SECONDS = Histogram("ocr_stage_seconds", "Этапы подготовки снимков", ("stage",))
+
+
+def _content_bbox(img: Image.Image) -> Optional[tuple[int, int, int, int]]:
+    """Рамка всего, что темнее полей (None — страница пустая)"""
+    gray = img if img.mode == "L" else img.convert("L")
+    return gray.point(lambda p: 255 if p < AUTOCROP_WHITE_THRESHOLD else 0).getbbox()
+
+
+def _autocrop_margins(img: Image.Image) -> Image.Image:
+    """Обрезает почти белые поля документа (с небольшим отступом)"""
+    bbox = _content_bbox(img)
+    if not bbox:
+        return img
+    left, top, right, bottom = bbox
+    left = max(0, left - AUTOCROP_PADDING)
+    top = max(0, top - AUTOCROP_PADDING)
+    right = min(img.width, right + AUTOCROP_PADDING)
+    bottom = min(img.height, bottom + AUTOCROP_PADDING)
+    if (right - left) * (bottom - top) >= img.width * img.height * 0.95:
+        return img
+    return img.crop((left, top, right, bottom))
+
+
+def _finalize_sync(img: Image.Image, policy: ImagePolicy, is_document: bool) -> tuple[bytes, tuple[int, int]]:
+    """Доводит растр до политики модели и кодирует в JPEG ровно один раз; возвращает JPEG и его размер"""
+    if is_document and policy.grayscale_documents:
+        if img.mode != "L":
+            img = img.convert("L")
+    elif img.mode != "RGB":
+        img = img.convert("RGB")
+
+    if is_document and policy.autocrop_documents:
+        img = _autocrop_margins(img)
+
+    target = policy.target_size(*img.size, is_document=is_document)
+    if target != img.size:
+        img.thumbnail(target, Image.Resampling.LANCZOS)
+
+    out_buf = io.BytesIO()
+    img.save(out_buf, format="JPEG", quality=policy.quality, optimize=True)
+    return out_buf.getvalue(), img.size
+
+
+def _log_image_report(
+    source_bytes: int, source_size: tuple[int, int], data: bytes, out_size: tuple[int, int], policy: ImagePolicy
+):
+    """Отчет: сколько байт и оценочных токенов картинки сэкономила политика"""
+    w, h = source_size
+    k = min(1.0, LEGACY_MAX_DIM / max(w, h, 1))
+    legacy_tokens = replace(policy, detail="high").estimate_tokens(int(w * k), int(h * k))
+    tokens = policy.estimate_tokens(*out_size)
+    logger.info(
+        f"🖼 {w}x{h} → {out_size[0]}x{out_size[1]} | "
+        f"{source_bytes // 1024} KB → {len(data) // 1024} KB | "
+        f"~токены {legacy_tokens} → {tokens} (−{max(0, legacy_tokens - tokens)})"
+    )
+
+
+@dataclass
+class PreparedImage:
+    """Результат подготовки файла: JPEG для модели + вердикт локальной проверки"""
+    data: Optional[bytes]
+    preflight: PreflightResult
+    is_document: bool
+
+
+def _stream_size(buf: BinaryIO) -> int:
+    pos = buf.tell()
+    size = buf.seek(0, io.SEEK_END)
+    buf.seek(pos)
+    return size
+
+
+def _pdf_content_clip(page: "fitz.Page") -> "fitz.Rect":
+    """
+    Область страницы с содержимым (без белых полей) — по черновому рендеру,
+    чтобы работало и для текста, и для сканов, вложенных картинкой.
+    """
+    rect = page.rect
+    preview_zoom = PDF_PREVIEW_DPI / 72
+    pix = page.get_pixmap(matrix=fitz.Matrix(preview_zoom, preview_zoom), colorspace=fitz.csGRAY, alpha=False)
+    bbox = _content_bbox(Image.frombytes("L", (pix.width, pix.height), pix.samples))
+    if not bbox:
+        return rect
+    left, top, right, bottom = (v / preview_zoom for v in bbox)
+    clip = fitz.Rect(
+        rect.x0 + left - PDF_CLIP_PADDING, rect.y0 + top - PDF_CLIP_PADDING,
+        rect.x0 + right + PDF_CLIP_PADDING, rect.y0 + bottom + PDF_CLIP_PADDING,
+    ) & rect
+    return rect if clip.is_empty else clip
+
+
+def _process_pdf_sync(buf: BinaryIO, policy: ImagePolicy) -> Optional[PreparedImage]:
+    """
+    Синхронная обработка PDF (выполняется в отдельном потоке).
+    Поля первой страницы отрезаются еще до рендера: содержимое рендерится сразу
+    в пиксмап целевого размера (текст получается максимально крупным) и кодируется в JPEG один раз.
+    """
     try:
-        doc = fitz.open(stream=buf, filetype="pdf")
-        if doc.page_count < 1:
-            doc.close()
-            return None
-        page = doc.load_page(0)
-        pix = page.get_pixmap(dpi=200)
-        img_data = pix.tobytes("jpg")
-        doc.close()
-        return Image.open(io.BytesIO(img_data))
+        source_bytes = _stream_size(buf)
+        with OCR_STAGE_SECONDS.time(stage="render"):
+            doc = fitz.open(stream=buf.read(), filetype="pdf")
+            try:
+                if doc.page_count < 1:
+                    return None
+                page = doc.load_page(0)
+                rect = page.rect
+                page_w, page_h = int(rect.width * PDF_MAX_DPI / 72), int(rect.height * PDF_MAX_DPI / 72)
+                clip = _pdf_content_clip(page) if policy.autocrop_documents else rect
+                clip_w, clip_h = int(clip.width * PDF_MAX_DPI / 72), int(clip.height * PDF_MAX_DPI / 72)
+                target_w, _ = policy.target_size(clip_w, clip_h)
+                zoom = (PDF_MAX_DPI / 72) * (target_w / max(clip_w, 1))
+                gray = policy.grayscale_documents
+                pix = page.get_pixmap(
+                    matrix=fitz.Matrix(zoom, zoom),
+                    clip=clip,
+                    colorspace=fitz.csGRAY if gray else fitz.csRGB,
+                    alpha=False,
+                )
+                img = Image.frombytes("L" if gray else "RGB", (pix.width, pix.height), pix.samples)
+            finally:
+                doc.close()
+
+        # PDF — всегда документ; проверка ловит только пустые/черные страницы
+        with OCR_STAGE_SECONDS.time(stage="preflight"):
+            check = preflight_image(img)
+        if not check.ok and check.reason in ("blank", "dark"):
+            return PreparedImage(data=None, preflight=check, is_document=True)
+        check = PreflightResult(ok=True, kind="document", metrics=check.metrics)
+
+        with OCR_STAGE_SECONDS.time(stage="encode"):
+            data, out_size = _finalize_sync(img, policy, is_document=True)
+        _log_image_report(source_bytes, (page_w, page_h), data, out_size, policy)
+        return PreparedImage(data=data, preflight=check, is_document=True)
     except Exception as e:
         logger.error(f"Error in _process_pdf_sync: {e}")
         return None
 
 
-def _process_image_sync(img: Image.Image) -> Optional[bytes]:
-    """Синхронная обработка изображения (выполняется в отдельном потоке)"""
+def _process_image_sync(buf: BinaryIO, policy: ImagePolicy, is_document: bool = False) -> Optional[PreparedImage]:
+    """
+    Синхронная обработка изображения (выполняется в отдельном потоке).
+    Для JPEG включаем draft-режим: декодер сразу уменьшает картинку в DCT-домене
+    (1/2, 1/4, 1/8), и полноразмерный растр в память не попадает.
+    is_document — подсказка из подписи; иначе тип определяет локальная проверка.
+    """
     try:
-        if img.mode != 'RGB':
-            img = img.convert('RGB')
-        
-        max_dim = 2048
-        if max(img.size) > max_dim:
-            img.thumbnail((max_dim, max_dim), Image.Resampling.LANCZOS)
-        
-        out_buf = io.BytesIO()
-        img.save(out_buf, format='JPEG', quality=85, optimize=True)
-        return out_buf.getvalue()
+        source_bytes = _stream_size(buf)
+        img = Image.open(buf)
+        source_size = img.size
+        if img.format == "JPEG":
+            img.draft("RGB", policy.target_size(*img.size))
+        # Защита от «бомб»: заголовок читается без декодирования, проверяем до load()
+        # (для JPEG — уже с учетом draft-уменьшения)
+        if img.width * img.height > MAX_IMAGE_PIXELS:
+            logger.warning(f"Image too large: {source_size[0]}x{source_size[1]}")
+            return _too_large(is_document)
+        with OCR_STAGE_SECONDS.time(stage="decode"):
+            img.load()
+
+        with OCR_STAGE_SECONDS.time(stage="preflight"):
+            check = preflight_image(img)
+        if not check.ok:
+            return PreparedImage(data=None, preflight=check, is_document=is_document or check.is_document)
+
+        is_document = is_document or check.is_document
+        with OCR_STAGE_SECONDS.time(stage="encode"):
+            data, out_size = _finalize_sync(img, policy, is_document)
+        _log_image_report(source_bytes, source_size, data, out_size, policy)
+        return PreparedImage(data=data, preflight=check, is_document=is_document)
+    except Image.DecompressionBombError as e:
+        logger.warning(f"Decompression bomb rejected: {e}")
+        return _too_large(is_document)
     except Exception as e:
         logger.error(f"Error in _process_image_sync: {e}")
         return None
 
 
-async def _prepare_file(message: Message, file_id: str, is_pdf: bool = False) -> Optional[bytes]:
-    """Асинхронная подготовка файла с неблокирующей обработкой"""
+async def _image_policy_for_user(user_id: int) -> ImagePolicy:
+    if _VISION_CONFIG:
+        try:
+            cfg = await _VISION_CONFIG(user_id)
+            if cfg.image:
+                return cfg.image
+        except Exception as e:
+            logger.error(f"Error in _image_policy_for_user: {e}")
+    return ImagePolicy()
+
+
+def _too_large(is_document: bool) -> PreparedImage:
+    check = PreflightResult(ok=False, kind="document" if is_document else "photo", reason="too_large")
+    return PreparedImage(data=None, preflight=check, is_document=is_document)
+
+
+async def _prepare_file(
+    message: Message, file_id: str, is_pdf: bool = False, is_document: bool = False
+) -> Optional[PreparedImage]:
+    """
+    Асинхронная подготовка файла с неблокирующей обработкой.
+    Файл качается потоком в spooled-буфер с лимитом размера; объем «в полете»
+    на весь процесс ограничен общим бюджетом памяти (upload_budget).
+    """
     try:
+        policy = await _image_policy_for_user(message.from_user.id)
         file_info = await message.bot.get_file(file_id)
-        buf = io.BytesIO()
-        await message.bot.download_file(file_info.file_path, buf)
-        buf.seek(0)
-
-        if is_pdf:
-            # PDF обработка в отдельном потоке
-            img = await asyncio.to_thread(_process_pdf_sync, buf)
-            if not img:
-                return None
-        else:
-            # Открытие изображения в отдельном потоке
-            img = await asyncio.to_thread(Image.open, buf)
-        
-        # Обработка изображения в отдельном потоке
-        result = await asyncio.to_thread(_process_image_sync, img)
-        return result
+        declared = file_info.file_size or 0
+        if declared > MAX_DOWNLOAD_BYTES:
+            return _too_large(is_document or is_pdf)
+
+        async with upload_budget.reserve(declared or SPOOL_MAX_MEMORY):
+            try:
+                with span("ocr.download", declared_kb=declared // 1024), OCR_STAGE_SECONDS.time(stage="download"):
+                    spool = await download_to_spool(message.bot, file_info.file_path)
+            except FileTooLarge:
+                return _too_large(is_document or is_pdf)
+
+            with spool:
+                # Декодирование, проверка и кодирование целиком в отдельном потоке (один переход в пул)
+                if is_pdf:
+                    with span("ocr.process_pdf"):
+                        return await asyncio.to_thread(_process_pdf_sync, spool, policy)
+                with span("ocr.process_image"):
+                    return await asyncio.to_thread(_process_image_sync, spool, policy, is_document)
 
     except Exception as e:
         logger.error(f"Error in _prepare_file: {e}")
         return None
 
-# --- Хендлеры ---
 
-@router.message(F.photo)
-async def on_photo(message: Message):
-    # 1. НОВАЯ ЛОГИКА ПРОВЕРКИ ДОСТУПА (Trial -> Подписка -> Balance)
+# --- Доступ (Trial -> Подписка -> Balance) ---
+
+def _photo_limits() -> dict:
+    return {"free": FREE_PHOTOS_PER_MONTH, "plus": PLUS_PHOTOS_PER_MONTH, "pro": PRO_PHOTOS_PER_MONTH}
+
+
+async def _check_access(message: Message, consume: bool) -> Optional[str]:
+    """
+    Проверяет (и при consume=True списывает) право на разбор одного снимка.
+    Возвращает источник доступа: 'admin' | 'trial' | 'subscription' | 'balance',
+    либо None, если пользователю уже ответили отказом.
+    """
     user_id = message.from_user.id
-    if user_id not in ADMIN_IDS:
-        # Проверка 1: Trial (первый раз бесплатно)
-        is_trial = not await st.is_trial_used(user_id)
-        if is_trial:
+    if user_id in ADMIN_IDS:
+        return "admin"
+
+    # Проверка 1: Trial (первый раз бесплатно)
+    if not await st.is_trial_used(user_id):
+        if consume:
             await st.mark_trial_used(user_id)
-            # Пропускаем дальше без проверок
-        else:
-            # Проверка 2: Активная подписка
-            has_sub = await st.has_active_subscription(user_id)
-            if has_sub:
-                # Проверяем месячные лимиты подписки
-                photo_limits = {"free": FREE_PHOTOS_PER_MONTH, "plus": PLUS_PHOTOS_PER_MONTH, "pro": PRO_PHOTOS_PER_MONTH}
-                chk = await st.check_photo_limits(user_id, message.from_user.username or "Unknown", photo_limits, consume=False)
-                if not chk["allowed"]:
-                    await message.answer(
-                        "⛔ Лимит фото/документов на этот месяц исчерпан.\n\n"
-                        "Чтобы продолжить разбор снимков и анализов, подключите тариф PLUS/PRO: /buy"
-                    )
-                    return
-                # Списываем месячный лимит
-                await st.check_photo_limits(user_id, message.from_user.username or "Unknown", photo_limits, consume=True)
-            else:
-                # Проверка 3: Balance (разовые покупки)
-                balance = await st.get_user_balance_analyses(user_id)
-                if balance > 0:
-                    # Списываем 1 единицу баланса
-                    await st.decrement_balance_analyses(user_id)
-                else:
-                    # Нет баланса - предлагаем купить
-                    from aiogram.utils.keyboard import InlineKeyboardBuilder
-                    kb = InlineKeyboardBuilder()
-                    kb.button(text="📄 Купить 1 разбор (99₽)", callback_data="pay:create:one_time_analysis")
-                    kb.button(text="💙 Подписка PLUS (299₽/мес)", callback_data="pay:create:plus")
-                    kb.button(text="💜 Подписка PRO (590₽/мес)", callback_data="pay:create:pro")
-                    kb.adjust(1)
-                    await message.answer(
-                        "⛔ У вас нет доступных расшифровок.\n\n"
-                        "Выберите вариант оплаты:",
-                        reply_markup=kb.as_markup()
-                    )
-                    return
+        return "trial"
+
+    # Проверка 2: Активная подписка (месячный лимит)
+    if await st.has_active_subscription(user_id):
+        username = message.from_user.username or "Unknown"
+        chk = await st.check_photo_limits(user_id, username, _photo_limits(), consume=consume)
+        if not chk["allowed"]:
+            await message.answer(
+                "⛔ Лимит фото/документов на этот месяц исчерпан.\n\n"
+                "Чтобы продолжить разбор снимков и анализов, подключите тариф PLUS/PRO: /buy"
+            )
+            return None
+        return "subscription"
+
+    # Проверка 3: Balance (разовые покупки)
+    if consume:
+        if await st.decrement_balance_analyses(user_id):
+            return "balance"
+    elif await st.get_user_balance_analyses(user_id) > 0:
+        return "balance"
+
+    # Нет баланса - предлагаем купить
+    from aiogram.utils.keyboard import InlineKeyboardBuilder
+    kb = InlineKeyboardBuilder()
+    kb.button(text="📄 Купить 1 разбор (99₽)", callback_data="pay:create:one_time_analysis")
+    kb.button(text="💙 Подписка PLUS (299₽/мес)", callback_data="pay:create:plus")
+    kb.button(text="💜 Подписка PRO (590₽/мес)", callback_data="pay:create:pro")
+    kb.adjust(1)
+    await message.answer(
+        "⛔ У вас нет доступных расшифровок.\n\n"
+        "Выберите вариант оплаты:",
+        reply_markup=kb.as_markup()
+    )
+    return None
+
+
+async def _reject_unusable(status_msg: Message, prepared: PreparedImage):
+    """Отказ по итогам локальной проверки — лимит не списывается"""
+    logger.info(f"🚫 Preflight: {prepared.preflight.reason} {prepared.preflight.metrics}")
+    reason = REJECT_MESSAGES.get(prepared.preflight.reason, "❌ Снимок не подходит для разбора.")
+    if prepared.preflight.reason == "too_large":
+        hint = "Лимит не списан. Пришлите фото или скриншот документа вместо исходного файла."
+    else:
+        hint = "Лимит не списан. Переснимите при хорошем освещении, держа камеру ровно, и пришлите еще раз."
+    await status_msg.edit_text(f"{reason}\n\n{hint}")
+
+
+# --- Хендлеры ---
+
+PHOTO_PROMPT = (
+    "Это изображение от владельца животного (симптом или документ). "
+    "1. Если это анализы — выдели показатели, которые НЕ в норме для этого вида животного. "
+    "2. Если это фото питомца — опиши, что видишь (травма, воспаление, стул) и насколько это выглядит опасно. "
+    "3. НЕ ставь диагноз, но подскажи, нужен ли очный врач срочно."
+)
+
+DOCUMENT_PROMPT = (
+    "Интерпретируй результаты анализов из этого ветеринарного документа. "
+    "Используй систему 'Светофор' для оценки показателей: 🔴 критично, 🟡 погранично, 🟢 норма. "
+    "Начни с краткого резюме, затем детальный разбор с эмодзи, и рекомендации."
+)
+
+
+def _caption_says_analysis(caption: Optional[str]) -> bool:
+    return "анализ" in (caption or "").lower()
+
+
+async def _process_uploads(
+    message: Message, items: list[AlbumItem], is_document_upload: bool, access: Optional[str] = None
+):
+    """
+    Общий конвейер для одиночного файла и альбома:
+    доступ (без списания) -> параллельная загрузка и проверка -> одно списание -> один ответ.
+    Альбом целиком стоит одну единицу лимита.
+    access — результат только что выполненной проверки (без очереди); None — проверить заново.
+    """
+    # 1. Предварительная проверка доступа (без списания); в воркере — повторно, с постановки прошло время
+    if access is None and not await _check_access(message, consume=False):
+        return
 
     # 2. Основная логика
     if not _ANSWER_CALLBACK: return
-    
+
     # Индикация загрузки
-    await message.bot.send_chat_action(message.chat.id, "upload_photo")
-    status_msg = await message.reply("🔎 Загружаю и обрабатываю изображение...")
-    
-    img_bytes = await _prepare_file(message, message.photo[-1].file_id, is_pdf=False)
-    
-    if img_bytes:
-        # Обновляем статус
-        await status_msg.edit_text("🔎 Анализирую снимок...")
-        
-        # ВЕТЕРИНАРНЫЙ ПРОМПТ ДЛЯ ФОТО
-        caption = message.caption or (
-            "Это изображение от владельца животного (симптом или документ). "
-            "1. Если это анализы — выдели показатели, которые НЕ в норме для этого вида животного. "
-            "2. Если это фото питомца — опиши, что видишь (травма, воспаление, стул) и насколько это выглядит опасно. "
-            "3. НЕ ставь диагноз, но подскажи, нужен ли очный врач срочно."
+    await message.bot.send_chat_action(message.chat.id, "upload_document" if is_document_upload else "upload_photo")
+    if is_document_upload:
+        status_msg = await message.reply("📄 Загружаю и обрабатываю документ...")
+    elif len(items) > 1:
+        status_msg = await message.reply(f"🔎 Загружаю и обрабатываю {len(items)} изображения...")
+    else:
+        status_msg = await message.reply("🔎 Загружаю и обрабатываю изображение...")
+
+    user_caption = next((i.caption for i in items if i.caption), None)
+    hint = _caption_says_analysis(user_caption)
+    with span("ocr.prepare", files=len(items)):
+        results = await asyncio.gather(
+            *(_prepare_file(message, i.file_id, is_pdf=i.is_pdf, is_document=hint) for i in items)
         )
-        
-        # Определяем, это анализ или фото симптома (по caption или по умолчанию - фото симптома)
-        is_analysis = "анализ" in (message.caption or "").lower() or "анализы" in (message.caption or "").lower()
-        
+    usable = [r for r in results if r and r.preflight.ok]
+    if not usable:
+        rejected = next((r for r in results if r), None)
+        if rejected:
+            await _reject_unusable(status_msg, rejected)
+        else:
+            await status_msg.edit_text("❌ Не удалось прочитать файл. Попробуйте прислать фото или скриншот.")
+        return
+
+    # 3. Списываем лимит только за пригодные снимки (альбом — одно списание)
+    if not await _check_access(message, consume=True):
+        await status_msg.delete()
+        return
+
+    # Обновляем статус
+    skipped = len(items) - len(usable)
+    status_text = "🔎 Анализирую документ..." if is_document_upload else "🔎 Анализирую снимок..."
+    if skipped:
+        status_text += f"\n(пропущено нечитаемых снимков: {skipped})"
+    await status_msg.edit_text(status_text)
+
+    # Тип снимка (анализы или фото симптома) определила локальная проверка
+    is_analysis = any(r.is_document for r in usable)
+    caption = user_caption or (DOCUMENT_PROMPT if is_analysis else PHOTO_PROMPT)
+    if len(usable) > 1:
+        caption += f"\n\n(Это {len(usable)} страницы/снимка одного обращения — разбери их вместе.)"
+    images = [r.data for r in usable]
+
+    try:
+        await _ANSWER_CALLBACK(message, caption, images if len(images) > 1 else images[0], is_analysis_document=is_analysis)
+    finally:
+        # Удаляем статус-сообщение после обработки
         try:
-            await _ANSWER_CALLBACK(message, caption, img_bytes, is_analysis_document=is_analysis)
-        finally:
-            # Удаляем статус-сообщение после обработки
-            try:
-                await status_msg.delete()
-            except Exception as e:
-                logger.error(f"Error in on_photo status cleanup: {e}")
+            await status_msg.delete()
+        except Exception as e:
+            logger.error(f"Error in _process_uploads status cleanup: {e}")
+
+
+async def _collect_items(message: Message, item: AlbumItem) -> Optional[list[AlbumItem]]:
+    """Одиночный файл — сразу в работу; часть альбома — ждем остальные части"""
+    if not message.media_group_id:
+        return [item]
+    try:
+        return await albums.collect(message.chat.id, message.media_group_id, item)
+    except Exception as e:
+        # Redis недоступен — лучше разобрать часть отдельно, чем потерять
+        logger.error(f"Error in _collect_items: {e}")
+        return [item]
+
+
+def _user_queue(message: Message):
+    """
+    Части альбома проходят мимо очереди пользователя (UserLockMiddleware), поэтому владелец
+    собранного альбома встает в нее сам: проверка доступа и списание не пересекутся
+    с одиночными фото, текстом и другими альбомами этого пользователя.
+    """
+    if message.media_group_id:
+        return hold_user_lock(message.from_user.id)
+    return nullcontext()
+
+
+async def _handle_uploads(message: Message, items: list[AlbumItem], is_document_upload: bool):
+    """
+    Отказы (нет доступа, перегрузка) — сразу и без списания. Дальше конвейер
+    выполняется здесь же или, с очередью заданий, в воркере.
+    """
+    access = await _check_access(message, consume=False)
+    if not access:
+        return
+    # Пробный разбор — бесплатный тариф; подписка и разовые покупки обслуживаются всегда
+    if await admission.shed(message, paid=access != "trial"):
+        return
+
+    if not job_queue.JOB_QUEUE_ENABLED:
+        async with admission.track("uploads"):
+            await _process_uploads(message, items, is_document_upload, access=access)
+        return
+    try:
+        await job_queue.enqueue(
+            "uploads", message, items=[asdict(i) for i in items], is_document_upload=is_document_upload
+        )
+    except job_queue.QueueFull:
+        await message.reply(admission.BUSY_TEXT)
+        return
+    except Exception as e:
+        logger.error(f"Error in _handle_uploads enqueue: {e}")
+        async with admission.track("uploads"):
+            await _process_uploads(message, items, is_document_upload, access=access)
+        return
+    await message.bot.send_chat_action(message.chat.id, "upload_document" if is_document_upload else "upload_photo")
+
+
+async def run_uploads_job(message: Message, items: list[dict], is_document_upload: bool):
+    """Задание очереди: тот же конвейер, что и без очереди, но в процессе воркера"""
+    async with admission.track("uploads"):
+        await _process_uploads(message, [AlbumItem(**i) for i in items], is_document_upload)
+
+
+@router.message(F.photo)
+async def on_photo(message: Message):
+    item = AlbumItem(message_id=message.message_id, file_id=message.photo[-1].file_id, caption=message.caption)
+    items = await _collect_items(message, item)
+    if not items:
+        return
+    async with _user_queue(message):
+        await _handle_uploads(message, items, is_document_upload=False)
+
 
 @router.message(F.document)
 async def on_document(message: Message):
@@ -179,79 +528,12 @@ async def on_document(message: Message):
         await message.reply("Я понимаю только картинки (JPG/PNG) и PDF документы.")
         return
 
-    # 2. НОВАЯ ЛОГИКА ПРОВЕРКИ ДОСТУПА (Trial -> Подписка -> Balance)
-    user_id = message.from_user.id
-    if user_id not in ADMIN_IDS:
-        # Проверка 1: Trial (первый раз бесплатно)
-        is_trial = not await st.is_trial_used(user_id)
-        if is_trial:
-            await st.mark_trial_used(user_id)
-            # Пропускаем дальше без проверок
-        else:
-            # Проверка 2: Активная подписка
-            has_sub = await st.has_active_subscription(user_id)
-            if has_sub:
-                # Проверяем месячные лимиты подписки
-                photo_limits = {"free": FREE_PHOTOS_PER_MONTH, "plus": PLUS_PHOTOS_PER_MONTH, "pro": PRO_PHOTOS_PER_MONTH}
-                chk = await st.check_photo_limits(user_id, message.from_user.username or "Unknown", photo_limits, consume=False)
-                if not chk["allowed"]:
-                    await message.answer(
-                        "⛔ Лимит фото/документов на этот месяц исчерпан.\n\n"
-                        "Чтобы продолжить разбор снимков и анализов, подключите тариф PLUS/PRO: /buy"
-                    )
-                    return
-                # Списываем месячный лимит
-                await st.check_photo_limits(user_id, message.from_user.username or "Unknown", photo_limits, consume=True)
-            else:
-                # Проверка 3: Balance (разовые покупки)
-                balance = await st.get_user_balance_analyses(user_id)
-                if balance > 0:
-                    # Списываем 1 единицу баланса
-                    await st.decrement_balance_analyses(user_id)
-                else:
-                    # Нет баланса - предлагаем купить
-                    from aiogram.utils.keyboard import InlineKeyboardBuilder
-                    kb = InlineKeyboardBuilder()
-                    kb.button(text="📄 Купить 1 разбор (99₽)", callback_data="pay:create:one_time_analysis")
-                    kb.button(text="💙 Подписка PLUS (299₽/мес)", callback_data="pay:create:plus")
-                    kb.button(text="💜 Подписка PRO (590₽/мес)", callback_data="pay:create:pro")
-                    kb.adjust(1)
-                    await message.answer(
-                        "⛔ У вас нет доступных расшифровок.\n\n"
-                        "Выберите вариант оплаты:",
-                        reply_markup=kb.as_markup()
-                    )
-                    return
-
-    # 3. Основная логика
-    if not _ANSWER_CALLBACK: return
-
-    # Индикация загрузки
-    await message.bot.send_chat_action(message.chat.id, "upload_document")
-    status_msg = await message.reply("📄 Загружаю и обрабатываю документ...")
-    
-    img_bytes = await _prepare_file(message, message.document.file_id, is_pdf=is_pdf)
-    
-    if img_bytes:
-        # Обновляем статус
-        await status_msg.edit_text("🔎 Анализирую документ...")
-        
-        caption = message.caption or (
-            "Интерпретируй результаты анализов из этого ветеринарного документа. "
-            "Используй систему 'Светофор' для оценки показателей: 🔴 критично, 🟡 погранично, 🟢 норма. "
-            "Начни с краткого резюме, затем детальный разбор с эмодзи, и рекомендации."
-        )
-        
-        # Документы (PDF/изображения документов) всегда считаются анализами
-        is_analysis = True
-        
-        try:
-            await _ANSWER_CALLBACK(message, caption, img_bytes, is_analysis_document=is_analysis)
-        finally:
-            # Удаляем статус-сообщение после обработки
-            try:
-                await status_msg.delete()
-            except Exception as e:
-                logger.error(f"Error in on_document status cleanup: {e}")
-    else:
-        await status_msg.edit_text("❌ Не удалось прочитать файл. Попробуйте прислать фото или скриншот.")
\ No newline at end of file
+    # PDF — всегда анализы; картинку-файл классифицирует локальная проверка
+    item = AlbumItem(
+        message_id=message.message_id, file_id=message.document.file_id, is_pdf=is_pdf, caption=message.caption
+    )
+    items = await _collect_items(message, item)
+    if not items:
+        return
+    async with _user_queue(message):
+        await _handle_uploads(message, items, is_document_upload=True)
@@ -1,30 +1,39 @@
-# handlers/pay.py — Реальная подписка через YooKassa (polling без вебхуков)
+# handlers/pay.py — Реальная подписка через YooKassa (вебхук + сверка)
 
-from datetime import datetime, timedelta
 import os
 import asyncio
 import logging
+from datetime import datetime, timedelta, timezone
+from typing import Optional
 
 from aiogram import Router, F, Bot
 from aiogram.types import Message, CallbackQuery
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.filters import Command
 from dotenv import load_dotenv
-from yookassa import Configuration, Payment
 
 import storage as st
+from services.payments import activate_payments_batch
+from services.payment_tracker import track_payment
+from services.yookassa_client import get_yookassa, is_configured
+from services.leader import fencing_token
 
 router = Router()
 logger = logging.getLogger("VetBot.Pay")
 
 load_dotenv()
 YOOKASSA_SHOP_ID = os.getenv("YOOKASSA_SHOP_ID")
-YOOKASSA_SECRET_KEY = os.getenv("YOOKASSA_SECRET_KEY") or os.getenv("YOOKASSA_TOKEN")
 YOOKASSA_RETURN_URL = os.getenv("YOOKASSA_RETURN_URL", "https://t.me")
-
-if YOOKASSA_SHOP_ID and YOOKASSA_SECRET_KEY:
-    Configuration.account_id = YOOKASSA_SHOP_ID
-    Configuration.secret_key = YOOKASSA_SECRET_KEY
+# Вебхук активирует сразу, сверка нужна только как страховка
+YOOKASSA_RECONCILE_INTERVAL = int(os.getenv("YOOKASSA_RECONCILE_INTERVAL", "600"))
+# Окно назад от курсора: платеж создан раньше, а succeeded стал позже
+YOOKASSA_RECONCILE_LOOKBACK = int(os.getenv("YOOKASSA_RECONCILE_LOOKBACK", "7200"))
+# Глубина первой сверки, когда курсора еще нет
+YOOKASSA_RECONCILE_FIRST_RUN_HOURS = int(os.getenv("YOOKASSA_RECONCILE_FIRST_RUN_HOURS", "24"))
+YOOKASSA_RECONCILE_PAGE_SIZE = 100
+RECONCILE_CURSOR_KEY = "yookassa:reconcile_cursor"
+
+if is_configured():
     logger.info("💳 YOOKASSA: конфигурация загружена, shop_id=%s", YOOKASSA_SHOP_ID)
 else:
     logger.warning("💳 YOOKASSA: нет SHOP_ID/SECRET_KEY, оплата не будет работать.")
@@ -66,7 +75,7 @@ async def cmd_buy(event):
 
 @router.callback_query(lambda c: c.data and c.data.startswith("pay:create:"))
 async def process_real_pay(cq: CallbackQuery):
-    if not (YOOKASSA_SHOP_ID and YOOKASSA_SECRET_KEY):
+    if not is_configured():
         await cq.answer("Оплата временно недоступна. Попробуйте позже.", show_alert=True)
         return
 
@@ -113,13 +122,19 @@ async def process_real_pay(cq: CallbackQuery):
     }
 
     try:
-        payment = await asyncio.to_thread(Payment.create, payment_data)
+        # Ключ от id нажатия: повтор запроса по этому нажатию не создаст второй платеж
+        payment = await get_yookassa().create_payment(payment_data, idempotence_key=f"tg-{cq.id}")
+        pay_url = payment["confirmation"]["confirmation_url"]
     except Exception as e:
         logger.error("YOOKASSA create error: %r", e)
         await cq.answer("Ошибка при создании платежа. Попробуйте позже.", show_alert=True)
         return
 
-    pay_url = payment.confirmation.confirmation_url
+    try:
+        await track_payment(payment["id"], user_id, tier)
+    except Exception as e:
+        # Не критично: платеж все равно активирует вебхук или сверка
+        logger.error("Pending payment track error: %r", e)
 
     if plan == "one_time_analysis":
         text = (
@@ -133,7 +148,7 @@ async def process_real_pay(cq: CallbackQuery):
             f"💳 *Оплата тарифа {plan_name}*\n\n"
             f"Сумма: *{amount} ₽* за 30 дней.\n\n"
             "Нажмите кнопку ниже, чтобы перейти на страницу оплаты.\n"
-            "После успешной оплаты доступ подключится автоматически в течение нескольких минут."
+            "После успешной оплаты доступ подключится автоматически."
         )
 
     kb = InlineKeyboardBuilder()
@@ -144,81 +159,64 @@ async def process_real_pay(cq: CallbackQuery):
     await cq.answer()
 
 
-async def yookassa_polling_loop(bot: Bot, poll_interval: int = 60):
+def _parse_yk_time(value: str) -> Optional[datetime]:
+    """'2024-05-01T12:00:00.000Z' -> aware datetime (UTC)"""
+    try:
+        return datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except Exception:
+        return None
+
+
+def _format_yk_time(dt: datetime) -> str:
+    return dt.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+
+
+async def reconcile_once(bot: Bot) -> int:
+    """
+    Один проход сверки: только платежи с created_at >= курсор - LOOKBACK,
+    все страницы по next_cursor, дедупликация одним запросом на страницу.
+    Курсор (максимальный created_at) сохраняется в bot_state после прохода.
+    """
+    now = datetime.now(timezone.utc)
+    stored = _parse_yk_time(await st.get_bot_state(RECONCILE_CURSOR_KEY) or "")
+    cursor = stored or (now - timedelta(hours=YOOKASSA_RECONCILE_FIRST_RUN_HOURS))
+    # Платеж мог перейти в succeeded позже, чем был создан — берем окно назад
+    since = cursor - timedelta(seconds=YOOKASSA_RECONCILE_LOOKBACK)
+
+    params = {"status": "succeeded", "limit": YOOKASSA_RECONCILE_PAGE_SIZE, "created_at.gte": _format_yk_time(since)}
+    newest = cursor
+    activated = 0
+    pages = 0
+    async for items in get_yookassa().iter_payment_pages(params):
+        pages += 1
+        activated += await activate_payments_batch(bot, items)
+        for payment in items:
+            created = _parse_yk_time(payment.get("created_at") or "")
+            if created and created > newest:
+                newest = created
+
+    # Курсор не должен «убегать» вперед реального времени
+    if not await st.set_bot_state(RECONCILE_CURSOR_KEY, _format_yk_time(min(newest, now)), fence=fencing_token()):
+        logger.warning("💳 YOOKASSA: курсор сверки уже записан новым лидером, пропускаем")
+    if activated:
+        logger.info("💳 YOOKASSA: сверкой активировано %s платеж(ей) (вебхук не дошел), страниц: %s", activated, pages)
+    return activated
+
+
+async def yookassa_polling_loop(bot: Bot, poll_interval: int = YOOKASSA_RECONCILE_INTERVAL):
     """
-    Опрашивает YooKassa и активирует подписки по успешным платежам.
-    Это упрощает запуск на VPS: не нужны вебхуки/HTTPS.
+    Сверка с YooKassa: основной канал активации — вебхук (services/yookassa_webhook.py),
+    а этот цикл раз в poll_interval добирает платежи, уведомления о которых потерялись.
     """
-    if not (YOOKASSA_SHOP_ID and YOOKASSA_SECRET_KEY):
+    if not is_configured():
         logger.warning("💳 YOOKASSA: нет ключей, polling отключён.")
         return
 
-    logger.info("💳 YOOKASSA: polling каждые %s сек.", poll_interval)
+    logger.info("💳 YOOKASSA: сверка каждые %s сек.", poll_interval)
 
     while True:
         try:
-            payments = await asyncio.to_thread(Payment.list, {"status": "succeeded", "limit": 50})
-            for payment in getattr(payments, "items", []):
-                metadata = getattr(payment, "metadata", None) or {}
-                user_id = metadata.get("user_id")
-                tier = metadata.get("tier") or metadata.get("plan")
-                payment_id = getattr(payment, "id", None)
-                created_at = getattr(payment, "created_at", "")
-                payment_status = getattr(payment, "status", "succeeded")
-                payment_amount_obj = getattr(payment, "amount", None)
-                payment_amount = None
-                if payment_amount_obj is not None:
-                    try:
-                        payment_amount = float(getattr(payment_amount_obj, "value", 0) or 0)
-                    except Exception:
-                        payment_amount = None
-
-                if not user_id or not tier or not payment_id:
-                    continue
-
-                is_new = await st.mark_yookassa_payment_processed(
-                    str(payment_id),
-                    int(user_id),
-                    str(tier),
-                    str(created_at),
-                    amount=payment_amount,
-                    status=str(payment_status),
-                )
-                if not is_new:
-                    continue
-
-                # Обработка разовой покупки
-                if str(tier) == "one_time_analysis":
-                    await st.increment_balance_analyses(int(user_id), 1)
-                    try:
-                        text = (
-                            f"🎉 *Покупка успешна!*\n\n"
-                            f"Вам начислена *1 расшифровка* анализов.\n"
-                            f"Используйте её, отправив фото или документ с анализами.\n\n"
-                            "Спасибо за поддержку!"
-                        )
-                        await bot.send_message(int(user_id), text, parse_mode="Markdown")
-                    except Exception as e_send:
-                        logger.warning("Не удалось отправить уведомление: %r", e_send)
-                    continue
-
-                # Обработка подписки
-                end_dt = (datetime.now() + timedelta(days=30)).replace(microsecond=0)
-                await st.set_user_paid(int(user_id), end_dt.isoformat(), str(tier))
-
-                plan_name = "PRO 💜" if str(tier) == "pro" else "PLUS 💙"
-                try:
-                    text = (
-                        f"🎉 *Подписка активирована!*\n\n"
-                        f"Тариф: *{plan_name}*\n"
-                        f"Доступ активен до: *{end_dt.strftime('%Y-%m-%d')}*\n\n"
-                        "Спасибо за поддержку — это помогает развивать бота."
-                    )
-                    await bot.send_message(int(user_id), text, parse_mode="Markdown")
-                except Exception as e_send:
-                    logger.warning("Не удалось отправить уведомление: %r", e_send)
-
-            await asyncio.sleep(poll_interval)
+            await reconcile_once(bot)
         except Exception as e:
             logger.error("💳 YOOKASSA polling error: %r", e)
-            await asyncio.sleep(poll_interval)
\ No newline at end of file
+        await asyncio.sleep(poll_interval)
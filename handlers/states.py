@@ -20,6 +20,7 @@ class AdminPromoState(StatesGroup):
 class AdminBroadcastState(StatesGroup):
     """Состояния для рассылки админом"""
     waiting_for_content = State()
+    waiting_for_audience = State()
     waiting_for_confirm = State()
 
 
@@ -0,0 +1,178 @@
+# middlewares/antiflood_middleware.py — АНТИФЛУД: ВЕДРО ТОКЕНОВ В REDIS НА ПОЛЬЗОВАТЕЛЯ И ТИП АПДЕЙТА
+
+import logging
+import os
+from typing import Any, Awaitable, Callable, Optional
+
+from aiogram import BaseMiddleware, Dispatcher
+from aiogram.types import Update
+
+from services.metrics import Counter
+from services.redis_client import get_redis
+
+logger = logging.getLogger("VetBot.Antiflood")
+
+ADMIN_IDS = [int(x) for x in os.getenv("ADMIN_IDS", "").split(",") if x.strip().isdigit()]
+
+ANTIFLOOD_ENABLED = os.getenv("ANTIFLOOD_ENABLED", "1") == "1"
+# Лимиты в формате N/SEC: не больше N апдейтов за SEC секунд (всплеском — сразу N)
+_DEFAULT_LIMITS = {
+    ("text", "free"): "6/60",
+    ("text", "paid"): "20/60",
+    ("photo", "free"): "4/60",
+    ("photo", "paid"): "15/60",
+    ("callback", "free"): "30/60",
+    ("callback", "paid"): "60/60",
+}
+# Как часто напоминать пользователю, что он упирается в лимит, сек
+ANTIFLOOD_NOTICE_EVERY = int(os.getenv("ANTIFLOOD_NOTICE_EVERY", "30"))
+# Сколько помним тариф пользователя (его пишет LoggingMiddleware), сек
+_TIER_TTL = 3600
+
+DROPPED_TOTAL = Counter("antiflood_dropped_total", "Апдейты, отброшенные антифлудом", ("kind", "tier"))
+CACHE_LOOKUPS_TOTAL = Counter("cache_lookups_total", "Обращения к кэшам в Redis", ("cache", "result"))
+
+
+def _parse_limit(value: str) -> tuple[float, float]:
+    count, seconds = value.split("/")
+    return float(count), float(count) / float(seconds)
+
+
+def _load_limits() -> dict[tuple[str, str], tuple[float, float]]:
+    limits = {}
+    for (kind, tier), default in _DEFAULT_LIMITS.items():
+        raw = os.getenv(f"ANTIFLOOD_{kind.upper()}_{tier.upper()}", default)
+        try:
+            limits[(kind, tier)] = _parse_limit(raw)
+        except (ValueError, ZeroDivisionError):
+            logger.warning(f"🌊 Неверный лимит ANTIFLOOD_{kind.upper()}_{tier.upper()}={raw!r}, беру {default}")
+            limits[(kind, tier)] = _parse_limit(default)
+    return limits
+
+
+LIMITS = _load_limits()
+
+# KEYS[1] — ведро, KEYS[2] — тариф пользователя, KEYS[3] — альбом пользователя (пустой ключ, если не альбом)
+# ARGV: capacity/rate для free, capacity/rate для paid, TTL альбома
+# Возвращает {разрешено (1/0), тариф, тариф взят из кэша (1/0)}
+# Альбом: ведро проверяет первая часть, решение сохраняется — остальные части получают то же решение
+_TAKE = """
+local cached = redis.call('GET', KEYS[2])
+local tier = cached or 'free'
+local hit = cached and 1 or 0
+if KEYS[3] ~= '' then
+    local decided = redis.call('GET', KEYS[3])
+    if decided then
+        return {tonumber(decided), tier, hit}
+    end
+end
+local capacity, rate
+if tier == 'paid' then
+    capacity, rate = tonumber(ARGV[3]), tonumber(ARGV[4])
+else
+    capacity, rate = tonumber(ARGV[1]), tonumber(ARGV[2])
+end
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+if KEYS[3] ~= '' then
+    redis.call('SET', KEYS[3], allowed, 'NX', 'EX', ARGV[5])
+end
+return {allowed, tier, hit}
+"""
+
+
+def _kind(event: Update) -> Optional[str]:
+    if event.message:
+        if event.message.photo or event.message.document:
+            return "photo"
+        return "text"
+    if event.callback_query:
+        return "callback"
+    return None
+
+
+async def remember_tier(user_id: int, paid: bool):
+    """Запоминает тариф для антифлуда (без похода в БД на каждый апдейт)"""
+    try:
+        await get_redis().set(f"tier:{user_id}", "paid" if paid else "free", ex=_TIER_TTL)
+    except Exception as e:
+        logger.warning(f"🌊 Не удалось сохранить тариф {user_id}: {e}")
+
+
+class AntifloodMiddleware(BaseMiddleware):
+    """
+    Отбрасывает лишние апдейты до FSM, БД и AI: один вызов Lua-скрипта в Redis.
+    Альбом считается одним апдейтом. Если Redis недоступен — пропускаем (fail-open).
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[Update, dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: dict[str, Any]
+    ) -> Any:
+        user = data.get("event_from_user")
+        kind = _kind(event)
+        if user is None or kind is None or user.id in ADMIN_IDS:
+            return await handler(event, data)
+
+        media_group_id = event.message.media_group_id if event.message else None
+        free_capacity, free_rate = LIMITS[(kind, "free")]
+        paid_capacity, paid_rate = LIMITS[(kind, "paid")]
+        try:
+            allowed, tier, hit = await get_redis().eval(
+                _TAKE,
+                3,
+                f"flood:{user.id}:{kind}",
+                f"tier:{user.id}",
+                f"flood:album:{user.id}:{media_group_id}" if media_group_id else "",
+                free_capacity, free_rate, paid_capacity, paid_rate, 60,
+            )
+        except Exception as e:
+            logger.error(f"Error in AntifloodMiddleware: {e}")
+            return await handler(event, data)
+
+        CACHE_LOOKUPS_TOTAL.inc(cache="tier", result="hit" if int(hit) else "miss")
+        if int(allowed):
+            return await handler(event, data)
+
+        DROPPED_TOTAL.inc(kind=kind, tier=tier)
+        logger.info(f"🌊 Флуд: {user.id} ({tier}) — {kind} отброшен")
+        await self._notify(event, user.id)
+        return None
+
+    @staticmethod
+    async def _notify(event: Update, user_id: int):
+        """Одно предупреждение за ANTIFLOOD_NOTICE_EVERY секунд, остальные лишние апдейты молча"""
+        try:
+            if not await get_redis().set(f"flood:notice:{user_id}", 1, nx=True, ex=ANTIFLOOD_NOTICE_EVERY):
+                if event.callback_query:
+                    await event.callback_query.answer()
+                return
+            text = "⏳ Слишком много запросов подряд. Подождите немного и попробуйте снова."
+            if event.callback_query:
+                await event.callback_query.answer(text, show_alert=False)
+            elif event.message:
+                await event.message.answer(text)
+        except Exception as e:
+            logger.warning(f"🌊 Не удалось предупредить {user_id}: {e}")
+
+
+def setup_antiflood(dp: Dispatcher):
+    """Ставит антифлуд перед FSM-middleware диспетчера (и перед очередью пользователя)"""
+    if not ANTIFLOOD_ENABLED:
+        return
+    dp.update.outer_middleware.unregister(dp.fsm)
+    dp.update.outer_middleware(AntifloodMiddleware())
+    dp.update.outer_middleware(dp.fsm)
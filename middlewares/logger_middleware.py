@@ -8,6 +8,7 @@ from aiogram import BaseMiddleware
 from aiogram.types import Message, CallbackQuery, Update
 
 import storage as st
+from middlewares.antiflood_middleware import remember_tier
 
 logger = logging.getLogger("VetBot.UserAction")
 
@@ -99,6 +100,9 @@ class LoggingMiddleware(BaseMiddleware):
         
         # Получаем данные пользователя из базы
         user_data = await st.get_user_subscription(user_id)
+        if user_data and user_data.get("blocked_at"):
+            # Пользователь снова пишет — значит, бот разблокирован
+            await st.clear_user_blocked(user_id)
         if user_data:
             # Добавляем баланс анализов в словарь (создаем копию, чтобы не изменять оригинал)
             balance = await st.get_user_balance_analyses(user_id)
@@ -107,6 +111,8 @@ class LoggingMiddleware(BaseMiddleware):
         # Определяем тег и действие
         tag = _get_user_tag(user_data)
         action = _get_action(event)
+        # Тариф нужен антифлуду — он работает до БД
+        await remember_tier(user_id, paid=tag in ("[💎 SUB]", "[💰 1-TIME]"))
         
         # Логируем
         logger.info(f"👤 [ID:{user_id} | {tag}] -> {action}")
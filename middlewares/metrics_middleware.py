@@ -0,0 +1,78 @@
+# middlewares/metrics_middleware.py — МЕТРИКИ АПДЕЙТОВ: ПОТОК ПО ТИПАМ И ВРЕМЯ ХЕНДЛЕРОВ
+
+import time
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware, Dispatcher
+from aiogram.dispatcher.event.bases import UNHANDLED
+from aiogram.types import TelegramObject, Update
+
+from services.metrics import Counter, Histogram
+from services.query_stats import query_scope
+
+UPDATES_TOTAL = Counter("updates_total", "Апдейты по типам и итогу", ("type", "status"))
+UPDATE_SECONDS = Histogram("update_seconds", "Полная обработка апдейта (все middleware + хендлер)", ("type",))
+HANDLER_SECONDS = Histogram("handler_seconds", "Время хендлеров", ("event", "handler", "status"))
+
+
+class UpdateMetricsMiddleware(BaseMiddleware):
+    """
+    Считает апдейты, полное время обработки и SQL-запросы на апдейт
+    (внешний middleware, до антифлуда и очереди пользователя).
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[Update, dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: dict[str, Any]
+    ) -> Any:
+        kind = event.event_type or "update"
+        started = time.perf_counter()
+        status = "ok"
+        try:
+            with query_scope(kind):
+                result = await handler(event, data)
+            if result is UNHANDLED:
+                status = "unhandled"
+            return result
+        except BaseException:
+            status = "error"
+            raise
+        finally:
+            UPDATE_SECONDS.observe(time.perf_counter() - started, type=kind)
+            UPDATES_TOTAL.inc(type=kind, status=status)
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Время конкретного хендлера (внутренний middleware: хендлер уже выбран фильтрами)"""
+
+    def __init__(self, event_name: str):
+        self.event_name = event_name
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any]
+    ) -> Any:
+        handler_obj = data.get("handler")
+        name = getattr(getattr(handler_obj, "callback", None), "__name__", "unknown")
+        started = time.perf_counter()
+        status = "ok"
+        try:
+            return await handler(event, data)
+        except BaseException:
+            status = "error"
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - started, event=self.event_name, handler=name, status=status)
+
+
+def setup_metrics(dp: Dispatcher):
+    """Счетчик апдейтов — первым из наших middleware; время хендлеров — на всех событиях (наследуется роутерами)"""
+    dp.update.outer_middleware.unregister(dp.fsm)
+    dp.update.outer_middleware(UpdateMetricsMiddleware())
+    dp.update.outer_middleware(dp.fsm)
+    for name in ("message", "callback_query"):
+        dp.observers[name].middleware(HandlerMetricsMiddleware(name))
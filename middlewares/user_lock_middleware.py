@@ -0,0 +1,197 @@
+# middlewares/user_lock_middleware.py — ПОСЛЕДОВАТЕЛЬНАЯ ОБРАБОТКА АПДЕЙТОВ ОДНОГО ПОЛЬЗОВАТЕЛЯ
+
+import asyncio
+import logging
+import os
+import random
+import time
+import uuid
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Optional
+
+from aiogram import BaseMiddleware, Dispatcher
+from aiogram.types import Update
+
+import config
+from services.metrics import Gauge, Histogram
+from services.redis_client import get_redis
+from services.tracing import span
+
+logger = logging.getLogger("VetBot.UserLock")
+
+# Распределенная блокировка нужна, когда апдейты одного пользователя могут попасть на разные реплики
+USER_LOCK_REDIS = os.getenv("USER_LOCK_REDIS", "1" if config.BOT_MODE == "webhook" else "0") == "1"
+# Срок блокировки в Redis (продлевается, пока апдейт обрабатывается), сек
+USER_LOCK_TTL = float(os.getenv("USER_LOCK_TTL", "30"))
+_POLL_MIN = 0.02
+_POLL_MAX = 0.5
+
+LOCK_WAIT_SECONDS = Histogram("user_lock_wait_seconds", "Ожидание очереди апдейтов пользователя", ("scope",))
+LOCKS_ACTIVE = Gauge("user_locks_active", "Пользователи с апдейтами в обработке")
+
+_RENEW = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+_RELEASE = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class KeyedLocks:
+    """
+    Блокировки по ключу. Запись живет, пока ее кто-то держит или ждет:
+    таблица ограничена числом пользователей, у которых апдейт в работе прямо сейчас.
+    """
+
+    def __init__(self):
+        self._locks: dict[int, list] = {}  # key -> [asyncio.Lock, число держащих/ждущих]
+
+    def __len__(self) -> int:
+        return len(self._locks)
+
+    async def acquire(self, key: int):
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            await entry[0].acquire()
+        except BaseException:
+            self._leave(key, entry)
+            raise
+
+    def release(self, key: int):
+        entry = self._locks[key]
+        entry[0].release()
+        self._leave(key, entry)
+
+    def _leave(self, key: int, entry: list):
+        entry[1] -= 1
+        if entry[1] == 0:
+            del self._locks[key]
+
+
+class RedisUserLock:
+    """Блокировка user_lock:{id} в Redis с продлением, пока обработка не закончилась"""
+
+    def __init__(self, user_id: int):
+        self.key = f"user_lock:{user_id}"
+        self.token = uuid.uuid4().hex
+        self._renew_task: Optional[asyncio.Task] = None
+
+    async def acquire(self):
+        redis = get_redis()
+        ttl_ms = int(USER_LOCK_TTL * 1000)
+        delay = _POLL_MIN
+        while not await redis.set(self.key, self.token, nx=True, px=ttl_ms):
+            await asyncio.sleep(delay * random.uniform(0.5, 1.0))
+            delay = min(_POLL_MAX, delay * 2)
+        self._renew_task = asyncio.create_task(self._renew_loop(ttl_ms))
+
+    async def _renew_loop(self, ttl_ms: int):
+        redis = get_redis()
+        while True:
+            await asyncio.sleep(USER_LOCK_TTL / 3)
+            try:
+                if not await redis.eval(_RENEW, 1, self.key, self.token, ttl_ms):
+                    logger.warning(f"🔒 {self.key}: блокировка истекла во время обработки")
+                    return
+            except Exception as e:
+                logger.warning(f"🔒 {self.key}: не удалось продлить блокировку: {e}")
+
+    async def release(self):
+        if self._renew_task:
+            self._renew_task.cancel()
+        try:
+            await get_redis().eval(_RELEASE, 1, self.key, self.token)
+        except Exception as e:
+            logger.warning(f"🔒 {self.key}: не удалось снять блокировку: {e}")
+
+
+# Общая таблица процесса: ее берут и middleware, и владелец альбома (см. hold_user_lock)
+_locks = KeyedLocks()
+
+
+async def _acquire_redis(user_id: int) -> Optional[RedisUserLock]:
+    lock = RedisUserLock(user_id)
+    started = time.monotonic()
+    try:
+        await lock.acquire()
+    except Exception as e:
+        # Redis недоступен: продолжаем с локальной блокировкой, чем не отвечать вовсе
+        logger.error(f"Error in UserLockMiddleware: {e}")
+        return None
+    LOCK_WAIT_SECONDS.observe(time.monotonic() - started, scope="redis")
+    return lock
+
+
+@asynccontextmanager
+async def hold_user_lock(user_id: int, use_redis: bool = USER_LOCK_REDIS) -> AsyncIterator[None]:
+    """
+    Очередь апдейтов пользователя. Middleware берет ее на каждый апдейт, кроме частей альбома;
+    владелец собранного альбома берет ее сам — на время проверки доступа и списания.
+    """
+    started = time.monotonic()
+    with span("user_lock.wait"):
+        await _locks.acquire(user_id)
+    LOCKS_ACTIVE.set(len(_locks))
+    try:
+        LOCK_WAIT_SECONDS.observe(time.monotonic() - started, scope="local")
+        redis_lock = None
+        if use_redis:
+            with span("user_lock.redis"):
+                redis_lock = await _acquire_redis(user_id)
+        try:
+            yield
+        finally:
+            if redis_lock:
+                await redis_lock.release()
+    finally:
+        _locks.release(user_id)
+        LOCKS_ACTIVE.set(len(_locks))
+
+
+def _should_serialize(event: Update) -> bool:
+    # Части альбома собирает services.albums (владелец ждет остальные части) — их не блокируем;
+    # владелец после сборки встает в ту же очередь через hold_user_lock
+    return not (event.message and event.message.media_group_id)
+
+
+class UserLockMiddleware(BaseMiddleware):
+    """
+    Апдейты одного пользователя обрабатываются строго по очереди (проверка лимитов,
+    пробный анализ и списание не пересекаются), разные пользователи — параллельно.
+    """
+
+    def __init__(self, use_redis: bool = USER_LOCK_REDIS):
+        self.use_redis = use_redis
+
+    async def __call__(
+        self,
+        handler: Callable[[Update, dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: dict[str, Any]
+    ) -> Any:
+        user = data.get("event_from_user")
+        if user is None or not _should_serialize(event):
+            return await handler(event, data)
+        async with hold_user_lock(user.id, self.use_redis):
+            return await handler(event, data)
+
+
+def setup_user_lock(dp: Dispatcher) -> UserLockMiddleware:
+    """
+    Ставит блокировку перед FSM-middleware диспетчера: иначе второй апдейт прочитал бы
+    состояние FSM до того, как первый его поменял.
+    """
+    middleware = UserLockMiddleware()
+    dp.update.outer_middleware.unregister(dp.fsm)
+    dp.update.outer_middleware(middleware)
+    dp.update.outer_middleware(dp.fsm)
+    return middleware
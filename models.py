@@ -34,6 +34,8 @@ class User(Base):
     is_trial_used: Mapped[bool] = mapped_column(Integer, default=0)  # 0 = не использован, 1 = использован (SQLite boolean)
     last_one_time_purchase: Mapped[Optional[str]] = mapped_column(String, nullable=True)  # ISO datetime последней разовой покупки
     referrer_id: Mapped[Optional[int]] = mapped_column(BigInteger, nullable=True)  # ID пользователя, который пригласил
+    blocked_at: Mapped[Optional[str]] = mapped_column(String, nullable=True)  # ISO datetime: бот заблокирован / аккаунт удален
+    last_delivery_error: Mapped[Optional[str]] = mapped_column(String, nullable=True)  # текст последней ошибки доставки
 
     def to_dict(self) -> dict:
         """Преобразует объект в словарь (для обратной совместимости)"""
@@ -53,6 +55,8 @@ class User(Base):
             "is_trial_used": bool(self.is_trial_used),
             "last_one_time_purchase": self.last_one_time_purchase,
             "referrer_id": self.referrer_id,
+            "blocked_at": self.blocked_at,
+            "last_delivery_error": self.last_delivery_error,
         }
 
 
@@ -70,8 +74,8 @@ class Pet(Base):
     chronic: Mapped[Optional[str]] = mapped_column(Text, nullable=True)  # Хронические болезни
     allergies: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
     meds: Mapped[Optional[str]] = mapped_column(Text, nullable=True)  # Текущие лекарства
-    next_vaccine_date: Mapped[Optional[str]] = mapped_column(String, nullable=True)  # YYYY-MM-DD
-    next_tick_date: Mapped[Optional[str]] = mapped_column(String, nullable=True)  # YYYY-MM-DD
+    next_vaccine_date: Mapped[Optional[str]] = mapped_column(String, nullable=True, index=True)  # YYYY-MM-DD
+    next_tick_date: Mapped[Optional[str]] = mapped_column(String, nullable=True, index=True)  # YYYY-MM-DD
     updated_at: Mapped[Optional[str]] = mapped_column(String, nullable=True)  # ISO datetime
 
     def to_dict(self) -> dict:
@@ -116,6 +120,65 @@ class YooKassaPayment(Base):
     created_at: Mapped[Optional[str]] = mapped_column(String, nullable=True)
 
 
+class PendingPayment(Base):
+    """Созданные ботом, но еще не завершенные платежи (точечный опрос статуса)"""
+    __tablename__ = "pending_payments"
+
+    payment_id: Mapped[str] = mapped_column(String, primary_key=True)
+    user_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    tier: Mapped[str] = mapped_column(String, nullable=False)
+    created_at: Mapped[str] = mapped_column(String, nullable=False)  # ISO datetime
+    next_check_at: Mapped[str] = mapped_column(String, nullable=False, index=True)  # ISO datetime
+    expires_at: Mapped[str] = mapped_column(String, nullable=False)  # ISO datetime
+    attempts: Mapped[int] = mapped_column(Integer, default=0)
+
+
+class BroadcastJob(Base):
+    """Задание рассылки (курсор по users.user_id позволяет продолжить после рестарта)"""
+    __tablename__ = "broadcast_jobs"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    admin_id: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    progress_chat_id: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    progress_message_id: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    content: Mapped[str] = mapped_column(Text, default="")
+    photo_file_id: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+    audience: Mapped[Optional[str]] = mapped_column(Text, nullable=True)  # JSON AudienceFilter
+    status: Mapped[str] = mapped_column(String, default="running", index=True)  # 'running', 'done'
+    cursor: Mapped[int] = mapped_column(BigInteger, default=0)  # последний обработанный user_id
+    total: Mapped[int] = mapped_column(Integer, default=0)
+    sent: Mapped[int] = mapped_column(Integer, default=0)
+    failed: Mapped[int] = mapped_column(Integer, default=0)
+    created_at: Mapped[str] = mapped_column(String, nullable=False)  # ISO datetime
+    finished_at: Mapped[Optional[str]] = mapped_column(String, nullable=True)  # ISO datetime
+
+
+class ReminderDelivery(Base):
+    """Журнал напоминаний: уникальность (pet, kind, due_date) не дает отправить дважды"""
+    __tablename__ = "reminder_deliveries"
+    __table_args__ = (
+        UniqueConstraint("pet_id", "kind", "due_date", name="uq_reminder_pet_kind_date"),
+    )
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    pet_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    user_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    kind: Mapped[str] = mapped_column(String, nullable=False)  # 'vaccine', 'tick'
+    due_date: Mapped[str] = mapped_column(String, nullable=False)  # YYYY-MM-DD
+    status: Mapped[str] = mapped_column(String, default="claimed")  # 'claimed', 'sent', 'failed'
+    created_at: Mapped[str] = mapped_column(String, nullable=False)  # ISO datetime
+
+
+class BotState(Base):
+    """Служебные значения бота (курсоры фоновых задач и т.п.)"""
+    __tablename__ = "bot_state"
+
+    key: Mapped[str] = mapped_column(String, primary_key=True)
+    value: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    updated_at: Mapped[Optional[str]] = mapped_column(String, nullable=True)  # ISO datetime
+    fence: Mapped[Optional[int]] = mapped_column(BigInteger, nullable=True)  # fencing-токен лидера, записавшего значение
+
+
 class Feedback(Base):
     """Модель фидбека (👍/👎)"""
     __tablename__ = "feedback"
@@ -0,0 +1,82 @@
+# services/admission.py — КОНТРОЛЬ ДОПУСКА: ПРИ ПЕРЕГРУЗКЕ БЕСПЛАТНЫЕ ЗАПРОСЫ ПОЛУЧАЮТ «ЗАНЯТО»
+
+import logging
+import os
+from contextlib import asynccontextmanager
+from typing import Optional
+
+from aiogram.types import Message
+
+from services import job_queue
+from services.loop_monitor import current_lag
+from services.metrics import Counter, Gauge
+from services.redis_client import get_redis
+
+logger = logging.getLogger("VetBot.Admission")
+
+# Сколько AI/OCR-запросов процесс держит в работе, прежде чем отказывать бесплатному тарифу
+ADMISSION_MAX_INFLIGHT = int(os.getenv("ADMISSION_MAX_INFLIGHT", "40"))
+# Задержка event loop, при которой процесс считается перегруженным, сек
+ADMISSION_MAX_LOOP_LAG = float(os.getenv("ADMISSION_MAX_LOOP_LAG", "0.5"))
+# С очередью заданий: сколько заданий может ждать воркеров, прежде чем отказывать бесплатному тарифу
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "200"))
+
+BUSY_TEXT = "⏳ Сейчас очень много запросов. Лимит не списан — попробуйте через минуту."
+
+INFLIGHT = Gauge("ai_inflight", "AI/OCR-запросы в работе", ("kind",))
+ADMISSION_TOTAL = Counter("admission_total", "Решения контроля допуска", ("decision", "reason", "tier"))
+
+_inflight = {"text": 0, "uploads": 0}
+
+
+@asynccontextmanager
+async def track(kind: str):
+    """Учитывает запрос в работе (kind: text | uploads)"""
+    _inflight[kind] += 1
+    INFLIGHT.set(_inflight[kind], kind=kind)
+    try:
+        yield
+    finally:
+        _inflight[kind] -= 1
+        INFLIGHT.set(_inflight[kind], kind=kind)
+
+
+def inflight_total() -> int:
+    return sum(_inflight.values())
+
+
+async def _overload_reason() -> Optional[str]:
+    if current_lag() >= ADMISSION_MAX_LOOP_LAG:
+        return "loop_lag"
+    if job_queue.JOB_QUEUE_ENABLED:
+        try:
+            if await get_redis().xlen(job_queue.JOB_QUEUE_STREAM) >= ADMISSION_MAX_QUEUE:
+                return "queue"
+        except Exception as e:
+            logger.warning(f"🚦 Не удалось узнать длину очереди: {e}")
+    elif inflight_total() >= ADMISSION_MAX_INFLIGHT:
+        return "inflight"
+    return None
+
+
+async def shed(message: Message, paid: bool) -> bool:
+    """
+    Решает, принимать ли новый AI/OCR-запрос (до списания лимита).
+    Платные тарифы обслуживаются всегда; бесплатному при перегрузке отвечаем «занято».
+    True — запрос отклонен, пользователю уже ответили.
+    """
+    tier = "paid" if paid else "free"
+    reason = None if paid else await _overload_reason()
+    if reason is None:
+        ADMISSION_TOTAL.inc(decision="admitted", reason="ok", tier=tier)
+        return False
+
+    ADMISSION_TOTAL.inc(decision="shed", reason=reason, tier=tier)
+    logger.warning(
+        f"🚦 Отказ {message.from_user.id} ({reason}): в работе {inflight_total()}, lag {current_lag():.2f}с"
+    )
+    try:
+        await message.answer(BUSY_TEXT)
+    except Exception as e:
+        logger.warning(f"🚦 Не удалось ответить «занято»: {e}")
+    return True
@@ -0,0 +1,79 @@
+# services/albums.py — СБОРКА АЛЬБОМОВ (media_group) ИЗ НЕСКОЛЬКИХ ФОТО
+
+import asyncio
+import json
+import logging
+import os
+import time
+from dataclasses import dataclass, asdict
+from typing import Optional
+
+from services.redis_client import get_redis
+
+logger = logging.getLogger("VetBot.Albums")
+
+# Окно тишины: альбом считается собранным, если новые части не приходили столько секунд
+ALBUM_WINDOW_SEC = float(os.getenv("ALBUM_WINDOW_SEC", "1.5"))
+# Жесткий потолок ожидания (на случай «капающих» частей)
+ALBUM_MAX_WAIT_SEC = float(os.getenv("ALBUM_MAX_WAIT_SEC", "6"))
+# Telegram допускает до 10 файлов в альбоме; модели больше 4 страниц обычно не нужно
+ALBUM_MAX_ITEMS = int(os.getenv("ALBUM_MAX_ITEMS", "4"))
+_KEY_TTL = 120
+
+
+@dataclass
+class AlbumItem:
+    message_id: int
+    file_id: str
+    is_pdf: bool = False
+    caption: Optional[str] = None
+
+
+def _key(chat_id: int, media_group_id: str) -> str:
+    return f"album:{chat_id}:{media_group_id}"
+
+
+async def collect(chat_id: int, media_group_id: str, item: AlbumItem) -> Optional[list[AlbumItem]]:
+    """
+    Регистрирует часть альбома. Части могут прийти на разные реплики:
+    хранилище общее (Redis), а владелец альбома выбирается через SET NX.
+    Владелец ждет окно тишины и получает все части (по порядку message_id),
+    остальные вызовы возвращают None — на них отвечать не нужно.
+    """
+    redis = get_redis()
+    key = _key(chat_id, media_group_id)
+
+    if await redis.exists(f"{key}:done"):
+        logger.warning(f"Album {media_group_id}: часть {item.message_id} пришла после сборки, пропускаю")
+        return None
+
+    async with redis.pipeline(transaction=True) as pipe:
+        pipe.rpush(f"{key}:items", json.dumps(asdict(item)))
+        pipe.set(f"{key}:last", time.time(), ex=_KEY_TTL)
+        pipe.expire(f"{key}:items", _KEY_TTL)
+        await pipe.execute()
+
+    is_owner = await redis.set(f"{key}:owner", item.message_id, nx=True, ex=_KEY_TTL)
+    if not is_owner:
+        return None
+
+    started = time.monotonic()
+    while True:
+        await asyncio.sleep(ALBUM_WINDOW_SEC / 3)
+        last = float(await redis.get(f"{key}:last") or 0)
+        if time.time() - last >= ALBUM_WINDOW_SEC:
+            break
+        if time.monotonic() - started >= ALBUM_MAX_WAIT_SEC:
+            break
+
+    async with redis.pipeline(transaction=True) as pipe:
+        pipe.set(f"{key}:done", 1, ex=_KEY_TTL)
+        pipe.lrange(f"{key}:items", 0, -1)
+        pipe.delete(f"{key}:items", f"{key}:last")
+        _, raw_items, _ = await pipe.execute()
+
+    items = sorted((AlbumItem(**json.loads(raw)) for raw in raw_items), key=lambda i: i.message_id)
+    if len(items) > ALBUM_MAX_ITEMS:
+        logger.info(f"Album {media_group_id}: {len(items)} частей, беру первые {ALBUM_MAX_ITEMS}")
+        items = items[:ALBUM_MAX_ITEMS]
+    return items
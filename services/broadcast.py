@@ -0,0 +1,239 @@
+# services/broadcast.py — РАССЫЛКИ: ПАРАЛЛЕЛЬНАЯ ОТПРАВКА С ЛИМИТОМ СКОРОСТИ И ПРОДОЛЖЕНИЕМ ПОСЛЕ РЕСТАРТА
+
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+
+import storage as st
+from services.leader import run_exclusive
+
+logger = logging.getLogger("VetBot.Broadcast")
+
+# Telegram допускает ~30 сообщений/сек на бота — держим запас
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "25"))
+BROADCAST_WORKERS = int(os.getenv("BROADCAST_WORKERS", "8"))
+# Сколько получателей в одной порции: после каждой порции курсор сохраняется в БД
+BROADCAST_CHUNK = int(os.getenv("BROADCAST_CHUNK", "200"))
+# Как часто обновлять сообщение с прогрессом у админа, сек
+BROADCAST_PROGRESS_EVERY = float(os.getenv("BROADCAST_PROGRESS_EVERY", "5"))
+# Сколько раз повторять отправку одному получателю после RetryAfter
+_MAX_RETRY_AFTER = 3
+
+# Как часто лидер ищет рассылки без исполнителя, сек
+BROADCAST_RESUME_EVERY = 30
+
+_tasks: set[asyncio.Task] = set()
+# id заданий, которые этот процесс выполняет или пытается захватить
+_running: set[int] = set()
+# Остановка процесса: рассылки доделывают текущую порцию и отдаются другой реплике
+_stopping = asyncio.Event()
+
+
+class TokenBucket:
+    """
+    Ведро токенов: не больше rate отправок в секунду (с всплеском до capacity).
+    pause(sec) останавливает всех отправителей — так Telegram просит при RetryAfter.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = max(0.1, rate)
+        self.capacity = capacity or self.rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+async def _send_one(bot: Bot, job, user_id: int, bucket: TokenBucket) -> bool:
+    for _ in range(_MAX_RETRY_AFTER + 1):
+        await bucket.acquire()
+        try:
+            if job.photo_file_id:
+                await bot.send_photo(user_id, job.photo_file_id, caption=job.content or None, parse_mode="Markdown")
+            else:
+                await bot.send_message(user_id, job.content, parse_mode="Markdown")
+            return True
+        except TelegramRetryAfter as e:
+            logger.warning(f"📢 Рассылка #{job.id}: RetryAfter {e.retry_after}с")
+            bucket.pause(e.retry_after)
+        except (TelegramForbiddenError, TelegramBadRequest):
+            # Бот заблокирован / чат не найден — повтор не поможет
+            return False
+        except Exception as e:
+            logger.error(f"📢 Рассылка #{job.id}: ошибка отправки {user_id}: {e}")
+            return False
+    return False
+
+
+def _progress_text(job, done: bool = False) -> str:
+    processed = job.sent + job.failed
+    head = "✅ Рассылка завершена!" if done else "📤 Идет рассылка…"
+    return (
+        f"{head} (#{job.id})\n\n"
+        f"Обработано: {processed} из ~{job.total}\n"
+        f"✅ Отправлено: {job.sent}\n"
+        f"❌ Ошибок: {job.failed}"
+    )
+
+
+async def _show_progress(bot: Bot, job, done: bool = False):
+    text = _progress_text(job, done)
+    try:
+        if job.progress_message_id and not done:
+            await bot.edit_message_text(text, chat_id=job.progress_chat_id, message_id=job.progress_message_id)
+        else:
+            await bot.send_message(job.progress_chat_id, text)
+    except TelegramBadRequest:
+        # message is not modified и т.п.
+        pass
+    except Exception as e:
+        logger.warning(f"📢 Рассылка #{job.id}: не удалось обновить прогресс: {e}")
+
+
+async def _run_job(bot: Bot, job):
+    bucket = TokenBucket(BROADCAST_RATE)
+    audience = st.AudienceFilter.from_json(job.audience)
+    last_progress = 0.0
+    logger.info(f"📢 Рассылка #{job.id}: старт с user_id > {job.cursor}")
+
+    while True:
+        if _stopping.is_set():
+            # Курсор сохранен после прошлой порции — задание продолжит другая реплика
+            logger.info(f"📢 Рассылка #{job.id}: приостановлена при остановке (cursor={job.cursor})")
+            return
+        user_ids = await st.get_user_ids_after(job.cursor, BROADCAST_CHUNK, audience)
+        if not user_ids:
+            break
+
+        queue: asyncio.Queue = asyncio.Queue()
+        for uid in user_ids:
+            queue.put_nowait(uid)
+        results = {"sent": 0, "failed": 0}
+
+        async def worker():
+            while True:
+                try:
+                    uid = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                ok = await _send_one(bot, job, uid, bucket)
+                results["sent" if ok else "failed"] += 1
+
+        await asyncio.gather(*(worker() for _ in range(min(BROADCAST_WORKERS, len(user_ids)))))
+
+        # Порция отправлена целиком — фиксируем курсор (после падения повторится максимум одна порция)
+        job.cursor = user_ids[-1]
+        job.sent += results["sent"]
+        job.failed += results["failed"]
+        await st.update_broadcast_job(job.id, cursor=job.cursor, sent=job.sent, failed=job.failed)
+
+        if time.monotonic() - last_progress >= BROADCAST_PROGRESS_EVERY:
+            last_progress = time.monotonic()
+            await _show_progress(bot, job)
+
+    job.status = "done"
+    await st.update_broadcast_job(job.id, status="done", finished_at=datetime.now().replace(microsecond=0).isoformat())
+    logger.info(f"📢 Рассылка #{job.id} завершена: sent={job.sent}, failed={job.failed}")
+    await _show_progress(bot, job, done=True)
+
+
+async def _run_exclusive_job(bot: Bot, job_id: int):
+    """Задание выполняет ровно одна реплика (аренда broadcast:{id}); состояние перечитываем под арендой"""
+    job = await st.get_broadcast_job(job_id)
+    if job is None or job.status != "running":
+        return
+    if job.sent or job.failed:
+        logger.info(f"📢 Рассылка #{job.id}: продолжаем после рестарта (cursor={job.cursor})")
+        try:
+            await bot.send_message(job.progress_chat_id, f"🔄 Рассылка #{job.id} продолжена после перезапуска.")
+        except Exception:
+            pass
+    await _run_job(bot, job)
+
+
+def _spawn(bot: Bot, job_id: int):
+    if job_id in _running or _stopping.is_set():
+        return
+    _running.add(job_id)
+
+    async def runner():
+        try:
+            await run_exclusive(f"broadcast:{job_id}", lambda: _run_exclusive_job(bot, job_id))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Задание остается running и продолжится при следующем запуске
+            logger.error(f"Error in broadcast job #{job_id}: {e}")
+        finally:
+            _running.discard(job_id)
+
+    task = asyncio.create_task(runner())
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+
+
+async def start_broadcast(
+    bot: Bot,
+    admin_id: int,
+    chat_id: int,
+    content: str,
+    photo_file_id: Optional[str] = None,
+    audience: Optional[st.AudienceFilter] = None,
+) -> int:
+    """Создает задание рассылки и запускает его в фоне. Возвращает id задания"""
+    total = await st.count_users(audience)
+    job = await st.create_broadcast_job(admin_id, chat_id, content, photo_file_id, total, audience)
+    try:
+        msg = await bot.send_message(chat_id, _progress_text(job))
+        job.progress_message_id = msg.message_id
+        await st.update_broadcast_job(job.id, progress_message_id=msg.message_id)
+    except Exception as e:
+        logger.warning(f"📢 Рассылка #{job.id}: не удалось отправить прогресс: {e}")
+    _spawn(bot, job.id)
+    return job.id
+
+
+async def resume_broadcasts(bot: Bot):
+    """
+    Подхватывает рассылки, у которых нет живого исполнителя (процесс упал или перезапущен).
+    Работает на лидере (run_singleton) и периодически проверяет «осиротевшие» задания:
+    задание, которое еще выполняет другая реплика, пропустит run_exclusive.
+    """
+    while True:
+        try:
+            for job in await st.get_running_broadcast_jobs():
+                if job.id not in _running:
+                    _spawn(bot, job.id)
+        except Exception as e:
+            logger.error(f"Error in resume_broadcasts: {e}")
+        await asyncio.sleep(BROADCAST_RESUME_EVERY)
+
+
+def stop_broadcasts() -> set[asyncio.Task]:
+    """Просит рассылки остановиться после текущей порции; возвращает их задачи для ожидания"""
+    _stopping.set()
+    return set(_tasks)
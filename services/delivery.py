@@ -0,0 +1,90 @@
+# services/delivery.py — СОСТОЯНИЕ ДОСТАВКИ: КТО ЗАБЛОКИРОВАЛ БОТА (ДЛЯ РАССЫЛОК И НАПОМИНАНИЙ)
+
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Any
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+from aiogram.methods import TelegramMethod
+
+import storage as st
+
+logger = logging.getLogger("VetBot.Delivery")
+
+# Через сколько дней после блокировки проверяем пользователя снова
+DELIVERY_REPROBE_AFTER_DAYS = int(os.getenv("DELIVERY_REPROBE_AFTER_DAYS", "7"))
+# Как часто запускать повторную проверку, сек
+DELIVERY_REPROBE_INTERVAL = int(os.getenv("DELIVERY_REPROBE_INTERVAL", str(6 * 60 * 60)))
+# Сколько пользователей проверяем за проход и с какой скоростью (запросов/сек)
+DELIVERY_REPROBE_BATCH = 200
+DELIVERY_REPROBE_RATE = 5
+
+# BadRequest, которые тоже означают «получателя больше нет»
+_DEAD_CHAT_ERRORS = ("chat not found", "user not found", "peer_id_invalid")
+
+
+def _private_chat_id(method: TelegramMethod) -> int:
+    """chat_id личного чата из метода (у групп id отрицательные — их не трогаем)"""
+    chat_id = getattr(method, "chat_id", None)
+    return chat_id if isinstance(chat_id, int) and chat_id > 0 else 0
+
+
+class DeliveryStateMiddleware(BaseRequestMiddleware):
+    """
+    Middleware сессии бота: ловит TelegramForbiddenError на любом пути отправки
+    (ответы, рассылки, напоминания, уведомления об оплате) и помечает пользователя.
+    """
+
+    async def __call__(self, make_request: NextRequestMiddlewareType, bot: Bot, method: TelegramMethod) -> Any:
+        try:
+            return await make_request(bot, method)
+        except TelegramForbiddenError as e:
+            await self._mark(method, e.message)
+            raise
+        except TelegramBadRequest as e:
+            if any(err in (e.message or "").lower() for err in _DEAD_CHAT_ERRORS):
+                await self._mark(method, e.message)
+            raise
+
+    @staticmethod
+    async def _mark(method: TelegramMethod, error: str):
+        user_id = _private_chat_id(method)
+        if not user_id:
+            return
+        try:
+            await st.mark_user_blocked(user_id, error or "forbidden")
+            logger.info(f"🚫 Пользователь {user_id} недоступен: {error}")
+        except Exception as e:
+            logger.error(f"Error in DeliveryStateMiddleware: {e}")
+
+
+async def reprobe_blocked_loop(bot: Bot):
+    """
+    Раз в DELIVERY_REPROBE_INTERVAL проверяет давно заблокировавших: send_chat_action
+    ничего не присылает в чат, но падает с Forbidden, если бот все еще заблокирован.
+    Разблокировавших возвращаем в рассылки; остальным middleware обновит blocked_at.
+    """
+    while True:
+        try:
+            await asyncio.sleep(DELIVERY_REPROBE_INTERVAL)
+            before = (datetime.now() - timedelta(days=DELIVERY_REPROBE_AFTER_DAYS)).replace(microsecond=0).isoformat()
+            user_ids = await st.get_blocked_user_ids(before, DELIVERY_REPROBE_BATCH)
+            restored = 0
+            for user_id in user_ids:
+                try:
+                    await bot.send_chat_action(user_id, "typing")
+                    await st.clear_user_blocked(user_id)
+                    restored += 1
+                except (TelegramForbiddenError, TelegramBadRequest):
+                    pass
+                except Exception as e:
+                    logger.warning(f"🚫 Повторная проверка {user_id}: {e}")
+                await asyncio.sleep(1 / DELIVERY_REPROBE_RATE)
+            if user_ids:
+                logger.info(f"🚫 Повторная проверка: {len(user_ids)} проверено, {restored} снова доступны")
+        except Exception as e:
+            logger.error(f"Error in reprobe_blocked_loop: {e}")
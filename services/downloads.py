@@ -0,0 +1,101 @@
+# services/downloads.py — ПОТОКОВАЯ ЗАГРУЗКА ФАЙЛОВ ИЗ TELEGRAM С ЛИМИТАМИ ПАМЯТИ
+
+import asyncio
+import logging
+import os
+import tempfile
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+from aiogram import Bot
+
+from services.metrics import POOL_IN_USE, POOL_SIZE, add_collector
+
+logger = logging.getLogger("VetBot.Downloads")
+
+# Потолок размера одного файла (Bot API и так не отдает больше 20 МБ)
+MAX_DOWNLOAD_BYTES = int(os.getenv("MAX_DOWNLOAD_BYTES", str(20 * 1024 * 1024)))
+# До этого размера файл держим в памяти, дальше SpooledTemporaryFile уходит на диск
+SPOOL_MAX_MEMORY = int(os.getenv("SPOOL_MAX_MEMORY", str(2 * 1024 * 1024)))
+# Сколько байт загрузок одновременно «в полете» на весь процесс
+UPLOAD_MEMORY_BUDGET = int(os.getenv("UPLOAD_MEMORY_BUDGET", str(64 * 1024 * 1024)))
+DOWNLOAD_CHUNK = 64 * 1024
+DOWNLOAD_TIMEOUT = 60
+
+
+class FileTooLarge(Exception):
+    """Файл превышает MAX_DOWNLOAD_BYTES"""
+
+
+class ByteBudget:
+    """
+    Семафор, взвешенный по байтам: reserve(n) ждет, пока суммарный объем
+    занятых резервов плюс n не уложится в capacity.
+    Резерв больше capacity урезается до capacity (иначе он не пройдет никогда).
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = max(1, int(capacity))
+        self.used = 0
+        self._cond = asyncio.Condition()
+
+    @property
+    def available(self) -> int:
+        return self.capacity - self.used
+
+    @asynccontextmanager
+    async def reserve(self, nbytes: int) -> AsyncIterator[None]:
+        weight = min(max(1, int(nbytes)), self.capacity)
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.used + weight <= self.capacity)
+            self.used += weight
+        try:
+            yield
+        finally:
+            async with self._cond:
+                self.used -= weight
+                self._cond.notify_all()
+
+
+upload_budget = ByteBudget(UPLOAD_MEMORY_BUDGET)
+
+
+def _collect_budget():
+    POOL_IN_USE.set(upload_budget.used, pool="upload_budget")
+    POOL_SIZE.set(upload_budget.capacity, pool="upload_budget")
+
+
+add_collector(_collect_budget)
+
+
+async def download_to_spool(
+    bot: Bot, file_path: str, max_bytes: int = MAX_DOWNLOAD_BYTES
+) -> tempfile.SpooledTemporaryFile:
+    """
+    Качает файл Telegram потоком в SpooledTemporaryFile.
+    Прерывает загрузку, как только поток превысил max_bytes (размер из get_file не гарантирован).
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY)
+    try:
+        if bot.session.api.is_local:
+            # Локальный Bot API сервер: файл уже на диске, просто копируем
+            await bot.download_file(file_path, spool, chunk_size=DOWNLOAD_CHUNK)
+            if spool.tell() > max_bytes:
+                raise FileTooLarge(f"{spool.tell()} > {max_bytes}")
+        else:
+            url = bot.session.api.file_url(bot.token, file_path)
+            total = 0
+            stream = bot.session.stream_content(url, timeout=DOWNLOAD_TIMEOUT, chunk_size=DOWNLOAD_CHUNK)
+            try:
+                async for chunk in stream:
+                    total += len(chunk)
+                    if total > max_bytes:
+                        raise FileTooLarge(f"{total} > {max_bytes}")
+                    spool.write(chunk)
+            finally:
+                await stream.aclose()
+        spool.seek(0)
+        return spool
+    except BaseException:
+        spool.close()
+        raise
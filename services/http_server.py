@@ -0,0 +1,55 @@
+# services/http_server.py — HTTP-СЕРВЕР БОТА (вебхуки, health, метрики)
+
+import hmac
+import logging
+from typing import Optional
+
+from aiohttp import web
+from aiogram import Bot
+
+import config
+from services import yookassa_webhook
+from services.metrics import collect, render_prometheus
+
+logger = logging.getLogger("VetBot.HTTP")
+
+
+async def handle_health(request: web.Request) -> web.Response:
+    return web.json_response({"status": "ok"})
+
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    """Метрики процесса в формате Prometheus (коллекторы обновляют очереди и пулы перед выдачей)"""
+    if config.METRICS_TOKEN:
+        # Байты, а не str: на не-ASCII заголовке compare_digest(str, str) падает с TypeError
+        auth = request.headers.get("Authorization", "").encode()
+        if not hmac.compare_digest(auth, f"Bearer {config.METRICS_TOKEN}".encode()):
+            return web.Response(status=401)
+    await collect()
+    return web.Response(text=render_prometheus(), content_type="text/plain", charset="utf-8")
+
+
+def build_app(bot: Bot) -> web.Application:
+    """Собирает aiohttp-приложение со всеми служебными маршрутами"""
+    app = build_metrics_app()
+    yookassa_webhook.setup_routes(app, bot)
+    return app
+
+
+def build_metrics_app() -> web.Application:
+    """Только health и метрики (для воркера очереди)"""
+    app = web.Application()
+    app.router.add_get("/health", handle_health)
+    app.router.add_get("/metrics", handle_metrics)
+    return app
+
+
+async def start_http_server(app: web.Application, port: Optional[int] = None) -> web.AppRunner:
+    """Запускает сервер на HTTP_HOST:HTTP_PORT (или на port), возвращает runner для остановки"""
+    port = port or config.HTTP_PORT
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host=config.HTTP_HOST, port=port)
+    await site.start()
+    logger.info(f"🌐 HTTP-сервер слушает {config.HTTP_HOST}:{port}")
+    return runner
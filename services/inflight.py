@@ -0,0 +1,129 @@
+# services/inflight.py — AI-ЗАПРОСЫ В РАБОТЕ: ОТМЕНА УСТАРЕВШЕГО ЗАПРОСА, КОГДА ПОЛЬЗОВАТЕЛЬ ПРИСЛАЛ УТОЧНЕНИЕ
+
+import asyncio
+import logging
+import os
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Optional
+
+from aiogram import BaseMiddleware, Dispatcher
+from aiogram.fsm.middleware import FSMContextMiddleware
+from aiogram.types import Update
+
+from keyboards.admin_kb import admin_keyboard
+from keyboards.main_kb import main_reply_kb
+from services.metrics import Counter
+
+logger = logging.getLogger("VetBot.Inflight")
+
+# Политика включается явно: новое текстовое сообщение отменяет предыдущий текстовый запрос к AI
+AI_CANCEL_SUPERSEDED = os.getenv("AI_CANCEL_SUPERSEDED", "0") == "1"
+# Отменяем, только если предыдущий запрос начат не раньше чем столько секунд назад
+AI_SUPERSEDE_WINDOW = float(os.getenv("AI_SUPERSEDE_WINDOW", "30"))
+
+SUPERSEDED_TOTAL = Counter("ai_superseded_total", "AI-запросы, отмененные более новым сообщением")
+
+# Кнопки клавиатур — это навигация, а не уточнение вопроса
+_BUTTON_TEXTS = frozenset(
+    button.text for kb in (main_reply_kb(), admin_keyboard()) for row in kb.keyboard for button in row
+)
+
+
+@dataclass
+class InFlight:
+    task: asyncio.Task
+    started: float
+    refund: Optional[Callable[[], Awaitable]] = None
+    superseded: bool = False
+
+
+# user_id -> запрос в работе (запись удаляется, как только запрос завершился)
+_inflight: dict[int, InFlight] = {}
+
+
+async def run_ai(user_id: int, coro: Awaitable, refund: Optional[Callable[[], Awaitable]] = None) -> Optional[Any]:
+    """
+    Выполняет запрос к AI как отменяемую задачу. Возвращает None, если запрос
+    вытеснен более новым сообщением (квота к этому моменту уже возвращена).
+    Отмена задачи закрывает HTTP-соединение с провайдером — генерация не дочитывается.
+    """
+    task = asyncio.ensure_future(coro)
+    entry = InFlight(task=task, started=time.monotonic(), refund=refund)
+    _inflight[user_id] = entry
+    try:
+        return await task
+    except asyncio.CancelledError:
+        if not entry.superseded or not task.cancelled():
+            # Отменили сам обработчик (остановка бота) — пробрасываем
+            raise
+        if entry.refund:
+            try:
+                await entry.refund()
+            except Exception as e:
+                logger.error(f"Error in inflight refund: {e}")
+        return None
+    finally:
+        if _inflight.get(user_id) is entry:
+            del _inflight[user_id]
+
+
+def supersede(user_id: int) -> bool:
+    """Отменяет запрос пользователя в работе, если он начат в пределах окна"""
+    entry = _inflight.get(user_id)
+    if entry is None or entry.task.done() or entry.superseded:
+        return False
+    if time.monotonic() - entry.started > AI_SUPERSEDE_WINDOW:
+        return False
+    entry.superseded = True
+    entry.task.cancel()
+    SUPERSEDED_TOTAL.inc()
+    logger.info(f"✂️ {user_id}: предыдущий AI-запрос отменен новым сообщением")
+    return True
+
+
+def _is_prompt(event: Update) -> bool:
+    msg = event.message
+    return bool(msg and msg.text and not msg.text.startswith("/") and msg.text not in _BUTTON_TEXTS)
+
+
+class SupersedeMiddleware(BaseMiddleware):
+    """
+    Стоит перед очередью пользователя (UserLockMiddleware): новое сообщение иначе
+    ждало бы, пока устаревший ответ сгенерируется и спишется.
+    Ответ на вопрос сценария (поле анкеты питомца, текст рассылки) — не уточнение:
+    при заданном состоянии FSM запрос не отменяем.
+    """
+
+    def __init__(self, fsm: FSMContextMiddleware):
+        self.fsm = fsm
+
+    async def __call__(
+        self,
+        handler: Callable[[Update, dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: dict[str, Any]
+    ) -> Any:
+        user = data.get("event_from_user")
+        if user is not None and user.id in _inflight and _is_prompt(event) and not await self._in_scenario(data):
+            supersede(user.id)
+        return await handler(event, data)
+
+    async def _in_scenario(self, data: dict[str, Any]) -> bool:
+        # FSM-middleware еще не отработал (мы стоим перед ним) — читаем состояние из хранилища сами;
+        # запрос к хранилищу — только когда у пользователя есть AI-запрос в работе
+        try:
+            context = self.fsm.resolve_event_context(data["bot"], data)
+            return bool(context and await context.get_state())
+        except Exception as e:
+            logger.error(f"Error in SupersedeMiddleware state check: {e}")
+            return True
+
+
+def setup_supersede(dp: Dispatcher):
+    """Ставит отмену устаревших запросов перед FSM-middleware (и перед очередью пользователя)"""
+    if not AI_CANCEL_SUPERSEDED:
+        return
+    dp.update.outer_middleware.unregister(dp.fsm)
+    dp.update.outer_middleware(SupersedeMiddleware(dp.fsm))
+    dp.update.outer_middleware(dp.fsm)
@@ -0,0 +1,225 @@
+# services/job_queue.py — ОЧЕРЕДЬ ЗАДАНИЙ AI/OCR В REDIS (STREAMS + ГРУППА ВОРКЕРОВ)
+
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Optional
+
+from aiogram import Bot
+from aiogram.types import Message
+from redis.exceptions import ResponseError
+
+from middlewares.user_lock_middleware import RedisUserLock
+from services.leader import INSTANCE_ID
+from services.metrics import Counter, Gauge, Histogram, add_collector
+from services.query_stats import query_scope
+from services.redis_client import get_redis
+from services.tracing import span, start_trace
+
+logger = logging.getLogger("VetBot.JobQueue")
+
+# Включено — хендлеры только ставят задания, а AI/OCR выполняют процессы worker.py
+JOB_QUEUE_ENABLED = os.getenv("JOB_QUEUE_ENABLED", "0") == "1"
+JOB_QUEUE_STREAM = os.getenv("JOB_QUEUE_STREAM", "jobs:answer")
+JOB_QUEUE_GROUP = "workers"
+# Сколько заданий может ждать в очереди; дальше новые запросы получают отказ «занято»
+JOB_QUEUE_MAX_PENDING = int(os.getenv("JOB_QUEUE_MAX_PENDING", "5000"))
+# Сколько заданий один процесс-воркер выполняет одновременно
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", "8"))
+# Через сколько секунд без признаков жизни задание упавшего воркера отдается другому
+JOB_VISIBILITY_TIMEOUT = int(os.getenv("JOB_VISIBILITY_TIMEOUT", "120"))
+# Сколько раз пробовать задание (после падений воркера), прежде чем отложить в dead-список
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+# Сколько ждать начатые задания при остановке воркера, сек
+WORKER_DRAIN_TIMEOUT = float(os.getenv("WORKER_DRAIN_TIMEOUT", "60"))
+_READ_BLOCK_MS = 2000
+_DEAD_KEEP = 1000
+
+JOBS_TOTAL = Counter("jobs_total", "Задания очереди по итогам", ("kind", "status"))
+JOB_WAIT_SECONDS = Histogram("job_wait_seconds", "Ожидание задания в очереди", ("kind",))
+JOB_RUN_SECONDS = Histogram("job_run_seconds", "Выполнение задания воркером", ("kind",))
+QUEUE_DEPTH = Gauge("job_queue_depth", "Задания в очереди: ждут, выполняются, отложены", ("state",))
+
+JobHandler = Callable[..., Awaitable[None]]
+_HANDLERS: dict[str, JobHandler] = {}
+
+
+class QueueFull(Exception):
+    """В очереди слишком много заданий — воркеры не успевают"""
+
+
+def register_job_handler(kind: str, func: JobHandler):
+    """func(message, **payload) — выполняется в воркере с message, привязанным к его Bot"""
+    _HANDLERS[kind] = func
+
+
+async def enqueue(kind: str, message: Message, **payload: Any) -> str:
+    """
+    Ставит задание: контекст сообщения (для ответа через Bot API) и параметры.
+    Файлы передаются file_id — воркер сам скачивает их у Telegram.
+    """
+    redis = get_redis()
+    if await redis.xlen(JOB_QUEUE_STREAM) >= JOB_QUEUE_MAX_PENDING:
+        JOBS_TOTAL.inc(kind=kind, status="rejected")
+        raise QueueFull()
+    job_id = await redis.xadd(JOB_QUEUE_STREAM, {
+        "kind": kind,
+        "message": message.model_dump_json(exclude_none=True),
+        "payload": json.dumps(payload, ensure_ascii=False),
+    })
+    JOBS_TOTAL.inc(kind=kind, status="enqueued")
+    return job_id
+
+
+async def _collect_depth():
+    if not JOB_QUEUE_ENABLED:
+        return
+    redis = get_redis()
+    async with redis.pipeline(transaction=False) as pipe:
+        pipe.xlen(JOB_QUEUE_STREAM)
+        pipe.xpending(JOB_QUEUE_STREAM, JOB_QUEUE_GROUP)
+        pipe.llen(f"{JOB_QUEUE_STREAM}:dead")
+        total, pending, dead = await pipe.execute(raise_on_error=False)
+    running = pending["pending"] if isinstance(pending, dict) else 0
+    if isinstance(total, int):
+        QUEUE_DEPTH.set(max(0, total - running), state="waiting")
+    QUEUE_DEPTH.set(running, state="running")
+    if isinstance(dead, int):
+        QUEUE_DEPTH.set(dead, state="dead")
+
+
+add_collector(_collect_depth)
+
+
+async def _ensure_group():
+    try:
+        await get_redis().xgroup_create(JOB_QUEUE_STREAM, JOB_QUEUE_GROUP, id="0", mkstream=True)
+    except ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+
+async def _finish(job_id: str):
+    """Задание выполнено (или отброшено): убираем из группы и из потока"""
+    async with get_redis().pipeline(transaction=True) as pipe:
+        pipe.xack(JOB_QUEUE_STREAM, JOB_QUEUE_GROUP, job_id)
+        pipe.xdel(JOB_QUEUE_STREAM, job_id)
+        await pipe.execute()
+
+
+async def _heartbeat(job_id: str):
+    """Пока задание выполняется, сбрасываем его idle — другие воркеры его не заберут"""
+    redis = get_redis()
+    while True:
+        await asyncio.sleep(JOB_VISIBILITY_TIMEOUT / 3)
+        try:
+            await redis.xclaim(JOB_QUEUE_STREAM, JOB_QUEUE_GROUP, INSTANCE_ID, 0, [job_id], justid=True)
+        except Exception as e:
+            logger.warning(f"🧵 {job_id}: не удалось продлить задание: {e}")
+
+
+async def _reclaim(count: int) -> list[tuple[str, dict]]:
+    """Забирает задания упавших воркеров; слишком часто падавшие — в dead-список"""
+    redis = get_redis()
+    _, entries, *_ = await redis.xautoclaim(
+        JOB_QUEUE_STREAM, JOB_QUEUE_GROUP, INSTANCE_ID, JOB_VISIBILITY_TIMEOUT * 1000, count=count
+    )
+    alive = []
+    for job_id, fields in entries:
+        if not fields:
+            continue
+        pending = await redis.xpending_range(JOB_QUEUE_STREAM, JOB_QUEUE_GROUP, job_id, job_id, 1)
+        attempts = pending[0]["times_delivered"] if pending else 1
+        if attempts > JOB_MAX_ATTEMPTS:
+            logger.error(f"🧵 Задание {job_id} ({fields.get('kind')}) отложено после {attempts - 1} попыток")
+            JOBS_TOTAL.inc(kind=fields.get("kind", "?"), status="dead")
+            await redis.rpush(f"{JOB_QUEUE_STREAM}:dead", json.dumps(fields, ensure_ascii=False))
+            await redis.ltrim(f"{JOB_QUEUE_STREAM}:dead", -_DEAD_KEEP, -1)
+            await _finish(job_id)
+            continue
+        logger.warning(f"🧵 Задание {job_id} подхвачено после сбоя воркера (попытка {attempts})")
+        alive.append((job_id, fields))
+    return alive
+
+
+async def _process(bot: Bot, job_id: str, fields: dict):
+    kind = fields.get("kind", "?")
+    handler = _HANDLERS.get(kind)
+    enqueued_at = int(job_id.split("-")[0]) / 1000
+    JOB_WAIT_SECONDS.observe(max(0.0, time.time() - enqueued_at), kind=kind)
+
+    heartbeat = asyncio.create_task(_heartbeat(job_id))
+    started = time.monotonic()
+    status = "done"
+    try:
+        if handler is None:
+            raise LookupError(f"нет обработчика для {kind!r}")
+        message = Message.model_validate_json(fields["message"]).as_(bot)
+        payload = json.loads(fields.get("payload") or "{}")
+        with start_trace(f"job.{kind}", job_id=job_id, user_id=message.from_user.id), query_scope(f"job.{kind}"):
+            # Задания одного пользователя — по очереди (лимиты и пробный анализ не пересекаются)
+            lock = RedisUserLock(message.from_user.id)
+            with span("job.user_lock"):
+                await lock.acquire()
+            try:
+                await handler(message, **payload)
+            finally:
+                await lock.release()
+    except asyncio.CancelledError:
+        # Остановка воркера: задание не подтверждаем — его подхватит другой воркер
+        raise
+    except Exception as e:
+        # Повтор после ошибки мог бы отправить ответ дважды — повторяем только после падения процесса
+        status = "error"
+        logger.error(f"Error in job {job_id} ({kind}): {e}")
+    finally:
+        heartbeat.cancel()
+    JOB_RUN_SECONDS.observe(time.monotonic() - started, kind=kind)
+    JOBS_TOTAL.inc(kind=kind, status=status)
+    await _finish(job_id)
+
+
+async def run_worker(bot: Bot, stop: Optional[asyncio.Event] = None):
+    """
+    Цикл воркера: до WORKER_CONCURRENCY заданий одновременно. Сначала подбирает
+    задания упавших воркеров, затем читает новые. По stop дожидается начатых заданий.
+    """
+    stop = stop or asyncio.Event()
+    redis = get_redis()
+    await _ensure_group()
+    logger.info(f"🧵 Воркер {INSTANCE_ID}: {JOB_QUEUE_STREAM}, до {WORKER_CONCURRENCY} заданий одновременно")
+
+    tasks: set[asyncio.Task] = set()
+    last_reclaim = 0.0
+    while not stop.is_set():
+        free = WORKER_CONCURRENCY - len(tasks)
+        if free <= 0:
+            await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED, timeout=1)
+            continue
+        try:
+            entries = []
+            if time.monotonic() - last_reclaim >= JOB_VISIBILITY_TIMEOUT / 3:
+                last_reclaim = time.monotonic()
+                entries = await _reclaim(free)
+            if not entries:
+                response = await redis.xreadgroup(
+                    JOB_QUEUE_GROUP, INSTANCE_ID, {JOB_QUEUE_STREAM: ">"}, count=free, block=_READ_BLOCK_MS
+                )
+                entries = response[0][1] if response else []
+        except Exception as e:
+            logger.error(f"Error in run_worker: {e}")
+            await asyncio.sleep(1)
+            continue
+        for job_id, fields in entries:
+            task = asyncio.create_task(_process(bot, job_id, fields))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+    if tasks:
+        logger.info(f"🧵 Остановка: дожидаемся {len(tasks)} заданий (до {WORKER_DRAIN_TIMEOUT:.0f}с)")
+        _, pending = await asyncio.wait(tasks, timeout=WORKER_DRAIN_TIMEOUT)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
@@ -0,0 +1,169 @@
+# services/leader.py — ВЫБОР ЛИДЕРА ДЛЯ ФОНОВЫХ ЗАДАЧ (АРЕНДА В REDIS + FENCING-ТОКЕНЫ)
+
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+from contextvars import ContextVar
+from typing import Awaitable, Callable, Optional
+
+from services.redis_client import get_redis
+
+logger = logging.getLogger("VetBot.Leader")
+
+# Срок аренды: за это время после падения лидера задачу подхватит другая реплика
+LEADER_LEASE_TTL = float(os.getenv("LEADER_LEASE_TTL", "10"))
+# Как часто продлевать аренду (и как часто последователи пробуют ее захватить)
+LEADER_RENEW_INTERVAL = float(os.getenv("LEADER_RENEW_INTERVAL", str(LEADER_LEASE_TTL / 3)))
+
+INSTANCE_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+_fencing_token: ContextVar[Optional[int]] = ContextVar("fencing_token", default=None)
+
+# KEYS[1] — ключ аренды, KEYS[2] — счетчик токенов; ARGV[1] — id реплики, ARGV[2] — TTL, мс
+_ACQUIRE = """
+if redis.call('SET', KEYS[1], ARGV[1], 'NX', 'PX', ARGV[2]) then
+    local token = redis.call('INCR', KEYS[2])
+    redis.call('SET', KEYS[1], ARGV[1] .. '|' .. token, 'PX', ARGV[2])
+    return token
+end
+return 0
+"""
+# Продлеваем / отпускаем только свою аренду
+_RENEW = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+_RELEASE = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+def fencing_token() -> Optional[int]:
+    """
+    Fencing-токен текущей аренды (внутри задачи, запущенной через run_singleton/run_exclusive).
+    Растет при каждой смене лидера: запись с меньшим токеном — от «старого» лидера.
+    """
+    return _fencing_token.get()
+
+
+class LeaderLease:
+    """Аренда имени name одной репликой"""
+
+    def __init__(self, name: str, ttl: float = LEADER_LEASE_TTL):
+        self.name = name
+        self.ttl_ms = int(ttl * 1000)
+        self.key = f"leader:{name}"
+        self.token: Optional[int] = None
+        self._value: Optional[str] = None
+        self._renewed_at = 0.0
+
+    async def try_acquire(self) -> bool:
+        token = int(await get_redis().eval(_ACQUIRE, 2, self.key, f"{self.key}:fencing", INSTANCE_ID, self.ttl_ms))
+        if not token:
+            return False
+        self.token = token
+        self._value = f"{INSTANCE_ID}|{token}"
+        self._renewed_at = time.monotonic()
+        return True
+
+    async def renew(self) -> bool:
+        """False — аренда потеряна (истекла или захвачена другой репликой)"""
+        if not self._value:
+            return False
+        try:
+            ok = await get_redis().eval(_RENEW, 1, self.key, self._value, self.ttl_ms)
+        except Exception as e:
+            # Redis недоступен: держимся, пока аренда гарантированно не истекла
+            logger.warning(f"👑 {self.name}: не удалось продлить аренду: {e}")
+            return time.monotonic() - self._renewed_at < self.ttl_ms / 1000
+        if ok:
+            self._renewed_at = time.monotonic()
+        return bool(ok)
+
+    async def release(self):
+        if not self._value:
+            return
+        try:
+            await get_redis().eval(_RELEASE, 1, self.key, self._value)
+        except Exception as e:
+            logger.warning(f"👑 {self.name}: не удалось освободить аренду: {e}")
+        self._value = None
+        self.token = None
+
+
+async def _with_token(token: int, factory: Callable[[], Awaitable]):
+    _fencing_token.set(token)
+    return await factory()
+
+
+async def _hold(lease: LeaderLease, factory: Callable[[], Awaitable]) -> bool:
+    """
+    Выполняет задачу, пока держим аренду. Потеряли аренду — отменяем задачу.
+    Возвращает True, если задача завершилась сама и без ошибки.
+    """
+    task = asyncio.create_task(_with_token(lease.token, factory))
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=LEADER_RENEW_INTERVAL)
+            if done:
+                if not task.cancelled() and task.exception():
+                    logger.error(f"👑 {lease.name}: задача упала: {task.exception()!r}")
+                    return False
+                return True
+            if not await lease.renew():
+                logger.warning(f"👑 {lease.name}: аренда потеряна, останавливаем задачу")
+                return False
+    finally:
+        if not task.done():
+            task.cancel()
+            try:
+                await task
+            except BaseException:
+                pass
+        await lease.release()
+
+
+async def run_exclusive(name: str, factory: Callable[[], Awaitable]) -> bool:
+    """
+    Однократная задача на одной реплике: если аренда name занята — сразу False.
+    Иначе выполняет factory() под арендой и возвращает True.
+    """
+    lease = LeaderLease(name)
+    try:
+        acquired = await lease.try_acquire()
+    except Exception as e:
+        logger.error(f"👑 {name}: Redis недоступен: {e}")
+        return False
+    if not acquired:
+        return False
+    await _hold(lease, factory)
+    return True
+
+
+async def run_singleton(name: str, factory: Callable[[], Awaitable]):
+    """
+    Бесконечный фоновый цикл, который должен работать ровно на одной реплике.
+    Последователи каждые LEADER_RENEW_INTERVAL пробуют захватить аренду.
+    """
+    lease = LeaderLease(name)
+    while True:
+        try:
+            if await lease.try_acquire():
+                logger.info(f"👑 {name}: лидер — {INSTANCE_ID} (token={lease.token})")
+                finished = await _hold(lease, factory)
+                if finished:
+                    return
+        except asyncio.CancelledError:
+            await lease.release()
+            raise
+        except Exception as e:
+            logger.error(f"👑 {name}: ошибка выбора лидера: {e}")
+        await asyncio.sleep(LEADER_RENEW_INTERVAL)
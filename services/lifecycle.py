@@ -0,0 +1,108 @@
+# services/lifecycle.py — ПЛАВНАЯ ОСТАНОВКА: ДОЖИДАЕМСЯ НАЧАТЫХ ОТВЕТОВ, ПОТОМ ЗАКРЫВАЕМ ПУЛЫ
+
+import asyncio
+import logging
+import os
+from typing import Any, Awaitable, Callable, Iterable, Optional
+
+from aiogram import BaseMiddleware, Bot, Dispatcher
+from aiogram.types import Update
+from aiohttp import web
+
+import storage as st
+from services.broadcast import stop_broadcasts
+from services.redis_client import close_redis
+from services.yookassa_client import close_yookassa
+
+logger = logging.getLogger("VetBot.Lifecycle")
+
+# Сколько ждать начатые апдейты и рассылки при остановке, сек (меньше stop_grace_period контейнера)
+SHUTDOWN_DRAIN_TIMEOUT = float(os.getenv("SHUTDOWN_DRAIN_TIMEOUT", "25"))
+
+_draining = False
+# Задачи апдейтов, которые сейчас обрабатываются
+_updates: set[asyncio.Task] = set()
+
+
+def is_draining() -> bool:
+    """Идет остановка: новые запросы не принимаем, начатые доделываем"""
+    return _draining
+
+
+class UpdateTrackerMiddleware(BaseMiddleware):
+    """Запоминает задачи апдейтов в обработке — их дожидается drain()"""
+
+    async def __call__(
+        self,
+        handler: Callable[[Update, dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: dict[str, Any]
+    ) -> Any:
+        task = asyncio.current_task()
+        _updates.add(task)
+        try:
+            return await handler(event, data)
+        finally:
+            _updates.discard(task)
+
+
+def setup_update_tracker(dp: Dispatcher):
+    """Ставит учет апдейтов первым из наших middleware (до антифлуда и очереди пользователя)"""
+    dp.update.outer_middleware.unregister(dp.fsm)
+    dp.update.outer_middleware(UpdateTrackerMiddleware())
+    dp.update.outer_middleware(dp.fsm)
+
+
+async def drain(extra: Iterable[asyncio.Task] = ()):
+    """
+    Ждет начатые апдейты (AI, OCR, оплаты) и переданные задачи не дольше SHUTDOWN_DRAIN_TIMEOUT.
+    Не успевшие отменяются: AI-ответ при отмене уходит в очередь или возвращает лимит.
+    """
+    global _draining
+    _draining = True
+    current = asyncio.current_task()
+    tasks = {t for t in (_updates | set(extra)) if not t.done() and t is not current}
+    if not tasks:
+        return
+    logger.info(f"🛑 Остановка: дожидаемся {len(tasks)} задач (до {SHUTDOWN_DRAIN_TIMEOUT:.0f}с)")
+    _, pending = await asyncio.wait(tasks, timeout=SHUTDOWN_DRAIN_TIMEOUT)
+    if pending:
+        logger.warning(f"🛑 Не успели завершиться {len(pending)} задач — отменяем")
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+
+async def shutdown(
+    bot: Bot,
+    dp: Optional[Dispatcher] = None,
+    http_runner: Optional[web.AppRunner] = None,
+    background: Iterable[asyncio.Task] = (),
+):
+    """
+    Порядок остановки: прием апдейтов уже остановлен (polling завершен / вебхук отвечает 503) ->
+    доделываем апдейты и текущие порции рассылок -> отпускаем фоновые циклы (аренды лидера) ->
+    закрываем HTTP-сервер, пулы YooKassa, Redis, сессию бота и БД.
+    """
+    global _draining
+    _draining = True
+    await drain(stop_broadcasts())
+
+    background = [t for t in background if not t.done()]
+    for task in background:
+        task.cancel()
+    await asyncio.gather(*background, return_exceptions=True)
+
+    steps = []
+    if http_runner is not None:
+        steps.append(("http", http_runner.cleanup))
+    steps.append(("yookassa", close_yookassa))
+    if dp is not None:
+        steps.append(("fsm", dp.storage.close))
+    steps += [("bot", bot.session.close), ("redis", close_redis), ("db", st.close_db)]
+    for name, close in steps:
+        try:
+            await close()
+        except Exception as e:
+            logger.error(f"Error in shutdown ({name}): {e}")
+    logger.info("🛑 Остановка завершена")
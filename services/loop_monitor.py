@@ -0,0 +1,133 @@
+# services/loop_monitor.py — ЗАДЕРЖКА EVENT LOOP (ПРИЗНАК ПЕРЕГРУЗКИ) И ПОИСК БЛОКИРУЮЩИХ ВЫЗОВОВ
+
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from typing import Optional
+
+from services.metrics import Counter, Gauge, Histogram
+
+logger = logging.getLogger("VetBot.LoopMonitor")
+
+# Как часто измерять задержку, сек
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "0.5"))
+# Колбэк, занявший цикл дольше порога, — в лог со стеком вызова, мс (0 — сторож выключен)
+LOOP_BLOCK_THRESHOLD_MS = float(os.getenv("LOOP_BLOCK_THRESHOLD_MS", "250"))
+# Сглаживание: доля нового замера в скользящем среднем
+_EWMA_ALPHA = 0.3
+# Один и тот же стек повторно пишем не чаще, сек
+_STACK_REPEAT_SECONDS = 60
+_STACK_DEPTH = 25
+
+LOOP_LAG_SECONDS = Gauge("event_loop_lag_seconds", "Задержка event loop (сглаженная)")
+LOOP_LAG_SAMPLES = Histogram(
+    "event_loop_lag_sample_seconds", "Замеры задержки event loop",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+LOOP_BLOCKED_TOTAL = Counter("event_loop_blocked_total", "Блокировки event loop дольше LOOP_BLOCK_THRESHOLD_MS")
+LOOP_BLOCK_SECONDS = Histogram(
+    "event_loop_block_seconds", "Длительность блокировок event loop",
+    buckets=(0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+)
+
+_lag = 0.0
+
+
+def current_lag() -> float:
+    """Сглаженная задержка event loop, сек (0 — монитор не запущен или цикл свободен)"""
+    return _lag
+
+
+class _BlockWatchdog(threading.Thread):
+    """
+    Сторож в отдельном потоке: ставит в цикл пустой колбэк и ждет его не дольше порога.
+    Не дождался — цикл занят синхронным кодом: снимаем стек потока цикла прямо во время
+    блокировки (в отличие от asyncio debug, который знает только имя колбэка и только после).
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, threshold: float):
+        super().__init__(name="loop-watchdog", daemon=True)
+        self.loop = loop
+        self.threshold = threshold
+        self.loop_thread_id = threading.get_ident()
+        self._stop_event = threading.Event()
+        self._pong = threading.Event()
+        self._last_logged: dict[str, float] = {}
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            self._pong.clear()
+            sent = time.monotonic()
+            try:
+                self.loop.call_soon_threadsafe(self._pong.set)
+            except RuntimeError:
+                return  # цикл закрыт
+            if not self._pong.wait(self.threshold):
+                self._report(sent)
+            self._stop_event.wait(self.threshold)
+
+    def _report(self, sent: float):
+        LOOP_BLOCKED_TOTAL.inc()
+        stack = self._loop_stack()
+        # Дожидаемся, пока цикл освободится; длительность — от отправки колбэка (оценка снизу)
+        while not self._pong.wait(1.0):
+            if self._stop_event.is_set():
+                return
+        blocked = time.monotonic() - sent
+        LOOP_BLOCK_SECONDS.observe(blocked)
+
+        now = time.monotonic()
+        if now - self._last_logged.get(stack, 0.0) < _STACK_REPEAT_SECONDS:
+            logger.warning(f"🐌 Event loop заблокирован на {blocked * 1000:.0f}+ мс (тот же стек, что выше)")
+            return
+        self._last_logged = {s: t for s, t in self._last_logged.items() if now - t < _STACK_REPEAT_SECONDS}
+        self._last_logged[stack] = now
+        logger.warning(f"🐌 Event loop заблокирован на {blocked * 1000:.0f}+ мс, стек в момент блокировки:\n{stack}")
+
+    def _loop_stack(self) -> str:
+        frame = sys._current_frames().get(self.loop_thread_id)
+        if frame is None:
+            return "<стек недоступен>"
+        frames = traceback.extract_stack(frame)
+        # Кадры самого asyncio (run_forever -> _run_once -> Handle._run) одинаковы всегда — отрезаем
+        for i in range(len(frames) - 1, -1, -1):
+            if frames[i].name == "_run" and frames[i].filename.endswith(os.path.join("asyncio", "events.py")):
+                frames = frames[i + 1:]
+                break
+        return "".join(traceback.format_list(frames[-_STACK_DEPTH:])).rstrip()
+
+
+def _start_watchdog() -> Optional[_BlockWatchdog]:
+    if LOOP_BLOCK_THRESHOLD_MS <= 0:
+        return None
+    watchdog = _BlockWatchdog(asyncio.get_running_loop(), LOOP_BLOCK_THRESHOLD_MS / 1000)
+    watchdog.start()
+    return watchdog
+
+
+async def run_loop_monitor():
+    """
+    Спит LOOP_LAG_INTERVAL и смотрит, насколько позже проснулся: опоздание —
+    это время, которое цикл был занят чужими колбэками (CPU, синхронный код, тысячи задач).
+    Заодно запускает сторожа, который пишет стеки блокирующих вызовов.
+    """
+    global _lag
+    watchdog = _start_watchdog()
+    try:
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(LOOP_LAG_INTERVAL)
+            lag = max(0.0, time.monotonic() - started - LOOP_LAG_INTERVAL)
+            LOOP_LAG_SAMPLES.observe(lag)
+            _lag = _EWMA_ALPHA * lag + (1 - _EWMA_ALPHA) * _lag
+            LOOP_LAG_SECONDS.set(_lag)
+    finally:
+        if watchdog is not None:
+            watchdog.stop()
@@ -0,0 +1,188 @@
+# services/metrics.py — ПРОСТЫЕ МЕТРИКИ ПРОЦЕССА (счетчики, гистограммы, в формате Prometheus)
+
+import inspect
+import logging
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Awaitable, Callable, Dict, List, Tuple, Union
+
+logger = logging.getLogger("VetBot.Metrics")
+
+LabelValues = Tuple[str, ...]
+
+# Границы по умолчанию для задержек, сек
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_REGISTRY: List["_Metric"] = []
+_REGISTRY_LOCK = threading.Lock()
+# Функции, обновляющие gauges перед выдачей (длина очереди, занятость пулов) — см. add_collector
+_COLLECTORS: List[Callable[[], Union[None, Awaitable[None]]]] = []
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: LabelValues, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric(ABC):
+    kind = ""
+
+    def __init__(self, name: str, doc: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.doc = doc
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        with _REGISTRY_LOCK:
+            _REGISTRY.append(self)
+
+    def _key(self, labels: dict) -> LabelValues:
+        return tuple(str(labels.get(n, "")) for n in self.labels)
+
+    @abstractmethod
+    def render(self) -> List[str]:
+        """Строки экспозиции Prometheus (без HELP/TYPE)"""
+
+
+class Counter(_Metric):
+    """Монотонный счетчик"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, doc: str, labels: Tuple[str, ...] = ()):
+        super().__init__(name, doc, labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labels, k)} {v}" for k, v in items]
+
+
+class Gauge(_Metric):
+    """Текущее значение (может расти и падать)"""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, doc: str, labels: Tuple[str, ...] = ()):
+        super().__init__(name, doc, labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = float(value)
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labels, k)} {v}" for k, v in items]
+
+
+class Histogram(_Metric):
+    """Распределение значений (задержки) по фиксированным корзинам"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, doc: str, labels: Tuple[str, ...] = (), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, doc, labels)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [counts по корзинам..., sum, count]
+        self._values: Dict[LabelValues, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            row = self._values.get(key)
+            if row is None:
+                row = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    row[i] += 1
+            row[-2] += value
+            row[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """with HIST.time(stage="decode"): ... — наблюдает длительность блока"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels) -> int:
+        row = self._values.get(self._key(labels))
+        return row[-1] if row else 0
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = [(k, list(v)) for k, v in self._values.items()]
+        lines = []
+        for key, row in items:
+            for bound, cnt in zip(self.buckets, row):
+                le = 'le="%s"' % bound
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cnt}")
+            le_inf = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le_inf)} {row[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {row[-2]}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {row[-1]}")
+        return lines
+
+
+# Общие для всех пулов (соединения БД, слоты вебхука, бюджет загрузок — в байтах): занято / всего
+POOL_IN_USE = Gauge("pool_in_use", "Занято в пуле", ("pool",))
+POOL_SIZE = Gauge("pool_size", "Размер пула", ("pool",))
+
+
+def add_collector(func: Callable[[], Union[None, Awaitable[None]]]):
+    """Регистрирует функцию (обычную или async), которая обновляет gauges перед каждой выдачей метрик"""
+    _COLLECTORS.append(func)
+
+
+async def collect():
+    """Вызывает все коллекторы; ошибка одного не мешает остальным"""
+    for func in list(_COLLECTORS):
+        try:
+            result = func()
+            if inspect.isawaitable(result):
+                await result
+        except Exception as e:
+            logger.warning(f"📈 Коллектор {getattr(func, '__name__', func)} не отработал: {e}")
+
+
+def render_prometheus() -> str:
+    """Все зарегистрированные метрики в текстовом формате Prometheus"""
+    with _REGISTRY_LOCK:
+        metrics = list(_REGISTRY)
+    out = []
+    for m in metrics:
+        out.append(f"# HELP {m.name} {m.doc}")
+        out.append(f"# TYPE {m.name} {m.kind}")
+        out.extend(m.render())
+    return "\n".join(out) + "\n"
@@ -0,0 +1,118 @@
+# services/payment_tracker.py — ТОЧЕЧНОЕ ОТСЛЕЖИВАНИЕ ПЛАТЕЖЕЙ, СОЗДАННЫХ БОТОМ
+
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Optional
+
+from aiogram import Bot
+
+import storage as st
+from services.payments import activate_payment
+from services.yookassa_client import get_yookassa, is_configured
+
+logger = logging.getLogger("VetBot.PaymentTracker")
+
+# Первая проверка через столько секунд после создания, дальше интервал удваивается
+PENDING_FIRST_CHECK = int(os.getenv("PENDING_FIRST_CHECK", "10"))
+# Потолок интервала между проверками одного платежа
+PENDING_MAX_INTERVAL = int(os.getenv("PENDING_MAX_INTERVAL", "300"))
+# Сколько живет неоплаченный платеж, после этого перестаем его проверять
+PENDING_PAYMENT_TTL = int(os.getenv("PENDING_PAYMENT_TTL", str(2 * 60 * 60)))
+# Сколько платежей проверяем за один проход (параллельно)
+PENDING_BATCH = 20
+# Как часто просыпаться, даже если ничего не запланировано
+_IDLE_SLEEP = 30
+
+_wakeup: Optional[asyncio.Event] = None
+
+
+def _iso(dt: datetime) -> str:
+    return dt.replace(microsecond=0).isoformat()
+
+
+def next_interval(attempts: int) -> int:
+    """10с, 20с, 40с, … до PENDING_MAX_INTERVAL: часто сразу после создания, реже потом"""
+    return min(PENDING_MAX_INTERVAL, PENDING_FIRST_CHECK * 2 ** attempts)
+
+
+async def track_payment(payment_id: str, user_id: int, tier: str):
+    """Ставит платеж на отслеживание (вызывается сразу после создания)"""
+    now = datetime.now()
+    await st.add_pending_payment(
+        payment_id,
+        user_id,
+        tier,
+        next_check_at=_iso(now + timedelta(seconds=PENDING_FIRST_CHECK)),
+        expires_at=_iso(now + timedelta(seconds=PENDING_PAYMENT_TTL)),
+    )
+    if _wakeup is not None:
+        _wakeup.set()
+
+
+async def _check(bot: Bot, pending) -> Optional[str]:
+    """Проверяет один платеж. Возвращает payment_id, если его пора снять с отслеживания"""
+    now = datetime.now()
+    try:
+        payment = await get_yookassa().get_payment(pending.payment_id)
+    except Exception as e:
+        logger.warning(f"💳 Pending {pending.payment_id}: ошибка запроса {e!r}")
+        payment = None
+
+    status = (payment or {}).get("status")
+    if status == "succeeded":
+        if await activate_payment(bot, payment):
+            age = (now - datetime.fromisoformat(pending.created_at)).total_seconds()
+            logger.info(f"💳 Pending {pending.payment_id}: активирован через {age:.0f}с после создания")
+        return pending.payment_id
+    if status == "canceled":
+        logger.info(f"💳 Pending {pending.payment_id}: отменен")
+        return pending.payment_id
+    if now >= datetime.fromisoformat(pending.expires_at):
+        logger.info(f"💳 Pending {pending.payment_id}: истек без оплаты (status={status})")
+        return pending.payment_id
+
+    attempts = (pending.attempts or 0) + 1
+    await st.reschedule_pending_payment(
+        pending.payment_id, _iso(now + timedelta(seconds=next_interval(attempts))), attempts
+    )
+    return None
+
+
+async def _sleep_until_next():
+    """Спим до ближайшей запланированной проверки или до нового платежа"""
+    next_at = await st.get_next_pending_check_at()
+    timeout = _IDLE_SLEEP
+    if next_at:
+        timeout = min(_IDLE_SLEEP, max(0.5, (datetime.fromisoformat(next_at) - datetime.now()).total_seconds()))
+    try:
+        await asyncio.wait_for(_wakeup.wait(), timeout=timeout)
+    except asyncio.TimeoutError:
+        pass
+    _wakeup.clear()
+
+
+async def pending_payments_loop(bot: Bot):
+    """
+    Опрашивает только открытые платежи бота по их id — задержка активации
+    не зависит от общего потока платежей магазина.
+    """
+    global _wakeup
+    if not is_configured():
+        return
+    _wakeup = asyncio.Event()
+    logger.info("💳 Отслеживание созданных платежей запущено")
+
+    while True:
+        try:
+            due = await st.get_due_pending_payments(_iso(datetime.now()), limit=PENDING_BATCH)
+            if due:
+                finished = await asyncio.gather(*(_check(bot, p) for p in due))
+                await st.delete_pending_payments([pid for pid in finished if pid])
+                if len(due) == PENDING_BATCH:
+                    continue
+            await _sleep_until_next()
+        except Exception as e:
+            logger.error(f"Error in pending_payments_loop: {e}")
+            await asyncio.sleep(_IDLE_SLEEP)
@@ -0,0 +1,160 @@
+# services/payments.py — АКТИВАЦИЯ ОПЛАТ YOOKASSA (общая для вебхука и сверки)
+
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Any, Optional
+
+from aiogram import Bot
+
+import storage as st
+from services.metrics import Histogram
+
+logger = logging.getLogger("VetBot.Payments")
+
+# От создания платежа в YooKassa до начисления (вебхук — секунды, сверка — минуты)
+ACTIVATION_DELAY_SECONDS = Histogram(
+    "payment_activation_delay_seconds", "Задержка активации оплаты", ("tier",),
+    buckets=(1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600, 7200),
+)
+
+
+def _get(obj: Any, name: str, default=None):
+    """Поле из dict (JSON API/уведомления) или из объекта с атрибутами"""
+    if isinstance(obj, dict):
+        return obj.get(name, default)
+    return getattr(obj, name, default)
+
+
+def payment_fields(payment: Any) -> Optional[dict]:
+    """
+    Нормализует платеж YooKassa (JSON API или уведомления) в dict для activate_payment.
+    Возвращает None, если в платеже нет наших метаданных.
+    """
+    metadata = _get(payment, "metadata") or {}
+    user_id = metadata.get("user_id")
+    tier = metadata.get("tier") or metadata.get("plan")
+    payment_id = _get(payment, "id")
+    if not user_id or not tier or not payment_id:
+        return None
+
+    amount = None
+    amount_obj = _get(payment, "amount")
+    if amount_obj is not None:
+        try:
+            amount = float(_get(amount_obj, "value", 0) or 0)
+        except Exception:
+            amount = None
+
+    return {
+        "payment_id": str(payment_id),
+        "user_id": int(user_id),
+        "tier": str(tier),
+        "created_at": str(_get(payment, "created_at", "") or ""),
+        "amount": amount,
+        "status": str(_get(payment, "status", "succeeded") or "succeeded"),
+    }
+
+
+async def activate_payment(bot: Bot, payment: Any) -> bool:
+    """
+    Начисляет покупку по успешному платежу и уведомляет пользователя.
+    Идемпотентно: повторный вызов для того же payment_id ничего не делает.
+    Возвращает True, если платеж активирован именно этим вызовом.
+    """
+    fields = payment_fields(payment)
+    if not fields or fields["status"] != "succeeded":
+        return False
+
+    is_new = await st.mark_yookassa_payment_processed(
+        fields["payment_id"],
+        fields["user_id"],
+        fields["tier"],
+        fields["created_at"],
+        amount=fields["amount"],
+        status=fields["status"],
+    )
+    if not is_new:
+        return False
+
+    await _grant(bot, fields)
+    await st.delete_pending_payments([fields["payment_id"]])
+    return True
+
+
+async def activate_payments_batch(bot: Bot, payments: list) -> int:
+    """
+    Пакетная активация страницы платежей: дедупликация одним запросом
+    (INSERT ... ON CONFLICT DO NOTHING RETURNING), начисление — только новым.
+    Если начисление упало, заявка на платеж снимается, и его подберет следующая сверка.
+    Возвращает количество активированных.
+    """
+    candidates = [f for f in (payment_fields(p) for p in payments) if f and f["status"] == "succeeded"]
+    if not candidates:
+        return 0
+    claimed = await st.claim_new_yookassa_payments(candidates)
+    granted = []
+    for fields in candidates:
+        if fields["payment_id"] not in claimed:
+            continue
+        try:
+            await _grant(bot, fields)
+        except Exception as e:
+            logger.error(f"❌ Не удалось начислить платеж {fields['payment_id']}: {e}")
+            try:
+                await st.release_yookassa_payment(fields["payment_id"])
+            except Exception as e_release:
+                logger.error(f"❌ Не удалось снять заявку на платеж {fields['payment_id']}: {e_release}")
+            continue
+        granted.append(fields["payment_id"])
+    await st.delete_pending_payments(granted)
+    return len(granted)
+
+
+def _observe_delay(fields: dict):
+    try:
+        created = datetime.fromisoformat(fields["created_at"].replace("Z", "+00:00"))
+    except ValueError:
+        return
+    if created.tzinfo is None:
+        return
+    delay = (datetime.now(timezone.utc) - created).total_seconds()
+    ACTIVATION_DELAY_SECONDS.observe(max(0.0, delay), tier=fields["tier"])
+
+
+async def _grant(bot: Bot, fields: dict):
+    """Начисление по уже «застолбленному» платежу"""
+    user_id = fields["user_id"]
+    tier = fields["tier"]
+    logger.info(f"💳 Платеж {fields['payment_id']} активирован: user={user_id}, tier={tier}")
+    _observe_delay(fields)
+
+    # Обработка разовой покупки
+    if tier == "one_time_analysis":
+        await st.increment_balance_analyses(user_id, 1)
+        try:
+            text = (
+                f"🎉 *Покупка успешна!*\n\n"
+                f"Вам начислена *1 расшифровка* анализов.\n"
+                f"Используйте её, отправив фото или документ с анализами.\n\n"
+                "Спасибо за поддержку!"
+            )
+            await bot.send_message(user_id, text, parse_mode="Markdown")
+        except Exception as e_send:
+            logger.warning("Не удалось отправить уведомление: %r", e_send)
+        return
+
+    # Обработка подписки
+    end_dt = (datetime.now() + timedelta(days=30)).replace(microsecond=0)
+    await st.set_user_paid(user_id, end_dt.isoformat(), tier)
+
+    plan_name = "PRO 💜" if tier == "pro" else "PLUS 💙"
+    try:
+        text = (
+            f"🎉 *Подписка активирована!*\n\n"
+            f"Тариф: *{plan_name}*\n"
+            f"Доступ активен до: *{end_dt.strftime('%Y-%m-%d')}*\n\n"
+            "Спасибо за поддержку — это помогает развивать бота."
+        )
+        await bot.send_message(user_id, text, parse_mode="Markdown")
+    except Exception as e_send:
+        logger.warning("Не удалось отправить уведомление: %r", e_send)
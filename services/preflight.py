@@ -0,0 +1,116 @@
+# services/preflight.py — ЛОКАЛЬНАЯ ПРОВЕРКА ФОТО ДО СПИСАНИЯ ЛИМИТА
+
+import os
+from dataclasses import dataclass, field
+
+import numpy as np
+from PIL import Image
+
+# Размер, до которого ужимаем картинку для метрик (по длинной стороне)
+PREFLIGHT_SIDE = 512
+
+# Пороги отбраковки (можно подкрутить через .env)
+PREFLIGHT_MIN_BRIGHTNESS = float(os.getenv("PREFLIGHT_MIN_BRIGHTNESS", "18"))
+PREFLIGHT_MAX_CLIPPED = float(os.getenv("PREFLIGHT_MAX_CLIPPED", "0.9"))
+# «Пустой» кадр — контраст почти нулевой; размытый снимок тоже малоконтрастен, но заметно выше
+PREFLIGHT_BLANK_CONTRAST = float(os.getenv("PREFLIGHT_BLANK_CONTRAST", "2"))
+PREFLIGHT_MIN_SHARPNESS = float(os.getenv("PREFLIGHT_MIN_SHARPNESS", "12"))
+# Документ почти всегда светлый, бесцветный и «исписанный» мелкими перепадами
+DOCUMENT_MIN_PAPER_RATIO = 0.45
+DOCUMENT_MAX_SATURATION = 0.12
+DOCUMENT_MIN_TEXT_DENSITY = 0.005
+
+
+@dataclass
+class PreflightResult:
+    ok: bool
+    kind: str  # 'document' | 'photo'
+    reason: str = ""  # 'dark' | 'overexposed' | 'blank' | 'blurry' | 'too_large'
+    metrics: dict = field(default_factory=dict)
+
+    @property
+    def is_document(self) -> bool:
+        return self.kind == "document"
+
+
+REJECT_MESSAGES = {
+    "dark": "🌑 Снимок слишком темный — на нем ничего не видно.",
+    "overexposed": "☀️ Снимок пересвечен — детали не различить.",
+    "blank": "⬜ Похоже, изображение пустое (однотонное).",
+    "blurry": "🌫 Снимок слишком размытый — текст и детали не читаются.",
+    "too_large": "📦 Файл слишком большой для обработки.",
+}
+
+
+def _laplacian_variance(gray: np.ndarray) -> float:
+    """Дисперсия 4-связного лапласиана — классическая метрика резкости"""
+    if gray.shape[0] < 3 or gray.shape[1] < 3:
+        return 0.0
+    lap = (
+        gray[:-2, 1:-1] + gray[2:, 1:-1] + gray[1:-1, :-2] + gray[1:-1, 2:]
+        - 4.0 * gray[1:-1, 1:-1]
+    )
+    return float(lap.var())
+
+
+def _text_density(gray: np.ndarray) -> float:
+    """Доля пикселей с резким перепадом яркости (штрихи букв/цифр)"""
+    if gray.shape[0] < 2 or gray.shape[1] < 2:
+        return 0.0
+    gx = np.abs(np.diff(gray, axis=1))[:-1, :]
+    gy = np.abs(np.diff(gray, axis=0))[:, :-1]
+    return float(((gx + gy) > 60.0).mean())
+
+
+def preflight_image(img: Image.Image) -> PreflightResult:
+    """
+    Дешевая проверка пригодности снимка (векторизовано, на уменьшенной копии):
+    экспозиция, контраст, резкость и «похожесть на документ».
+    """
+    small = img.copy()
+    small.thumbnail((PREFLIGHT_SIDE, PREFLIGHT_SIDE), Image.Resampling.BILINEAR)
+
+    if small.mode in ("RGB", "RGBA", "P", "CMYK", "YCbCr"):
+        rgb = np.asarray(small.convert("RGB"), dtype=np.float32)
+        saturation = float(((rgb.max(axis=2) - rgb.min(axis=2)) / 255.0).mean())
+    else:
+        saturation = 0.0
+    gray = np.asarray(small.convert("L"), dtype=np.float32)
+
+    brightness = float(gray.mean())
+    contrast = float(gray.std())
+    sharpness = _laplacian_variance(gray)
+    text_density = _text_density(gray)
+    paper_ratio = float((gray > 180.0).mean())
+    clipped = float((gray >= 250.0).mean())
+
+    metrics = {
+        "brightness": round(brightness, 1),
+        "contrast": round(contrast, 1),
+        "sharpness": round(sharpness, 1),
+        "text_density": round(text_density, 4),
+        "paper_ratio": round(paper_ratio, 3),
+        "clipped": round(clipped, 3),
+        "saturation": round(saturation, 3),
+    }
+
+    is_document = (
+        paper_ratio >= DOCUMENT_MIN_PAPER_RATIO
+        and saturation <= DOCUMENT_MAX_SATURATION
+        and text_density >= DOCUMENT_MIN_TEXT_DENSITY
+    )
+    kind = "document" if is_document else "photo"
+
+    # Однотонный кадр: контраста нет вовсе (низкая резкость при заметном контрасте — это размытие)
+    if contrast < PREFLIGHT_BLANK_CONTRAST:
+        reason = "dark" if brightness < PREFLIGHT_MIN_BRIGHTNESS else "blank"
+        return PreflightResult(ok=False, kind=kind, reason=reason, metrics=metrics)
+    if brightness < PREFLIGHT_MIN_BRIGHTNESS:
+        return PreflightResult(ok=False, kind=kind, reason="dark", metrics=metrics)
+    if sharpness < PREFLIGHT_MIN_SHARPNESS:
+        return PreflightResult(ok=False, kind=kind, reason="blurry", metrics=metrics)
+    # Белый лист с текстом — норма; пересвет — когда выбито почти всё и штрихов не осталось
+    if clipped > PREFLIGHT_MAX_CLIPPED and text_density < DOCUMENT_MIN_TEXT_DENSITY:
+        return PreflightResult(ok=False, kind=kind, reason="overexposed", metrics=metrics)
+
+    return PreflightResult(ok=True, kind=kind, metrics=metrics)
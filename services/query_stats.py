@@ -0,0 +1,139 @@
+# services/query_stats.py — СКОЛЬКО SQL-ЗАПРОСОВ СТОИТ АПДЕЙТ: СЧЕТЧИК, МЕДЛЕННЫЕ ЗАПРОСЫ, ПРОВЕРКИ N+1
+
+import logging
+import os
+import re
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Optional
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from services.metrics import Counter, Histogram
+
+logger = logging.getLogger("VetBot.SQL")
+
+# Запросы дольше порога пишем в лог (параметры скрыты), мс; 0 — не писать
+DB_SLOW_QUERY_MS = float(os.getenv("DB_SLOW_QUERY_MS", "200"))
+# Апдейт с большим числом запросов — предупреждение в лог (0 — не проверять)
+DB_QUERY_BUDGET = int(os.getenv("DB_QUERY_BUDGET", "30"))
+_STATEMENT_LOG_LEN = 500
+
+QUERIES_PER_SCOPE = Histogram(
+    "db_queries_per_update", "SQL-запросов на апдейт или задание", ("type",),
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89),
+)
+QUERY_SECONDS_PER_SCOPE = Histogram("db_seconds_per_update", "Время SQL-запросов на апдейт или задание", ("type",))
+SLOW_QUERIES_TOTAL = Counter("db_slow_queries_total", "SQL-запросы дольше DB_SLOW_QUERY_MS", ("verb",))
+
+
+class QueryStats:
+    """Запросы одной области (апдейт, задание, блок теста); capture — сохранять тексты для отчета"""
+
+    __slots__ = ("count", "seconds", "statements", "capture")
+
+    def __init__(self, capture: bool = False):
+        self.count = 0
+        self.seconds = 0.0
+        self.statements: list[str] = []
+        self.capture = capture
+
+
+# SQLAlchemy переносит контекст в greenlet, где выполняется драйвер, — хуки видят ту же область
+_current: ContextVar[Optional[QueryStats]] = ContextVar("query_stats", default=None)
+_WS = re.compile(r"\s+")
+
+
+def _short(statement: str) -> str:
+    text = _WS.sub(" ", statement).strip()
+    return text if len(text) <= _STATEMENT_LOG_LEN else text[:_STATEMENT_LOG_LEN] + "…"
+
+
+def _redact(params: Any) -> Any:
+    """Значения параметров не логируем (персональные данные, платежи) — только типы"""
+    if isinstance(params, dict):
+        return {k: type(v).__name__ for k, v in params.items()}
+    if isinstance(params, (list, tuple)):
+        if params and isinstance(params[0], (dict, list, tuple)):
+            return f"[{len(params)} строк] {_redact(params[0])}"
+        return [type(v).__name__ for v in params]
+    return type(params).__name__
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info["query_started"].pop()
+    elapsed = time.perf_counter() - started
+    stats = _current.get()
+    if stats is not None:
+        stats.count += 1
+        stats.seconds += elapsed
+        if stats.capture:
+            stats.statements.append(_short(statement))
+    if DB_SLOW_QUERY_MS and elapsed * 1000 >= DB_SLOW_QUERY_MS:
+        verb = statement.lstrip().split(" ", 1)[0].upper() or "?"
+        SLOW_QUERIES_TOTAL.inc(verb=verb)
+        logger.warning(f"🐢 SQL {elapsed * 1000:.0f} мс: {_short(statement)} | параметры: {_redact(parameters)}")
+
+
+def _handle_error(exception_context):
+    # Упавший запрос не доходит до after_cursor_execute — снимаем его отметку времени
+    conn = exception_context.connection
+    if conn is not None and conn.info.get("query_started"):
+        conn.info["query_started"].pop()
+
+
+def install(engine: AsyncEngine):
+    """Вешает хуки на движок (вызывается из storage.init_db)"""
+    sync_engine = engine.sync_engine
+    event.listen(sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(sync_engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(sync_engine, "handle_error", _handle_error)
+
+
+@contextmanager
+def query_scope(kind: str, capture: bool = False):
+    """
+    Считает SQL-запросы внутри блока (апдейт `update.message`, задание `job.answer`).
+    Вложенная область не сбрасывает внешнюю: запросы попадают в обе.
+    """
+    outer = _current.get()
+    stats = QueryStats(capture)
+    token = _current.set(stats)
+    try:
+        yield stats
+    finally:
+        _current.reset(token)
+        if outer is not None:
+            outer.count += stats.count
+            outer.seconds += stats.seconds
+            if outer.capture:
+                outer.statements.extend(stats.statements)
+        if kind:
+            QUERIES_PER_SCOPE.observe(stats.count, type=kind)
+            QUERY_SECONDS_PER_SCOPE.observe(stats.seconds, type=kind)
+            if DB_QUERY_BUDGET and stats.count > DB_QUERY_BUDGET:
+                logger.warning(f"🐢 {kind}: {stats.count} SQL-запросов ({stats.seconds * 1000:.0f} мс) — похоже на N+1")
+
+
+def current_query_count() -> int:
+    stats = _current.get()
+    return stats.count if stats else 0
+
+
+@contextmanager
+def assert_max_queries(limit: int):
+    """
+    Для тестов: `with assert_max_queries(3): await handler(...)`.
+    Больше limit запросов — AssertionError со списком выполненных запросов.
+    """
+    with query_scope("", capture=True) as stats:
+        yield stats
+    if stats.count > limit:
+        listing = "\n".join(f"  {i}. {s}" for i, s in enumerate(stats.statements, 1))
+        raise AssertionError(f"Ожидалось не больше {limit} SQL-запросов, выполнено {stats.count}:\n{listing}")
@@ -0,0 +1,31 @@
+# services/redis_client.py — ОБЩИЙ ПУЛ СОЕДИНЕНИЙ REDIS
+
+import logging
+from typing import Optional
+
+from redis.asyncio import Redis
+
+import config
+
+logger = logging.getLogger("VetBot.Redis")
+
+_redis: Optional[Redis] = None
+
+
+def get_redis() -> Redis:
+    """Общий клиент Redis (один пул на процесс, создается лениво)"""
+    global _redis
+    if _redis is None:
+        _redis = Redis.from_url(config.REDIS_URL, decode_responses=True)
+    return _redis
+
+
+async def close_redis():
+    """Закрывает пул (вызывается при остановке бота)"""
+    global _redis
+    if _redis is not None:
+        try:
+            await _redis.aclose()
+        except Exception as e:
+            logger.error(f"Error in close_redis: {e}")
+        _redis = None
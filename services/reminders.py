@@ -0,0 +1,192 @@
+# services/reminders.py — НАПОМИНАНИЯ О ВАКЦИНАЦИИ И КЛЕЩАХ ПО РАСПИСАНИЮ
+
+import asyncio
+import logging
+import os
+from datetime import date, datetime, timedelta
+from typing import Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+
+import storage as st
+from services.broadcast import TokenBucket
+from services.leader import fencing_token
+
+logger = logging.getLogger("VetBot.Reminders")
+
+# Во сколько (по местному времени) рассылать напоминания, HH:MM
+REMINDER_TIME = os.getenv("REMINDER_TIME", "10:00")
+# Часовой пояс расписания (пусто — время сервера)
+REMINDER_TZ = os.getenv("REMINDER_TZ", "")
+# Сколько пропущенных дней (бот был выключен) догонять при запуске
+REMINDER_CATCHUP_DAYS = int(os.getenv("REMINDER_CATCHUP_DAYS", "2"))
+REMINDER_RATE = float(os.getenv("REMINDER_RATE", "20"))
+REMINDER_WORKERS = int(os.getenv("REMINDER_WORKERS", "8"))
+# Напоминание, «занятое» дольше этого срока и так и не отправленное (процесс упал), отправляем заново, сек
+REMINDER_CLAIM_TIMEOUT = int(os.getenv("REMINDER_CLAIM_TIMEOUT", "600"))
+# Сколько напоминаний занимаем в журнале одним запросом
+_CLAIM_BATCH = 100
+
+LAST_RUN_KEY = "reminders:last_date"
+
+_TEXTS = {
+    "vaccine": "💉 **Напоминание:** Сегодня у питомца **{name}** плановая вакцинация!",
+    "tick": "🕷 **Напоминание:** Пора обработать **{name}** от клещей и блох!",
+}
+_LATE_TEXTS = {
+    "vaccine": "💉 **Напоминание:** {day} у питомца **{name}** была запланирована вакцинация. Не забудьте!",
+    "tick": "🕷 **Напоминание:** {day} нужно было обработать **{name}** от клещей и блох. Не забудьте!",
+}
+
+
+def _load_tz():
+    if not REMINDER_TZ:
+        return None
+    try:
+        from zoneinfo import ZoneInfo
+        return ZoneInfo(REMINDER_TZ)
+    except Exception as e:
+        logger.warning(f"⏰ Неизвестный REMINDER_TZ={REMINDER_TZ!r} ({e}), используем время сервера")
+        return None
+
+
+_TZ = _load_tz()
+
+
+def _now() -> datetime:
+    return datetime.now(_TZ).replace(tzinfo=None) if _TZ else datetime.now()
+
+
+def _send_time() -> tuple[int, int]:
+    hours, minutes = REMINDER_TIME.split(":")
+    return int(hours), int(minutes)
+
+
+def next_run_at(now: datetime) -> datetime:
+    """Ближайший момент рассылки (сегодня, если время еще не наступило, иначе завтра)"""
+    hours, minutes = _send_time()
+    run_at = now.replace(hour=hours, minute=minutes, second=0, microsecond=0)
+    return run_at if run_at > now else run_at + timedelta(days=1)
+
+
+def _text(kind: str, name: str, due_date: str, today: date) -> str:
+    name = name or "питомец"
+    if due_date == today.isoformat():
+        return _TEXTS[kind].format(name=name)
+    return _LATE_TEXTS[kind].format(name=name, day=date.fromisoformat(due_date).strftime("%d.%m"))
+
+
+async def _deliver(bot: Bot, user_id: int, text: str, bucket: TokenBucket) -> bool:
+    for _ in range(3):
+        await bucket.acquire()
+        try:
+            await bot.send_message(user_id, text)
+            return True
+        except TelegramRetryAfter as e:
+            bucket.pause(e.retry_after)
+        except (TelegramForbiddenError, TelegramBadRequest):
+            return False
+        except Exception as e:
+            logger.error(f"Error in reminders send_message: {e}")
+            return False
+    return False
+
+
+async def dispatch(bot: Bot, dates: list[str], today: date) -> tuple[int, int]:
+    """
+    Отправляет напоминания на даты dates. Каждое напоминание сначала «занимается»
+    в reminder_deliveries — повторный запуск или вторая реплика его не отправят.
+    Возвращает (sent, failed).
+    """
+    due = await st.get_due_pet_reminders(dates)
+    bucket = TokenBucket(REMINDER_RATE)
+    sent = failed = 0
+
+    for i in range(0, len(due), _CLAIM_BATCH):
+        batch = due[i:i + _CLAIM_BATCH]
+        claimed = await st.claim_reminder_deliveries(
+            [(pet_id, user_id, kind, due_date) for pet_id, user_id, _, kind, due_date in batch],
+            reclaim_after=REMINDER_CLAIM_TIMEOUT,
+        )
+        queue: asyncio.Queue = asyncio.Queue()
+        for pet_id, user_id, name, kind, due_date in batch:
+            delivery_id = claimed.get((pet_id, kind, due_date))
+            if delivery_id:
+                queue.put_nowait((delivery_id, user_id, _text(kind, name, due_date, today)))
+        if queue.empty():
+            continue
+
+        ok_ids, failed_ids = [], []
+
+        async def worker():
+            while not queue.empty():
+                delivery_id, user_id, text = queue.get_nowait()
+                (ok_ids if await _deliver(bot, user_id, text, bucket) else failed_ids).append(delivery_id)
+
+        await asyncio.gather(*(worker() for _ in range(min(REMINDER_WORKERS, queue.qsize()))))
+        await st.set_reminder_delivery_status(ok_ids, "sent")
+        await st.set_reminder_delivery_status(failed_ids, "failed")
+        sent += len(ok_ids)
+        failed += len(failed_ids)
+
+    return sent, failed
+
+
+def _dates_to_send(today: date, last_run: Optional[str]) -> list[str]:
+    """Сегодня плюс пропущенные дни после последнего запуска (не больше REMINDER_CATCHUP_DAYS)"""
+    if not last_run:
+        # Первый запуск: догонять нечего
+        return [today.isoformat()]
+    first = today - timedelta(days=REMINDER_CATCHUP_DAYS)
+    try:
+        first = max(first, date.fromisoformat(last_run) + timedelta(days=1))
+    except ValueError:
+        pass
+    days = (today - first).days
+    return [(first + timedelta(days=i)).isoformat() for i in range(days + 1)] if days >= 0 else []
+
+
+async def run_once(bot: Bot) -> bool:
+    """
+    Рассылка за сегодня и пропущенные дни. Возвращает False, если часть напоминаний
+    осталась «занятой» упавшим процессом — их стоит добрать после REMINDER_CLAIM_TIMEOUT.
+    """
+    today = _now().date()
+    dates = _dates_to_send(today, await st.get_bot_state(LAST_RUN_KEY))
+    if not dates:
+        return True
+    sent, failed = await dispatch(bot, dates, today)
+    stuck = await st.count_claimed_reminder_deliveries(dates)
+    logger.info(f"⏰ Напоминания за {dates[0]}…{dates[-1]}: отправлено {sent}, ошибок {failed}")
+    if stuck:
+        # Дату не записываем: следующий запуск повторит эти дни и заберет зависшие записи
+        logger.warning(f"⏰ {stuck} напоминаний заняты, но не отправлены — повторим через {REMINDER_CLAIM_TIMEOUT} с")
+        return False
+    if not await st.set_bot_state(LAST_RUN_KEY, today.isoformat(), fence=fencing_token()):
+        logger.warning("⏰ Дата последней рассылки уже записана новым лидером")
+    return True
+
+
+async def reminder_scheduler(bot: Bot):
+    """
+    Запускает рассылку каждый день в REMINDER_TIME. Если при старте сегодняшнее время
+    уже прошло, а рассылки еще не было — отправляет сразу (и догоняет пропущенные дни).
+    """
+    logger.info(f"⏰ Напоминания: ежедневно в {REMINDER_TIME} {REMINDER_TZ or '(время сервера)'}")
+    while True:
+        try:
+            now = _now()
+            hours, minutes = _send_time()
+            todays_time_passed = (now.hour, now.minute) >= (hours, minutes)
+            last_run = await st.get_bot_state(LAST_RUN_KEY)
+            if todays_time_passed and last_run != now.date().isoformat():
+                # Всегда спим после запуска: если last_run «из будущего» (перевели часы или REMINDER_TZ),
+                # дат для рассылки нет, дата не пишется — без сна цикл крутился бы вхолостую
+                if not await run_once(bot):
+                    await asyncio.sleep(max(1.0, REMINDER_CLAIM_TIMEOUT))
+                    continue
+            await asyncio.sleep(max(1.0, (next_run_at(_now()) - _now()).total_seconds()))
+        except Exception as e:
+            logger.error(f"Error in reminder_scheduler: {e}")
+            await asyncio.sleep(60)
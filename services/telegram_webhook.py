@@ -0,0 +1,104 @@
+# services/telegram_webhook.py — ПРИЕМ АПДЕЙТОВ TELEGRAM ЧЕРЕЗ ВЕБХУК (РЕЖИМ BOT_MODE=webhook)
+
+import asyncio
+import logging
+from typing import Any, Dict
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+import config
+from services.lifecycle import is_draining
+from services.metrics import POOL_IN_USE, POOL_SIZE, add_collector
+
+logger = logging.getLogger("VetBot.TelegramWebhook")
+
+
+class BoundedRequestHandler(SimpleRequestHandler):
+    """
+    Обработчик вебхука с лимитом одновременно обрабатываемых апдейтов.
+    Когда все слоты заняты, ответ Telegram задерживается — он сам притормаживает
+    отправку (не больше max_connections запросов в полете), а память не растет.
+    """
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, max_concurrency: int, drain_timeout: float, **kwargs: Any):
+        super().__init__(dispatcher=dispatcher, bot=bot, handle_in_background=True, **kwargs)
+        self._slots = asyncio.Semaphore(max(1, max_concurrency))
+        self._drain_timeout = drain_timeout
+
+    async def _background_feed_update(self, bot: Bot, update: Dict[str, Any]) -> None:
+        try:
+            await super()._background_feed_update(bot, update)
+        finally:
+            self._slots.release()
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if is_draining():
+            # Реплика останавливается: Telegram повторит доставку (через балансировщик — другой реплике)
+            return web.Response(status=503)
+        return await super().handle(request)
+
+    async def _handle_request_background(self, bot: Bot, request: web.Request) -> web.Response:
+        await self._slots.acquire()
+        try:
+            return await super()._handle_request_background(bot, request)
+        except BaseException:
+            # Задача не создана — слот освобождаем сами
+            self._slots.release()
+            raise
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._background_feed_update_tasks)
+
+    async def drain(self):
+        """Ждет завершения начатых апдейтов (не дольше drain_timeout)"""
+        tasks = set(self._background_feed_update_tasks)
+        if not tasks:
+            return
+        logger.info(f"🌐 Вебхук: дожидаемся {len(tasks)} апдейтов (до {self._drain_timeout:.0f}с)")
+        _, pending = await asyncio.wait(tasks, timeout=self._drain_timeout)
+        if pending:
+            logger.warning(f"🌐 Вебхук: {len(pending)} апдейтов не успели завершиться, отменяем")
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    async def close(self) -> None:
+        await self.drain()
+        await super().close()
+
+
+def setup_telegram_webhook(app: web.Application, dp: Dispatcher, bot: Bot) -> BoundedRequestHandler:
+    """Вешает прием апдейтов на общий HTTP-сервер (рядом с вебхуком YooKassa и /health)"""
+    handler = BoundedRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        max_concurrency=config.WEBHOOK_MAX_CONCURRENCY,
+        drain_timeout=config.WEBHOOK_DRAIN_TIMEOUT,
+        secret_token=config.WEBHOOK_SECRET or None,
+    )
+    handler.register(app, path=config.WEBHOOK_PATH)
+
+    def collect_slots():
+        POOL_IN_USE.set(handler.in_flight, pool="webhook")
+        POOL_SIZE.set(config.WEBHOOK_MAX_CONCURRENCY, pool="webhook")
+
+    add_collector(collect_slots)
+    # startup/shutdown диспетчера привязываем к жизненному циклу приложения
+    setup_application(app, dp, bot=bot)
+    return handler
+
+
+async def register_webhook(bot: Bot, dp: Dispatcher):
+    """setWebhook идемпотентен: каждая реплика при старте выставляет один и тот же URL"""
+    url = f"{config.WEBHOOK_BASE_URL}{config.WEBHOOK_PATH}"
+    await bot.set_webhook(
+        url,
+        secret_token=config.WEBHOOK_SECRET or None,
+        allowed_updates=dp.resolve_used_update_types(),
+        max_connections=config.WEBHOOK_MAX_CONNECTIONS,
+        drop_pending_updates=False,
+    )
+    logger.info(f"🌐 Вебхук Telegram: {url} (max_connections={config.WEBHOOK_MAX_CONNECTIONS})")
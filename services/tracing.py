@@ -0,0 +1,268 @@
+# services/tracing.py — ТРАССИРОВКА АПДЕЙТА: КУДА УХОДИТ ВРЕМЯ (БД, AI, ОБРАБОТКА СНИМКОВ, TELEGRAM)
+
+import functools
+import json
+import logging
+import os
+import random
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Optional
+
+from aiogram import BaseMiddleware, Bot, Dispatcher
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import TelegramMethod
+from aiogram.types import Update
+
+logger = logging.getLogger("VetBot.Trace")
+
+# Доля трассируемых апдейтов и заданий: 0 — выключено (почти без накладных расходов), 1 — все
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0"))
+# Сводку по быстрым апдейтам не пишем, мс
+TRACE_LOG_MIN_MS = float(os.getenv("TRACE_LOG_MIN_MS", "0"))
+# Экспорт в локальный OpenTelemetry collector (OTLP/HTTP), например http://localhost:4318/v1/traces
+TRACE_OTLP_ENDPOINT = os.getenv("TRACE_OTLP_ENDPOINT", "")
+# Сколько спанов хранить на трассу (защита от циклов с тысячами запросов)
+_MAX_SPANS = 500
+
+
+class Trace:
+    __slots__ = ("trace_id", "name", "attrs", "start_ns", "start_perf", "spans", "dropped")
+
+    def __init__(self, name: str, attrs: dict):
+        self.trace_id = uuid.uuid4().hex
+        self.name = name
+        self.attrs = attrs
+        self.start_ns = time.time_ns()
+        self.start_perf = time.perf_counter()
+        self.spans: list[tuple[str, float, float, dict]] = []  # (имя, старт от начала трассы, длительность, атрибуты)
+        self.dropped = 0
+
+
+_current: ContextVar[Optional[Trace]] = ContextVar("trace", default=None)
+
+
+class _Span:
+    __slots__ = ("trace", "name", "attrs", "started")
+
+    def __init__(self, trace: Trace, name: str, attrs: dict):
+        self.trace = trace
+        self.name = name
+        self.attrs = attrs
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def set(self, key: str, value: Any):
+        self.attrs[key] = value
+
+    def __exit__(self, exc_type, exc, tb):
+        ended = time.perf_counter()
+        if exc_type is not None:
+            self.attrs["error"] = exc_type.__name__
+        trace = self.trace
+        if len(trace.spans) < _MAX_SPANS:
+            trace.spans.append((self.name, self.started - trace.start_perf, ended - self.started, self.attrs))
+        else:
+            trace.dropped += 1
+        return False
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return self.__exit__(exc_type, exc, tb)
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def set(self, key: str, value: Any):
+        pass
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP = _NoopSpan()
+
+
+def span(name: str, **attrs: Any):
+    """Спан внутри текущей трассы: `with span("ocr.decode"):` или `async with`. Без трассы — no-op"""
+    trace = _current.get()
+    if trace is None:
+        return _NOOP
+    return _Span(trace, name, attrs)
+
+
+def traced(name: str):
+    """Декоратор для async-функций: весь вызов — один спан"""
+    def decorator(func: Callable[..., Awaitable]):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            trace = _current.get()
+            if trace is None:
+                return await func(*args, **kwargs)
+            with _Span(trace, name, {}):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def current_trace_id() -> Optional[str]:
+    trace = _current.get()
+    return trace.trace_id if trace else None
+
+
+@contextmanager
+def start_trace(name: str, **attrs: Any):
+    """Начинает трассу (с вероятностью TRACE_SAMPLE_RATE); по завершении пишет сводку"""
+    if TRACE_SAMPLE_RATE <= 0 or _current.get() is not None or random.random() >= TRACE_SAMPLE_RATE:
+        yield None
+        return
+    trace = Trace(name, attrs)
+    token = _current.set(trace)
+    error = None
+    try:
+        yield trace
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        _current.reset(token)
+        total = time.perf_counter() - trace.start_perf
+        if error:
+            trace.attrs["error"] = error
+        _finish(trace, total)
+
+
+def _summary(trace: Trace, total: float) -> dict:
+    """Сводка: суммарное время и число вызовов по именам спанов + самые долгие спаны"""
+    by_name: dict[str, list] = {}
+    for name, _, duration, _ in trace.spans:
+        agg = by_name.setdefault(name, [0, 0.0])
+        agg[0] += 1
+        agg[1] += duration
+    slowest = sorted(trace.spans, key=lambda s: s[2], reverse=True)[:5]
+    return {
+        "trace_id": trace.trace_id,
+        "name": trace.name,
+        **trace.attrs,
+        "total_ms": round(total * 1000, 1),
+        "spans": {n: {"count": c, "ms": round(d * 1000, 1)} for n, (c, d) in sorted(by_name.items(), key=lambda i: -i[1][1])},
+        "slowest": [{"name": n, "at_ms": round(s * 1000, 1), "ms": round(d * 1000, 1), **a} for n, s, d, a in slowest],
+        **({"dropped_spans": trace.dropped} if trace.dropped else {}),
+    }
+
+
+def _finish(trace: Trace, total: float):
+    if total * 1000 >= TRACE_LOG_MIN_MS:
+        logger.info(f"⏱ {json.dumps(_summary(trace, total), ensure_ascii=False, default=str)}")
+    if TRACE_OTLP_ENDPOINT:
+        _export_otlp(trace, total)
+
+
+# --- OTLP (опционально: pip install opentelemetry-sdk opentelemetry-exporter-otlp-proto-http) ---
+
+_otel_tracer = None
+_otel_failed = False
+
+
+def _get_otel_tracer():
+    global _otel_tracer, _otel_failed
+    if _otel_tracer is not None or _otel_failed:
+        return _otel_tracer
+    try:
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+    except ImportError:
+        logger.warning("⏱ TRACE_OTLP_ENDPOINT задан, но opentelemetry-sdk не установлен — экспорт выключен")
+        _otel_failed = True
+        return None
+    provider = TracerProvider(resource=Resource.create({"service.name": os.getenv("OTEL_SERVICE_NAME", "vet-bot")}))
+    # BatchSpanProcessor отправляет из своего потока — event loop не блокируется
+    provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter(endpoint=TRACE_OTLP_ENDPOINT)))
+    _otel_tracer = provider.get_tracer("vetbot")
+    return _otel_tracer
+
+
+def _export_otlp(trace: Trace, total: float):
+    tracer = _get_otel_tracer()
+    if tracer is None:
+        return
+    try:
+        from opentelemetry import trace as otel_trace
+
+        def ns(offset: float) -> int:
+            return trace.start_ns + int(offset * 1e9)
+
+        root = tracer.start_span(trace.name, start_time=trace.start_ns, attributes=_otel_attrs(trace.attrs))
+        parent = otel_trace.set_span_in_context(root)
+        for name, start, duration, attrs in trace.spans:
+            child = tracer.start_span(name, context=parent, start_time=ns(start), attributes=_otel_attrs(attrs))
+            child.end(end_time=ns(start + duration))
+        root.end(end_time=ns(total))
+    except Exception as e:
+        logger.warning(f"⏱ Ошибка экспорта OTLP: {e}")
+
+
+def _otel_attrs(attrs: dict) -> dict:
+    return {k: v if isinstance(v, (str, bool, int, float)) else str(v) for k, v in attrs.items()}
+
+
+# --- Точки входа: апдейты диспетчера и запросы к Bot API ---
+
+def _update_kind(event: Update) -> str:
+    return event.event_type or "update"
+
+
+class TracingMiddleware(BaseMiddleware):
+    """Трасса на апдейт (до всех наших middleware — в сводку попадает и ожидание очереди пользователя)"""
+
+    async def __call__(
+        self,
+        handler: Callable[[Update, dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: dict[str, Any]
+    ) -> Any:
+        if TRACE_SAMPLE_RATE <= 0:
+            return await handler(event, data)
+        user = data.get("event_from_user")
+        with start_trace(
+            f"update.{_update_kind(event)}", update_id=event.update_id, user_id=user.id if user else None
+        ):
+            return await handler(event, data)
+
+
+class TracingRequestMiddleware(BaseRequestMiddleware):
+    """Спан на каждый вызов Bot API (sendMessage, getFile, editMessageText…)"""
+
+    async def __call__(self, make_request: NextRequestMiddlewareType, bot: Bot, method: TelegramMethod) -> Any:
+        trace = _current.get()
+        if trace is None:
+            return await make_request(bot, method)
+        with _Span(trace, f"tg.{method.__api_method__}", {}):
+            return await make_request(bot, method)
+
+
+def setup_tracing(dp: Optional[Dispatcher], bot: Bot):
+    """Ставит трассировку первой (до учета апдейтов, антифлуда и очереди пользователя)"""
+    bot.session.middleware(TracingRequestMiddleware())
+    if dp is not None:
+        dp.update.outer_middleware.unregister(dp.fsm)
+        dp.update.outer_middleware(TracingMiddleware())
+        dp.update.outer_middleware(dp.fsm)
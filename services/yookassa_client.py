@@ -0,0 +1,197 @@
+# services/yookassa_client.py — АСИНХРОННЫЙ КЛИЕНТ YOOKASSA API (aiohttp, без потоков)
+
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+import uuid
+from typing import AsyncIterator, Optional
+
+import aiohttp
+from dotenv import load_dotenv
+
+from services.metrics import Counter, Histogram
+
+logger = logging.getLogger("VetBot.YooKassaClient")
+
+load_dotenv()
+
+YOOKASSA_SHOP_ID = os.getenv("YOOKASSA_SHOP_ID")
+YOOKASSA_SECRET_KEY = os.getenv("YOOKASSA_SECRET_KEY") or os.getenv("YOOKASSA_TOKEN")
+# Адрес API (переопределяется для локального стенда tools/fake_yookassa.py)
+YOOKASSA_API_URL = (os.getenv("YOOKASSA_API_URL") or "https://api.yookassa.ru/v3").rstrip("/")
+YOOKASSA_TIMEOUT = float(os.getenv("YOOKASSA_TIMEOUT", "15"))
+YOOKASSA_MAX_RETRIES = int(os.getenv("YOOKASSA_MAX_RETRIES", "3"))
+YOOKASSA_POOL_SIZE = int(os.getenv("YOOKASSA_POOL_SIZE", "10"))
+
+# Коды, при которых запрос безопасно повторить (с тем же Idempotence-Key)
+_RETRY_STATUSES = {429, 500, 502, 503, 504}
+_BACKOFF_BASE = 0.5
+_BACKOFF_MAX = 8.0
+
+REQUEST_SECONDS = Histogram(
+    "yookassa_request_seconds", "Длительность запросов к YooKassa API", ("method", "endpoint", "status")
+)
+RETRIES_TOTAL = Counter("yookassa_retries_total", "Повторы запросов к YooKassa API", ("endpoint", "reason"))
+
+
+class YooKassaError(Exception):
+    """Ошибка YooKassa API (4xx или исчерпаны повторы)"""
+
+    def __init__(self, status: int, code: str = "", description: str = ""):
+        super().__init__(f"YooKassa {status}: {code} {description}".strip())
+        self.status = status
+        self.code = code
+        self.description = description
+
+
+def _json_or_empty(body: str) -> dict:
+    """Тело ответа как dict (у 502 от прокси там может быть HTML)"""
+    try:
+        data = json.loads(body) if body else {}
+    except ValueError:
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+class YooKassaClient:
+    """
+    Клиент платежей YooKassa поверх одного пула соединений aiohttp.
+    POST всегда с Idempotence-Key: повтор после 5xx/429/таймаута не создаст второй платеж.
+    """
+
+    def __init__(
+        self,
+        shop_id: str,
+        secret_key: str,
+        api_url: str = YOOKASSA_API_URL,
+        timeout: float = YOOKASSA_TIMEOUT,
+        max_retries: int = YOOKASSA_MAX_RETRIES,
+        pool_size: int = YOOKASSA_POOL_SIZE,
+    ):
+        self.api_url = api_url.rstrip("/")
+        self.max_retries = max(0, max_retries)
+        self._auth = aiohttp.BasicAuth(str(shop_id), str(secret_key))
+        self._timeout = aiohttp.ClientTimeout(total=timeout)
+        self._pool_size = pool_size
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                auth=self._auth,
+                timeout=self._timeout,
+                connector=aiohttp.TCPConnector(limit=self._pool_size, ttl_dns_cache=300),
+            )
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def _request(
+        self,
+        method: str,
+        path: str,
+        endpoint: str,
+        *,
+        params: Optional[dict] = None,
+        json: Optional[dict] = None,
+        idempotence_key: Optional[str] = None,
+    ) -> dict:
+        headers = {}
+        if method == "POST":
+            headers["Idempotence-Key"] = idempotence_key or str(uuid.uuid4())
+
+        url = f"{self.api_url}{path}"
+        attempt = 0
+        while True:
+            started = time.perf_counter()
+            status_label = "error"
+            retry_reason = None
+            delay = None
+            try:
+                async with self._get_session().request(
+                    method, url, params=params, json=json, headers=headers
+                ) as resp:
+                    status_label = str(resp.status)
+                    data = _json_or_empty(await resp.text())
+                    if resp.status == 200:
+                        return data
+                    if resp.status == 202 or resp.status in _RETRY_STATUSES:
+                        # 202 — YooKassa еще обрабатывает запрос, просит повторить через retry_after мс
+                        retry_reason = status_label
+                        if resp.status == 202 and data.get("retry_after"):
+                            delay = float(data["retry_after"]) / 1000
+                        elif resp.headers.get("Retry-After", "").isdigit():
+                            delay = float(resp.headers["Retry-After"])
+                    else:
+                        raise YooKassaError(resp.status, data.get("code", ""), data.get("description", ""))
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                retry_reason = type(e).__name__
+            finally:
+                REQUEST_SECONDS.observe(
+                    time.perf_counter() - started, method=method, endpoint=endpoint, status=status_label
+                )
+
+            if attempt >= self.max_retries:
+                raise YooKassaError(0 if status_label == "error" else int(status_label), "retries_exhausted", retry_reason)
+            attempt += 1
+            RETRIES_TOTAL.inc(endpoint=endpoint, reason=retry_reason)
+            if delay is None:
+                delay = min(_BACKOFF_MAX, _BACKOFF_BASE * 2 ** (attempt - 1)) * random.uniform(0.5, 1.0)
+            logger.warning(f"💳 YooKassa {method} {endpoint}: {retry_reason}, повтор {attempt}/{self.max_retries} через {delay:.2f}с")
+            await asyncio.sleep(delay)
+
+    async def create_payment(self, data: dict, idempotence_key: Optional[str] = None) -> dict:
+        return await self._request("POST", "/payments", "/payments", json=data, idempotence_key=idempotence_key)
+
+    async def get_payment(self, payment_id: str) -> dict:
+        return await self._request("GET", f"/payments/{payment_id}", "/payments/{id}")
+
+    async def list_payments(self, params: Optional[dict] = None) -> dict:
+        """Одна страница списка: {"items": [...], "next_cursor": "..."}"""
+        return await self._request("GET", "/payments", "/payments", params=params)
+
+    async def iter_payment_pages(self, params: Optional[dict] = None) -> AsyncIterator[list]:
+        """Все страницы списка по next_cursor"""
+        params = dict(params or {})
+        while True:
+            page = await self.list_payments(params)
+            items = page.get("items") or []
+            yield items
+            next_cursor = page.get("next_cursor")
+            if not next_cursor or not items:
+                return
+            params["cursor"] = next_cursor
+
+
+_client: Optional[YooKassaClient] = None
+
+
+def is_configured() -> bool:
+    return bool(YOOKASSA_SHOP_ID and YOOKASSA_SECRET_KEY)
+
+
+def get_yookassa() -> YooKassaClient:
+    """Общий клиент (один пул соединений на процесс, создается лениво)"""
+    global _client
+    if _client is None:
+        if not is_configured():
+            raise RuntimeError("YOOKASSA_SHOP_ID/YOOKASSA_SECRET_KEY не заданы")
+        _client = YooKassaClient(YOOKASSA_SHOP_ID, YOOKASSA_SECRET_KEY)
+    return _client
+
+
+async def close_yookassa():
+    """Закрывает пул (вызывается при остановке бота)"""
+    global _client
+    if _client is not None:
+        try:
+            await _client.close()
+        except Exception as e:
+            logger.error(f"Error in close_yookassa: {e}")
+        _client = None
@@ -0,0 +1,105 @@
+# services/yookassa_webhook.py — ПРИЕМ HTTP-УВЕДОМЛЕНИЙ YOOKASSA
+
+import hmac
+import ipaddress
+import logging
+import os
+
+from aiohttp import web
+from aiogram import Bot
+from services.payments import activate_payment
+from services.yookassa_client import get_yookassa
+
+logger = logging.getLogger("VetBot.YooKassaWebhook")
+
+YOOKASSA_WEBHOOK_PATH = os.getenv("YOOKASSA_WEBHOOK_PATH", "/yookassa/webhook")
+# Секрет в URL уведомления (…/yookassa/webhook?token=…) — YooKassa сама не подписывает запросы
+YOOKASSA_WEBHOOK_SECRET = os.getenv("YOOKASSA_WEBHOOK_SECRET", "")
+# Перепроверять платеж через API (защита от поддельных уведомлений)
+YOOKASSA_WEBHOOK_VERIFY = os.getenv("YOOKASSA_WEBHOOK_VERIFY", "1") == "1"
+# Брать IP из X-Forwarded-For (если бот за nginx/балансировщиком)
+YOOKASSA_TRUST_PROXY = os.getenv("YOOKASSA_TRUST_PROXY", "0") == "1"
+
+# Официальные адреса, с которых YooKassa шлет уведомления
+_DEFAULT_ALLOWED = (
+    "185.71.76.0/27",
+    "185.71.77.0/27",
+    "77.75.153.0/25",
+    "77.75.156.11/32",
+    "77.75.156.35/32",
+    "77.75.154.128/25",
+    "2a02:5180::/32",
+)
+_EXTRA_ALLOWED = [x.strip() for x in os.getenv("YOOKASSA_WEBHOOK_ALLOWED_IPS", "").split(",") if x.strip()]
+ALLOWED_NETWORKS = [ipaddress.ip_network(net, strict=False) for net in (*_DEFAULT_ALLOWED, *_EXTRA_ALLOWED)]
+
+BOT_KEY = web.AppKey("bot", Bot)
+
+
+def _client_ip(request: web.Request) -> str:
+    if YOOKASSA_TRUST_PROXY:
+        forwarded = request.headers.get("X-Forwarded-For", "")
+        if forwarded:
+            # Последний адрес добавил наш прокси — ему и верим
+            return forwarded.split(",")[-1].strip()
+    return request.remote or ""
+
+
+def is_allowed_ip(ip: str) -> bool:
+    try:
+        addr = ipaddress.ip_address(ip)
+    except ValueError:
+        return False
+    return any(addr in net for net in ALLOWED_NETWORKS)
+
+
+async def _fetch_payment(payment_id: str):
+    """Актуальное состояние платежа из API — источник правды вместо тела уведомления"""
+    return await get_yookassa().get_payment(payment_id)
+
+
+async def handle_notification(request: web.Request) -> web.Response:
+    """
+    POST от YooKassa. Отвечаем 200 на всё, что обработано или заведомо не наше,
+    и 5xx на внутренние ошибки — тогда YooKassa повторит доставку.
+    """
+    ip = _client_ip(request)
+    if not is_allowed_ip(ip):
+        logger.warning(f"💳 Webhook: запрос с чужого IP {ip}")
+        return web.Response(status=403)
+
+    if YOOKASSA_WEBHOOK_SECRET:
+        token = request.query.get("token", "")
+        if not hmac.compare_digest(token.encode(), YOOKASSA_WEBHOOK_SECRET.encode()):
+            logger.warning(f"💳 Webhook: неверный токен от {ip}")
+            return web.Response(status=403)
+
+    try:
+        body = await request.json()
+    except Exception:
+        return web.Response(status=400)
+    # Валидный JSON, но не объект ([] или "x") — такой же мусор, как битый JSON
+    if not isinstance(body, dict) or not isinstance(body.get("object") or {}, dict):
+        return web.Response(status=400)
+
+    event = body.get("event")
+    obj = body.get("object") or {}
+    payment_id = obj.get("id")
+    if event != "payment.succeeded" or not payment_id:
+        return web.Response(status=200)
+
+    bot = request.app[BOT_KEY]
+    try:
+        payment = await _fetch_payment(str(payment_id)) if YOOKASSA_WEBHOOK_VERIFY else obj
+        activated = await activate_payment(bot, payment)
+    except Exception as e:
+        logger.error(f"💳 Webhook: ошибка обработки {payment_id}: {e!r}")
+        return web.Response(status=500)
+
+    logger.info(f"💳 Webhook: {payment_id} {'активирован' if activated else 'уже обработан'}")
+    return web.Response(status=200)
+
+
+def setup_routes(app: web.Application, bot: Bot):
+    app[BOT_KEY] = bot
+    app.router.add_post(YOOKASSA_WEBHOOK_PATH, handle_notification)
@@ -4,19 +4,27 @@ Async Storage для Vet-bot (SQLAlchemy 2.0)
 Все методы асинхронные, не блокируют Event Loop.
 """
 
+import functools
+import inspect
+import json
 import logging
 import os
+import time as time_module
+from dataclasses import asdict, dataclass
 from datetime import datetime, date, time, timedelta
 from pathlib import Path
-from typing import Optional
+from typing import AsyncIterator, Optional
 
 from dotenv import load_dotenv
-from sqlalchemy import select, update, insert, func, and_, or_, text
+from sqlalchemy import select, update, insert, delete, func, and_, or_, text, tuple_
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 from sqlalchemy.orm import selectinload
 
-from models import Base, User, Pet, History, YooKassaPayment, Feedback, PromoCode, PromoUsage
+from models import Base, User, Pet, History, YooKassaPayment, Feedback, PromoCode, PromoUsage, BotState, PendingPayment, BroadcastJob, ReminderDelivery
 import config
+from services import query_stats
+from services.metrics import POOL_IN_USE, POOL_SIZE, Histogram, add_collector
+from services.tracing import traced
 
 # Загружаем переменные окружения
 load_dotenv()
@@ -78,6 +86,8 @@ async def init_db():
         echo=False,  # Включить для отладки SQL-запросов
         future=True,
     )
+    # Счетчик запросов на апдейт и лог медленных запросов (DB_SLOW_QUERY_MS)
+    query_stats.install(_engine)
 
     _async_session = async_sessionmaker(
         _engine,
@@ -88,6 +98,13 @@ async def init_db():
     # Создание всех таблиц
     async with _engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+
+        # Индексы для выборки напоминаний (create_all не добавляет их в уже существующую таблицу)
+        try:
+            await conn.execute(text("CREATE INDEX IF NOT EXISTS ix_pets_next_vaccine_date ON pets (next_vaccine_date)"))
+            await conn.execute(text("CREATE INDEX IF NOT EXISTS ix_pets_next_tick_date ON pets (next_tick_date)"))
+        except Exception as e:
+            logger.warning(f"⚠️ Ошибка создания индексов pets: {e}")
         
         # Миграция: добавление новых колонок для монетизации (если их нет)
         if "postgresql" in DATABASE_URL:
@@ -97,7 +114,8 @@ async def init_db():
                     SELECT column_name 
                     FROM information_schema.columns 
                     WHERE table_name = 'users' 
-                    AND column_name IN ('balance_analyses', 'is_trial_used', 'last_one_time_purchase', 'referrer_id')
+                    AND column_name IN ('balance_analyses', 'is_trial_used', 'last_one_time_purchase', 'referrer_id',
+                                        'blocked_at', 'last_delivery_error')
                 """
                 result = await conn.execute(text(check_sql))
                 existing_columns = {row[0] for row in result.fetchall()}
@@ -119,6 +137,15 @@ async def init_db():
                     await conn.execute(text("ALTER TABLE users ADD COLUMN referrer_id BIGINT"))
                     logger.info("✅ Миграция: добавлена колонка referrer_id")
 
+                # Миграция состояния доставки (заблокировавшие бота)
+                if 'blocked_at' not in existing_columns:
+                    await conn.execute(text("ALTER TABLE users ADD COLUMN blocked_at VARCHAR"))
+                    logger.info("✅ Миграция: добавлена колонка blocked_at")
+
+                if 'last_delivery_error' not in existing_columns:
+                    await conn.execute(text("ALTER TABLE users ADD COLUMN last_delivery_error VARCHAR"))
+                    logger.info("✅ Миграция: добавлена колонка last_delivery_error")
+
                 # Миграция платежей: сумма и статус для честной финансовой статистики
                 payments_check_sql = """
                     SELECT column_name
@@ -136,6 +163,11 @@ async def init_db():
                 if "status" not in payment_columns:
                     await conn.execute(text("ALTER TABLE yookassa_payments ADD COLUMN status VARCHAR DEFAULT 'succeeded'"))
                     logger.info("✅ Миграция: добавлена колонка status в yookassa_payments")
+
+                # Миграция рассылок: фильтр аудитории
+                await conn.execute(text("ALTER TABLE broadcast_jobs ADD COLUMN IF NOT EXISTS audience TEXT"))
+                # Fencing-токены для служебного состояния
+                await conn.execute(text("ALTER TABLE bot_state ADD COLUMN IF NOT EXISTS fence BIGINT"))
             except Exception as e:
                 logger.warning(f"⚠️ Ошибка при миграции колонок (возможно, они уже существуют): {e}")
         else:
@@ -151,11 +183,43 @@ async def init_db():
                     logger.info("✅ Миграция SQLite: добавлена колонка status в yookassa_payments")
             except Exception as e:
                 logger.warning(f"⚠️ Ошибка SQLite-миграции yookassa_payments: {e}")
+            try:
+                users_info = await conn.execute(text("PRAGMA table_info(users)"))
+                user_columns = {row[1] for row in users_info.fetchall()}
+                for column in ("blocked_at", "last_delivery_error"):
+                    if column not in user_columns:
+                        await conn.execute(text(f"ALTER TABLE users ADD COLUMN {column} VARCHAR"))
+                        logger.info(f"✅ Миграция SQLite: добавлена колонка {column} в users")
+            except Exception as e:
+                logger.warning(f"⚠️ Ошибка SQLite-миграции users: {e}")
+            try:
+                jobs_info = await conn.execute(text("PRAGMA table_info(broadcast_jobs)"))
+                if "audience" not in {row[1] for row in jobs_info.fetchall()}:
+                    await conn.execute(text("ALTER TABLE broadcast_jobs ADD COLUMN audience TEXT"))
+                    logger.info("✅ Миграция SQLite: добавлена колонка audience в broadcast_jobs")
+            except Exception as e:
+                logger.warning(f"⚠️ Ошибка SQLite-миграции broadcast_jobs: {e}")
+            try:
+                state_info = await conn.execute(text("PRAGMA table_info(bot_state)"))
+                if "fence" not in {row[1] for row in state_info.fetchall()}:
+                    await conn.execute(text("ALTER TABLE bot_state ADD COLUMN fence BIGINT"))
+                    logger.info("✅ Миграция SQLite: добавлена колонка fence в bot_state")
+            except Exception as e:
+                logger.warning(f"⚠️ Ошибка SQLite-миграции bot_state: {e}")
 
     db_type = "PostgreSQL" if "postgresql" in DATABASE_URL else "SQLite"
     logger.info(f"📂 БД готова ({db_type} + Async SQLAlchemy 2.0)")
 
 
+async def close_db():
+    """Закрывает пул соединений (вызывается последним при остановке)"""
+    global _engine, _async_session
+    if _engine is not None:
+        await _engine.dispose()
+    _engine = None
+    _async_session = None
+
+
 def _get_session() -> AsyncSession:
     """Получить новую сессию (для использования в async context managers)"""
     if _async_session is None:
@@ -163,6 +227,15 @@ def _get_session() -> AsyncSession:
     return _async_session()
 
 
+def _insert(model):
+    """INSERT с поддержкой ON CONFLICT для текущего диалекта (PostgreSQL / SQLite)"""
+    if "postgresql" in DATABASE_URL:
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    return dialect_insert(model)
+
+
 def _parse_sub_end(sub_end_date: Optional[str]) -> Optional[datetime]:
     """
     Поддерживаем оба формата:
@@ -187,10 +260,138 @@ def _parse_sub_end(sub_end_date: Optional[str]) -> Optional[datetime]:
 
 # ===== АДМИНКА И СТАТИСТИКА =====
 
-async def get_all_users() -> list[int]:
-    """Для рассылки: возвращает список всех user_id"""
+@dataclass(frozen=True)
+class AudienceFilter:
+    """
+    Аудитория рассылки. Все условия уходят в SQL (WHERE / EXISTS), таблица целиком не читается.
+    tiers: 'free', 'plus', 'pro' (по действующей подписке); species: 'dog', 'cat'.
+    """
+    tiers: tuple[str, ...] = ()
+    active_days: Optional[int] = None
+    has_pets: Optional[bool] = None
+    species: tuple[str, ...] = ()
+
+    def to_json(self) -> str:
+        return json.dumps(asdict(self), ensure_ascii=False)
+
+    @classmethod
+    def from_json(cls, raw: Optional[str]) -> "AudienceFilter":
+        if not raw:
+            return cls()
+        data = json.loads(raw)
+        return cls(
+            tiers=tuple(data.get("tiers") or ()),
+            active_days=data.get("active_days"),
+            has_pets=data.get("has_pets"),
+            species=tuple(data.get("species") or ()),
+        )
+
+
+def _audience_conditions(audience: Optional[AudienceFilter], include_blocked: bool = False) -> list:
+    conditions = []
+    if not include_blocked:
+        conditions.append(User.blocked_at.is_(None))
+    if audience is None:
+        return conditions
+
+    if audience.tiers:
+        today = datetime.now().strftime("%Y-%m-%d")
+        # sub_end_date бывает 'YYYY-MM-DD' и ISO — строковое сравнение с датой корректно для обоих
+        paid_active = and_(User.status == "paid", User.sub_end_date >= today)
+        tier_conditions = []
+        if "free" in audience.tiers:
+            tier_conditions.append(or_(User.status != "paid", User.sub_end_date.is_(None), User.sub_end_date < today))
+        paid_tiers = [t for t in audience.tiers if t != "free"]
+        if paid_tiers:
+            tier_conditions.append(and_(paid_active, User.tier.in_(paid_tiers)))
+        conditions.append(or_(*tier_conditions))
+
+    if audience.active_days:
+        since = (datetime.now() - timedelta(days=audience.active_days)).strftime("%Y-%m-%d")
+        conditions.append(User.last_usage_date >= since)
+
+    if audience.has_pets is not None:
+        has_pet = select(Pet.id).where(Pet.user_id == User.user_id).exists()
+        conditions.append(has_pet if audience.has_pets else ~has_pet)
+
+    if audience.species:
+        conditions.append(
+            select(Pet.id).where(Pet.user_id == User.user_id, Pet.type.in_(audience.species)).exists()
+        )
+    return conditions
+
+
+async def get_user_ids_after(cursor: int, limit: int, audience: Optional[AudienceFilter] = None) -> list[int]:
+    """
+    Для рассылки: следующая страница user_id > cursor (keyset-пагинация по первичному ключу).
+    Заблокировавших бота пропускаем.
+    """
+    async with _get_session() as session:
+        result = await session.execute(
+            select(User.user_id)
+            .where(User.user_id > cursor, *_audience_conditions(audience))
+            .order_by(User.user_id)
+            .limit(limit)
+        )
+        return [row[0] for row in result.fetchall()]
+
+
+async def iter_user_ids(
+    audience: Optional[AudienceFilter] = None, page_size: int = 1000, after: int = 0
+) -> AsyncIterator[int]:
+    """
+    Потоково отдает user_id аудитории страницами по page_size.
+    Каждая страница — отдельный короткий запрос: соединение с БД не держится,
+    пока вызывающий код медленно отправляет сообщения.
+    """
+    cursor = after
+    while True:
+        page = await get_user_ids_after(cursor, page_size, audience)
+        for user_id in page:
+            yield user_id
+        if len(page) < page_size:
+            return
+        cursor = page[-1]
+
+
+async def count_users(audience: Optional[AudienceFilter] = None, include_blocked: bool = False) -> int:
+    """COUNT аудитории (для превью рассылки — без выгрузки id)"""
+    stmt = select(func.count(User.user_id)).where(*_audience_conditions(audience, include_blocked))
+    async with _get_session() as session:
+        return (await session.execute(stmt)).scalar() or 0
+
+
+async def mark_user_blocked(user_id: int, error: str):
+    """Бот заблокирован / аккаунт удален: исключаем из рассылок до повторной проверки"""
+    async with _get_session() as session:
+        await session.execute(
+            update(User)
+            .where(User.user_id == user_id)
+            .values(blocked_at=datetime.now().replace(microsecond=0).isoformat(), last_delivery_error=error[:255])
+        )
+        await session.commit()
+
+
+async def clear_user_blocked(user_id: int):
+    """Пользователь снова доступен (написал боту или прошел проверку)"""
+    async with _get_session() as session:
+        await session.execute(
+            update(User)
+            .where(User.user_id == user_id, User.blocked_at.is_not(None))
+            .values(blocked_at=None, last_delivery_error=None)
+        )
+        await session.commit()
+
+
+async def get_blocked_user_ids(blocked_before: str, limit: int) -> list[int]:
+    """Заблокировавшие бота раньше blocked_before — кандидаты на повторную проверку"""
     async with _get_session() as session:
-        result = await session.execute(select(User.user_id))
+        result = await session.execute(
+            select(User.user_id)
+            .where(User.blocked_at.is_not(None), User.blocked_at < blocked_before)
+            .order_by(User.blocked_at)
+            .limit(limit)
+        )
         return [row[0] for row in result.fetchall()]
 
 
@@ -208,6 +409,12 @@ async def get_bot_stats() -> dict:
                 select(func.count(User.user_id)).where(User.joined_at.like(f"{today}%"))
             )
         ).scalar() or 0
+        stats["users_blocked"] = (
+            await session.execute(select(func.count(User.user_id)).where(User.blocked_at.is_not(None)))
+        ).scalar() or 0
+        stats["users_blocked_pct"] = (
+            round(100 * stats["users_blocked"] / stats["users_total"], 1) if stats["users_total"] else 0
+        )
 
         # Сообщения
         stats["msgs_total"] = (await session.execute(select(func.count(History.id)))).scalar() or 0
@@ -578,6 +785,7 @@ async def get_user_subscription(user_id: int) -> Optional[dict]:
                 "daily_usage": user.daily_usage,
                 "last_usage_date": user.last_usage_date,
                 "sub_end_date": user.sub_end_date,
+                "blocked_at": user.blocked_at,
             }
         return None
 
@@ -759,6 +967,18 @@ async def check_text_limits(
         }
 
 
+async def refund_text_usage(user_id: int):
+    """Возвращает одно списанное текстовое сообщение (запрос отменен до ответа)"""
+    today = datetime.now().strftime("%Y-%m-%d")
+    async with _get_session() as session:
+        await session.execute(
+            update(User)
+            .where(User.user_id == user_id, User.last_usage_date == today, User.daily_usage > 0)
+            .values(daily_usage=User.daily_usage - 1)
+        )
+        await session.commit()
+
+
 async def check_photo_limits(
     user_id: int, username: str, photo_limits_by_tier: dict, consume: bool = True
 ) -> dict:
@@ -939,31 +1159,100 @@ async def get_last_entries(user_id: int, limit: int = 3) -> list[tuple[str, str,
 
 # ===== РАССЫЛКА НАПОМИНАНИЙ =====
 
-async def check_reminders_today() -> list[tuple[int, str]]:
-    """Возвращает список (user_id, text) кому надо напомнить"""
-    today = datetime.now().strftime("%Y-%m-%d")
-    notifications = []
-
+async def get_due_pet_reminders(dates: list[str]) -> list[tuple[int, int, str, str, str]]:
+    """
+    Питомцы с вакцинацией или обработкой от клещей на одну из дат — одним запросом по индексам.
+    Возвращает [(pet_id, user_id, pet_name, kind, due_date)], kind: 'vaccine' / 'tick'.
+    """
+    if not dates:
+        return []
     async with _get_session() as session:
-        # Вакцинация
         result = await session.execute(
-            select(Pet.user_id, Pet.name).where(Pet.next_vaccine_date == today)
-        )
-        for row in result.fetchall():
-            notifications.append(
-                (row[0], f"💉 **Напоминание:** Сегодня у питомца **{row[1]}** плановая вакцинация!")
+            select(Pet.id, Pet.user_id, Pet.name, Pet.next_vaccine_date, Pet.next_tick_date)
+            .join(User, User.user_id == Pet.user_id)
+            .where(
+                or_(Pet.next_vaccine_date.in_(dates), Pet.next_tick_date.in_(dates)),
+                User.blocked_at.is_(None),
             )
+        )
+        due = []
+        for pet_id, user_id, name, vaccine_date, tick_date in result.fetchall():
+            if vaccine_date in dates:
+                due.append((pet_id, user_id, name, "vaccine", vaccine_date))
+            if tick_date in dates:
+                due.append((pet_id, user_id, name, "tick", tick_date))
+        return due
+
+
+async def claim_reminder_deliveries(
+    reminders: list[tuple[int, int, str, str]], reclaim_after: int = 0
+) -> dict[tuple[int, str, str], int]:
+    """
+    Атомарно «занимает» напоминания [(pet_id, user_id, kind, due_date)] через
+    INSERT ... ON CONFLICT DO NOTHING RETURNING. Отправлять можно только вернувшиеся —
+    остальные уже отправлены раньше или прямо сейчас другой репликой.
+    reclaim_after (сек) — забирать и записи, застрявшие в 'claimed' дольше этого срока
+    (процесс упал между «занял» и «отправил»); UPDATE обновляет created_at, поэтому
+    из двух одновременных попыток запись достанется только одной.
+    Возвращает {(pet_id, kind, due_date): delivery_id}.
+    """
+    if not reminders:
+        return {}
+    now_dt = datetime.now().replace(microsecond=0)
+    now = now_dt.isoformat()
+    rows = [
+        {"pet_id": pet_id, "user_id": user_id, "kind": kind, "due_date": due_date, "status": "claimed", "created_at": now}
+        for pet_id, user_id, kind, due_date in reminders
+    ]
+    stmt = (
+        _insert(ReminderDelivery)
+        .values(rows)
+        .on_conflict_do_nothing(index_elements=["pet_id", "kind", "due_date"])
+        .returning(ReminderDelivery.id, ReminderDelivery.pet_id, ReminderDelivery.kind, ReminderDelivery.due_date)
+    )
+    async with _get_session() as session:
+        result = await session.execute(stmt)
+        claimed = {(row[1], row[2], row[3]): row[0] for row in result.fetchall()}
+        if reclaim_after > 0:
+            keys = [(pet_id, kind, due_date) for pet_id, _, kind, due_date in reminders]
+            keys = [key for key in keys if key not in claimed]
+            if keys:
+                stale_before = (now_dt - timedelta(seconds=reclaim_after)).isoformat()
+                result = await session.execute(
+                    update(ReminderDelivery)
+                    .where(
+                        ReminderDelivery.status == "claimed",
+                        ReminderDelivery.created_at < stale_before,
+                        tuple_(ReminderDelivery.pet_id, ReminderDelivery.kind, ReminderDelivery.due_date).in_(keys),
+                    )
+                    .values(created_at=now)
+                    .returning(ReminderDelivery.id, ReminderDelivery.pet_id, ReminderDelivery.kind, ReminderDelivery.due_date)
+                )
+                claimed.update({(row[1], row[2], row[3]): row[0] for row in result.fetchall()})
+        await session.commit()
+        return claimed
 
-        # Клещи
-        result = await session.execute(
-            select(Pet.user_id, Pet.name).where(Pet.next_tick_date == today)
+
+async def set_reminder_delivery_status(delivery_ids: list[int], status: str):
+    if not delivery_ids:
+        return
+    async with _get_session() as session:
+        await session.execute(
+            update(ReminderDelivery).where(ReminderDelivery.id.in_(delivery_ids)).values(status=status)
         )
-        for row in result.fetchall():
-            notifications.append(
-                (row[0], f"🕷 **Напоминание:** Пора обработать **{row[1]}** от клещей и блох!")
-            )
+        await session.commit()
 
-    return notifications
+
+async def count_claimed_reminder_deliveries(dates: list[str]) -> int:
+    """Сколько напоминаний на даты dates все еще «заняты», но не отправлены"""
+    if not dates:
+        return 0
+    async with _get_session() as session:
+        result = await session.execute(
+            select(func.count(ReminderDelivery.id))
+            .where(ReminderDelivery.status == "claimed", ReminderDelivery.due_date.in_(dates))
+        )
+        return result.scalar_one()
 
 
 # ===== ПЛАТЕЖИ И ФИДБЕК =====
@@ -1006,6 +1295,104 @@ async def mark_yookassa_payment_processed(
             return False
 
 
+async def claim_new_yookassa_payments(payments: list[dict]) -> set[str]:
+    """
+    Пакетная версия mark_yookassa_payment_processed: один INSERT ... ON CONFLICT DO NOTHING RETURNING
+    на всю страницу платежей. Возвращает payment_id, которые вставлены сейчас (т.е. новые).
+    payments — dict'ы с ключами payment_id, user_id, tier, created_at, amount, status.
+    """
+    if not payments:
+        return set()
+    rows = [
+        {
+            "payment_id": p["payment_id"],
+            "user_id": p["user_id"],
+            "tier": p["tier"],
+            "created_at": p.get("created_at"),
+            "amount": p.get("amount"),
+            "status": p.get("status") or "succeeded",
+        }
+        for p in payments
+    ]
+    stmt = (
+        _insert(YooKassaPayment)
+        .values(rows)
+        .on_conflict_do_nothing(index_elements=["payment_id"])
+        .returning(YooKassaPayment.payment_id)
+    )
+    async with _get_session() as session:
+        result = await session.execute(stmt)
+        claimed = {row[0] for row in result.fetchall()}
+        await session.commit()
+        return claimed
+
+
+async def release_yookassa_payment(payment_id: str):
+    """Снимает «заявку» на платеж, если начислить не удалось, — следующая сверка попробует снова"""
+    async with _get_session() as session:
+        await session.execute(delete(YooKassaPayment).where(YooKassaPayment.payment_id == payment_id))
+        await session.commit()
+
+
+async def add_pending_payment(payment_id: str, user_id: int, tier: str, next_check_at: str, expires_at: str):
+    """Ставит созданный ботом платеж на точечное отслеживание"""
+    now = datetime.now().replace(microsecond=0).isoformat()
+    stmt = (
+        _insert(PendingPayment)
+        .values(
+            payment_id=payment_id,
+            user_id=user_id,
+            tier=tier,
+            created_at=now,
+            next_check_at=next_check_at,
+            expires_at=expires_at,
+            attempts=0,
+        )
+        .on_conflict_do_nothing(index_elements=["payment_id"])
+    )
+    async with _get_session() as session:
+        await session.execute(stmt)
+        await session.commit()
+
+
+async def get_due_pending_payments(now_iso: str, limit: int = 20) -> list[PendingPayment]:
+    """Платежи, которые пора проверить (next_check_at <= now), самые «просроченные» первыми"""
+    async with _get_session() as session:
+        result = await session.execute(
+            select(PendingPayment)
+            .where(PendingPayment.next_check_at <= now_iso)
+            .order_by(PendingPayment.next_check_at)
+            .limit(limit)
+        )
+        return list(result.scalars().all())
+
+
+async def get_next_pending_check_at() -> Optional[str]:
+    """Ближайшее время проверки среди отслеживаемых платежей"""
+    async with _get_session() as session:
+        result = await session.execute(select(func.min(PendingPayment.next_check_at)))
+        return result.scalar_one_or_none()
+
+
+async def reschedule_pending_payment(payment_id: str, next_check_at: str, attempts: int):
+    async with _get_session() as session:
+        await session.execute(
+            update(PendingPayment)
+            .where(PendingPayment.payment_id == payment_id)
+            .values(next_check_at=next_check_at, attempts=attempts)
+        )
+        await session.commit()
+
+
+async def delete_pending_payments(payment_ids: list[str]):
+    """Снимает платежи с отслеживания (активированы, отменены или истекли)"""
+    if not payment_ids:
+        return
+    async with _get_session() as session:
+        await session.execute(delete(PendingPayment).where(PendingPayment.payment_id.in_(payment_ids)))
+        await session.commit()
+
+
 async def save_feedback(
     user_id: int, kind: str, source: str = "text", entry_id: Optional[int] = None
 ) -> None:
@@ -1180,3 +1567,126 @@ async def get_referral_link(user_id: int) -> str:
     # Формат: https://t.me/BOT_USERNAME?start=ref_USER_ID
     # Но мы вернем только параметр для команды /start
     return f"ref_{user_id}"
+
+
+# ===== СЛУЖЕБНОЕ СОСТОЯНИЕ =====
+
+async def get_bot_state(key: str) -> Optional[str]:
+    """Читает служебное значение (курсор и т.п.)"""
+    async with _get_session() as session:
+        result = await session.execute(select(BotState.value).where(BotState.key == key))
+        return result.scalar_one_or_none()
+
+
+async def set_bot_state(key: str, value: str, fence: Optional[int] = None) -> bool:
+    """
+    Сохраняет служебное значение (upsert).
+    fence — fencing-токен лидера (services/leader.py): запись с токеном меньше уже сохраненного
+    отклоняется, чтобы «старый» лидер после потери аренды не затер данные нового.
+    Возвращает False, если запись отклонена.
+    """
+    now = datetime.now().isoformat()
+    stmt = _insert(BotState).values(key=key, value=value, updated_at=now, fence=fence)
+    if fence is None:
+        stmt = stmt.on_conflict_do_update(index_elements=["key"], set_={"value": value, "updated_at": now})
+    else:
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["key"],
+            set_={"value": value, "updated_at": now, "fence": fence},
+            where=or_(BotState.fence.is_(None), BotState.fence <= fence),
+        )
+    async with _get_session() as session:
+        result = await session.execute(stmt)
+        await session.commit()
+        return result.rowcount != 0
+
+
+# ===== РАССЫЛКИ =====
+
+async def create_broadcast_job(
+    admin_id: int,
+    progress_chat_id: int,
+    content: str,
+    photo_file_id: Optional[str],
+    total: int,
+    audience: Optional[AudienceFilter] = None,
+) -> BroadcastJob:
+    async with _get_session() as session:
+        job = BroadcastJob(
+            admin_id=admin_id,
+            progress_chat_id=progress_chat_id,
+            content=content,
+            photo_file_id=photo_file_id,
+            audience=(audience or AudienceFilter()).to_json(),
+            status="running",
+            cursor=0,
+            total=total,
+            sent=0,
+            failed=0,
+            created_at=datetime.now().replace(microsecond=0).isoformat(),
+        )
+        session.add(job)
+        await session.commit()
+        await session.refresh(job)
+        return job
+
+
+async def update_broadcast_job(job_id: int, **fields):
+    """Сохраняет прогресс рассылки (cursor, sent, failed, status …)"""
+    async with _get_session() as session:
+        await session.execute(update(BroadcastJob).where(BroadcastJob.id == job_id).values(**fields))
+        await session.commit()
+
+
+async def get_broadcast_job(job_id: int) -> Optional[BroadcastJob]:
+    async with _get_session() as session:
+        result = await session.execute(select(BroadcastJob).where(BroadcastJob.id == job_id))
+        return result.scalar_one_or_none()
+
+
+async def get_running_broadcast_jobs() -> list[BroadcastJob]:
+    """Незавершенные рассылки (для продолжения после рестарта)"""
+    async with _get_session() as session:
+        result = await session.execute(
+            select(BroadcastJob).where(BroadcastJob.status == "running").order_by(BroadcastJob.id)
+        )
+        return list(result.scalars().all())
+
+
+# === ТРАССИРОВКА И МЕТРИКИ ===
+DB_CALL_SECONDS = Histogram("db_call_seconds", "Вызовы хранилища (число и время по операциям)", ("op", "status"))
+
+
+def _timed(name: str, func):
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        started = time_module.perf_counter()
+        status = "ok"
+        try:
+            return await func(*args, **kwargs)
+        except BaseException:
+            status = "error"
+            raise
+        finally:
+            DB_CALL_SECONDS.observe(time_module.perf_counter() - started, op=name, status=status)
+    return wrapper
+
+
+# Каждая публичная функция хранилища — спан db.<имя> (без активной трассы — прямой вызов) и гистограмма
+def _trace_public_functions():
+    for name, func in list(globals().items()):
+        if not name.startswith("_") and inspect.iscoroutinefunction(func) and func.__module__ == __name__:
+            globals()[name] = _timed(name, traced(f"db.{name}")(func))
+
+
+def _collect_pool():
+    """Занятость пула соединений (у SQLite пула с размером нет — пропускаем)"""
+    pool = _engine.pool if _engine is not None else None
+    if pool is None or not hasattr(pool, "checkedout"):
+        return
+    POOL_IN_USE.set(pool.checkedout(), pool="db")
+    POOL_SIZE.set(pool.size(), pool="db")
+
+
+_trace_public_functions()
+add_collector(_collect_pool)
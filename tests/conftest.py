@@ -0,0 +1,77 @@
+# tests/conftest.py — ОБЩИЕ ФИКСТУРЫ: SQLite ВО ВРЕМЕННОЙ ПАПКЕ, FAKEREDIS, ФЕЙКОВЫЙ БОТ
+
+import asyncio
+import inspect
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+# Тесты не должны попасть в боевую БД из .env (load_dotenv не перезаписывает заданные переменные)
+for _name in ("POSTGRES_USER", "POSTGRES_PASSWORD", "POSTGRES_DB", "DATABASE_URL"):
+    os.environ[_name] = ""
+
+import fakeredis  # noqa: E402
+
+import storage as st  # noqa: E402
+from services import redis_client  # noqa: E402
+
+
+def pytest_pyfunc_call(pyfuncitem):
+    """async def test_... выполняем в своем event loop (без pytest-asyncio)"""
+    if not inspect.iscoroutinefunction(pyfuncitem.obj):
+        return None
+    args = {name: pyfuncitem.funcargs[name] for name in pyfuncitem._fixtureinfo.argnames}
+
+    async def run():
+        # База живет в том же event loop, что и тест
+        if "db" in args:
+            await st.init_db()
+        try:
+            await pyfuncitem.obj(**args)
+        finally:
+            if "db" in args:
+                await st._engine.dispose()
+            if "redis" in args:
+                await args["redis"].aclose()
+
+    asyncio.run(run())
+    return True
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """Пустая SQLite-база (init_db и dispose — в pytest_pyfunc_call, в event loop теста)"""
+    monkeypatch.setattr(st, "DATABASE_URL", f"sqlite+aiosqlite:///{tmp_path / 'test.db'}")
+    monkeypatch.setattr(st, "_engine", None)
+    monkeypatch.setattr(st, "_async_session", None)
+    return st
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    fake = fakeredis.aioredis.FakeRedis(decode_responses=True)
+    monkeypatch.setattr(redis_client, "_redis", fake)
+    return fake
+
+
+class FakeBot:
+    """Запоминает отправленные сообщения; fail_for — кому отправка падает"""
+
+    def __init__(self, fail_for: tuple = ()):
+        self.sent: list[tuple[int, str]] = []
+        self.fail_for = set(fail_for)
+
+    async def send_message(self, chat_id, text, **kwargs):
+        if chat_id in self.fail_for:
+            raise RuntimeError(f"send_message({chat_id}) failed")
+        self.sent.append((chat_id, text))
+
+
+@pytest.fixture
+def bot():
+    return FakeBot()
@@ -0,0 +1,110 @@
+# tests/test_job_queue.py — ОЧЕРЕДЬ ЗАДАНИЙ: ПОВТОРНАЯ ВЫДАЧА ПОСЛЕ ПАДЕНИЯ ВОРКЕРА, DEAD-СПИСОК
+
+import asyncio
+
+import pytest
+from aiogram.types import Message
+
+from services import job_queue
+
+USER_ID = 42
+
+
+def _message(text: str = "Что делать, если кот чихает?") -> Message:
+    return Message.model_validate({
+        "message_id": 1,
+        "date": 1767225600,
+        "chat": {"id": USER_ID, "type": "private"},
+        "from": {"id": USER_ID, "is_bot": False, "first_name": "Test"},
+        "text": text,
+    })
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    """Обработчик задания 'answer', запоминающий вызовы; короткий таймаут видимости"""
+    monkeypatch.setattr(job_queue, "JOB_VISIBILITY_TIMEOUT", 1)
+    monkeypatch.setattr(job_queue, "_HANDLERS", {})
+    received = []
+
+    async def handler(message: Message, **payload):
+        if payload.get("fail"):
+            raise RuntimeError("AI недоступен")
+        received.append((message.from_user.id, message.text, payload))
+
+    job_queue.register_job_handler("answer", handler)
+    return received
+
+
+async def _read_and_crash(redis, consumer: str = "crashed-worker") -> list:
+    """Воркер забрал задания и упал, не подтвердив их"""
+    response = await redis.xreadgroup(
+        job_queue.JOB_QUEUE_GROUP, consumer, {job_queue.JOB_QUEUE_STREAM: ">"}, count=10
+    )
+    return response[0][1] if response else []
+
+
+async def _pending(redis) -> int:
+    return (await redis.xpending(job_queue.JOB_QUEUE_STREAM, job_queue.JOB_QUEUE_GROUP))["pending"]
+
+
+async def test_crashed_job_is_redelivered_once(redis, bot, calls):
+    await job_queue._ensure_group()
+    job_id = await job_queue.enqueue("answer", _message(), pet="Барсик")
+    assert [entry[0] for entry in await _read_and_crash(redis)] == [job_id]
+
+    # Пока задание «живое» (idle меньше таймаута), его никто не забирает
+    assert await job_queue._reclaim(10) == []
+    await asyncio.sleep(1.1)
+    entries = await job_queue._reclaim(10)
+    assert [entry[0] for entry in entries] == [job_id]
+
+    await job_queue._process(bot, *entries[0])
+    assert calls == [(USER_ID, "Что делать, если кот чихает?", {"pet": "Барсик"})]
+
+    # Выполненное задание убрано из потока и группы — повторно не выдается
+    await asyncio.sleep(1.1)
+    assert await job_queue._reclaim(10) == []
+    assert await _read_and_crash(redis, "other-worker") == []
+    assert await redis.xlen(job_queue.JOB_QUEUE_STREAM) == 0
+    assert await _pending(redis) == 0
+
+
+async def test_failed_job_is_not_retried(redis, bot, calls):
+    # Ошибка обработчика — не падение процесса: повтор мог бы отправить ответ дважды
+    await job_queue._ensure_group()
+    await job_queue.enqueue("answer", _message(), fail=True)
+    (job_id, fields), = await _read_and_crash(redis, job_queue.INSTANCE_ID)
+
+    await job_queue._process(bot, job_id, fields)
+    await asyncio.sleep(1.1)
+    assert await job_queue._reclaim(10) == []
+    assert await redis.xlen(job_queue.JOB_QUEUE_STREAM) == 0
+    assert calls == []
+
+
+async def test_job_goes_to_dead_list_after_max_attempts(redis, bot, calls, monkeypatch):
+    monkeypatch.setattr(job_queue, "JOB_MAX_ATTEMPTS", 2)
+    await job_queue._ensure_group()
+    job_id = await job_queue.enqueue("answer", _message())
+    await _read_and_crash(redis)
+
+    # Вторая выдача (после падения первого воркера) — еще в пределах лимита, но и она «падает»
+    await asyncio.sleep(1.1)
+    assert [entry[0] for entry in await job_queue._reclaim(10)] == [job_id]
+    await asyncio.sleep(1.1)
+    assert await job_queue._reclaim(10) == []
+
+    dead = f"{job_queue.JOB_QUEUE_STREAM}:dead"
+    assert await redis.llen(dead) == 1
+    assert await redis.xlen(job_queue.JOB_QUEUE_STREAM) == 0
+    assert await _pending(redis) == 0
+    assert calls == []
+
+
+async def test_enqueue_rejects_when_queue_is_full(redis, monkeypatch):
+    monkeypatch.setattr(job_queue, "JOB_QUEUE_MAX_PENDING", 2)
+    await job_queue.enqueue("answer", _message())
+    await job_queue.enqueue("answer", _message())
+    with pytest.raises(job_queue.QueueFull):
+        await job_queue.enqueue("answer", _message())
@@ -0,0 +1,89 @@
+# tests/test_payments.py — АКТИВАЦИЯ ОПЛАТ: ДЕДУПЛИКАЦИЯ, ПАКЕТНАЯ «ЗАЯВКА», ОТКАТ ПРИ ОШИБКЕ
+
+from sqlalchemy import select
+
+from models import PendingPayment, User, YooKassaPayment
+from services import payments
+from services.query_stats import assert_max_queries
+
+
+def _payment(payment_id: str, user_id: int, tier: str = "one_time_analysis", status: str = "succeeded") -> dict:
+    return {
+        "id": payment_id,
+        "status": status,
+        "created_at": "2026-01-01T10:00:00.000Z",
+        "amount": {"value": "99.00", "currency": "RUB"},
+        "metadata": {"user_id": str(user_id), "tier": tier},
+    }
+
+
+async def _add_users(st, *user_ids: int):
+    async with st._get_session() as session:
+        session.add_all(User(user_id=uid, username=f"u{uid}", balance_analyses=0) for uid in user_ids)
+        await session.commit()
+
+
+async def _balances(st) -> dict[int, int]:
+    async with st._get_session() as session:
+        result = await session.execute(select(User.user_id, User.balance_analyses))
+        return dict(result.fetchall())
+
+
+async def _processed_ids(st) -> set[str]:
+    async with st._get_session() as session:
+        result = await session.execute(select(YooKassaPayment.payment_id))
+        return set(result.scalars().all())
+
+
+async def test_claim_is_one_query_and_returns_only_new(db):
+    rows = [payments.payment_fields(_payment(f"p{i}", 1)) for i in range(5)]
+
+    with assert_max_queries(1):
+        claimed = await db.claim_new_yookassa_payments(rows)
+    assert claimed == {f"p{i}" for i in range(5)}
+
+    # Страница пересекается с уже обработанной — новые только p5, p6
+    rows = [payments.payment_fields(_payment(f"p{i}", 1)) for i in range(3, 7)]
+    assert await db.claim_new_yookassa_payments(rows) == {"p5", "p6"}
+
+
+async def test_batch_grants_each_payment_once(db, bot):
+    await _add_users(db, 1, 2)
+    page = [_payment("a", 1), _payment("b", 2), _payment("c", 1, status="canceled")]
+
+    assert await payments.activate_payments_batch(bot, page) == 2
+    assert await payments.activate_payments_batch(bot, page) == 0
+    # Вебхук по тому же платежу после сверки — тоже ничего
+    assert await payments.activate_payment(bot, _payment("a", 1)) is False
+
+    assert await _balances(db) == {1: 1, 2: 1}
+    assert sorted(chat_id for chat_id, _ in bot.sent) == [1, 2]
+
+
+async def test_batch_releases_claim_when_grant_fails(db, bot, monkeypatch):
+    await _add_users(db, 1, 2, 3)
+    for payment_id, user_id in (("a", 1), ("b", 2), ("c", 3)):
+        await db.add_pending_payment(payment_id, user_id, "one_time_analysis", "2026-01-01T00:00:00", "2026-01-02T00:00:00")
+
+    increment = db.increment_balance_analyses
+
+    async def flaky_increment(user_id: int, amount: int = 1):
+        if user_id == 2:
+            raise RuntimeError("database is locked")
+        await increment(user_id, amount)
+
+    monkeypatch.setattr(db, "increment_balance_analyses", flaky_increment)
+    page = [_payment("a", 1), _payment("b", 2), _payment("c", 3)]
+
+    # Ошибка на «b» не мешает начислить «c»; «b» не остается «застолбленным»
+    assert await payments.activate_payments_batch(bot, page) == 2
+    assert await _processed_ids(db) == {"a", "c"}
+    assert await _balances(db) == {1: 1, 2: 0, 3: 1}
+    async with db._get_session() as session:
+        pending = set((await session.execute(select(PendingPayment.payment_id))).scalars().all())
+    assert pending == {"b"}
+
+    # Следующая сверка начисляет «b», остальные не повторяются
+    monkeypatch.setattr(db, "increment_balance_analyses", increment)
+    assert await payments.activate_payments_batch(bot, page) == 1
+    assert await _balances(db) == {1: 1, 2: 1, 3: 1}
@@ -0,0 +1,125 @@
+# tests/test_reminders.py — ЖУРНАЛ НАПОМИНАНИЙ: «ЗАЯВКА», ПОВТОР ПОСЛЕ СБОЯ, FENCING, РАСПИСАНИЕ
+
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import select, update
+
+from models import Pet, ReminderDelivery, User
+from services import reminders
+from services.query_stats import assert_max_queries
+
+
+async def _add_pets(st, due_date: str, *user_ids: int):
+    async with st._get_session() as session:
+        for uid in user_ids:
+            session.add(User(user_id=uid, username=f"u{uid}"))
+            session.add(Pet(user_id=uid, name=f"Pet{uid}", next_vaccine_date=due_date))
+        await session.commit()
+
+
+async def _statuses(st) -> dict[int, str]:
+    async with st._get_session() as session:
+        result = await session.execute(select(ReminderDelivery.user_id, ReminderDelivery.status))
+        return dict(result.fetchall())
+
+
+async def _age_claims(st, seconds: int):
+    """Имитация процесса, упавшего seconds назад между «занял» и «отправил»"""
+    old = (datetime.now() - timedelta(seconds=seconds)).replace(microsecond=0).isoformat()
+    async with st._get_session() as session:
+        await session.execute(update(ReminderDelivery).values(created_at=old))
+        await session.commit()
+
+
+async def test_claim_is_exclusive(db):
+    rows = [(1, 10, "vaccine", "2026-03-01"), (2, 20, "tick", "2026-03-01")]
+    first = await db.claim_reminder_deliveries(rows)
+    assert set(first) == {(1, "vaccine", "2026-03-01"), (2, "tick", "2026-03-01")}
+    # Вторая реплика (или повторный запуск) получает пустой ответ, даже с reclaim_after — записи свежие
+    assert await db.claim_reminder_deliveries(rows) == {}
+    assert await db.claim_reminder_deliveries(rows, reclaim_after=600) == {}
+
+
+async def test_stale_claim_is_taken_over_once(db):
+    rows = [(1, 10, "vaccine", "2026-03-01"), (2, 20, "vaccine", "2026-03-01")]
+    claimed = await db.claim_reminder_deliveries(rows)
+    await db.set_reminder_delivery_status([claimed[(2, "vaccine", "2026-03-01")]], "sent")
+    await _age_claims(db, 3600)
+
+    # Забирается только зависшая 'claimed'; отправленная — никогда (INSERT + UPDATE, без чтения по одной)
+    with assert_max_queries(2):
+        again = await db.claim_reminder_deliveries(rows, reclaim_after=600)
+    assert again == {(1, "vaccine", "2026-03-01"): claimed[(1, "vaccine", "2026-03-01")]}
+    # Повторный захват обновил created_at — второй претендент ничего не получает
+    assert await db.claim_reminder_deliveries(rows, reclaim_after=600) == {}
+
+
+async def test_fencing_rejects_stale_leader(db):
+    assert await db.set_bot_state(reminders.LAST_RUN_KEY, "2026-03-02", fence=5)
+    assert not await db.set_bot_state(reminders.LAST_RUN_KEY, "2026-03-01", fence=4)
+    assert await db.get_bot_state(reminders.LAST_RUN_KEY) == "2026-03-02"
+    assert await db.set_bot_state(reminders.LAST_RUN_KEY, "2026-03-03", fence=6)
+
+
+async def test_run_once_sends_once(db, bot):
+    today = reminders._now().date().isoformat()
+    await _add_pets(db, today, 1, 2)
+
+    assert await reminders.run_once(bot)
+    assert sorted(chat_id for chat_id, _ in bot.sent) == [1, 2]
+    assert await _statuses(db) == {1: "sent", 2: "sent"}
+    assert await db.get_bot_state(reminders.LAST_RUN_KEY) == today
+
+    # Дата записана, но даже повторная рассылка за тот же день ничего не дублирует
+    await reminders.dispatch(bot, [today], reminders._now().date())
+    assert len(bot.sent) == 2
+
+
+async def test_run_once_resends_after_crash(db, bot, monkeypatch):
+    monkeypatch.setattr(reminders, "REMINDER_CLAIM_TIMEOUT", 600)
+    today = reminders._now().date().isoformat()
+    await _add_pets(db, today, 1, 2)
+    # Прошлый процесс занял напоминание пользователя 1 и упал до отправки
+    await db.claim_reminder_deliveries([(1, 1, "vaccine", today)])
+
+    # Заявка свежая: отправляем только 2, дату не пишем — иначе 1 потерялось бы навсегда
+    assert not await reminders.run_once(bot)
+    assert [chat_id for chat_id, _ in bot.sent] == [2]
+    assert await db.get_bot_state(reminders.LAST_RUN_KEY) is None
+
+    await _age_claims(db, 3600)
+    assert await reminders.run_once(bot)
+    assert [chat_id for chat_id, _ in bot.sent] == [2, 1]
+    assert await _statuses(db) == {1: "sent", 2: "sent"}
+    assert await db.get_bot_state(reminders.LAST_RUN_KEY) == today
+
+
+async def test_scheduler_sleeps_when_last_run_is_in_the_future(db, bot, monkeypatch):
+    monkeypatch.setattr(reminders, "REMINDER_TIME", "00:00")
+    tomorrow = (reminders._now().date() + timedelta(days=1)).isoformat()
+    await db.set_bot_state(reminders.LAST_RUN_KEY, tomorrow)
+
+    runs, sleeps = [], []
+    run_once = reminders.run_once
+
+    async def counting_run_once(b):
+        runs.append(1)
+        if len(runs) > 3:
+            raise asyncio.CancelledError()  # цикл крутится без сна — выходим, проверка ниже упадет
+        return await run_once(b)
+
+    async def fake_sleep(seconds):
+        sleeps.append(seconds)
+        raise asyncio.CancelledError()
+
+    monkeypatch.setattr(reminders, "run_once", counting_run_once)
+    monkeypatch.setattr(reminders.asyncio, "sleep", fake_sleep)
+    with pytest.raises(asyncio.CancelledError):
+        await reminders.reminder_scheduler(bot)
+
+    # Рассылать нечего — но цикл уснул до следующего запуска, а не пошел на новый круг
+    assert len(runs) == 1
+    assert sleeps and sleeps[0] > 60
+    assert bot.sent == []
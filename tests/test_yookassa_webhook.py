@@ -0,0 +1,91 @@
+# tests/test_yookassa_webhook.py — ВЕБХУК YOOKASSA: IP, ТОКЕН, ПЕРЕПРОВЕРКА ЧЕРЕЗ API, ДЕДУПЛИКАЦИЯ
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+from sqlalchemy import select
+
+from models import User
+from services import yookassa_webhook
+
+YOOKASSA_IP = "185.71.76.5"
+SECRET = "s3cret"
+
+
+def _notification(payment_id: str = "pay-1", user_id: int = 1, status: str = "succeeded") -> dict:
+    return {
+        "type": "notification",
+        "event": "payment.succeeded",
+        "object": {
+            "id": payment_id,
+            "status": status,
+            "amount": {"value": "99.00", "currency": "RUB"},
+            "metadata": {"user_id": str(user_id), "tier": "one_time_analysis"},
+            "created_at": "2026-01-01T10:00:00.000Z",
+        },
+    }
+
+
+@pytest.fixture
+def api_payments(monkeypatch):
+    """Ответы «API YooKassa» на перепроверку: payment_id -> платеж"""
+    monkeypatch.setattr(yookassa_webhook, "YOOKASSA_WEBHOOK_SECRET", SECRET)
+    monkeypatch.setattr(yookassa_webhook, "YOOKASSA_WEBHOOK_VERIFY", True)
+    monkeypatch.setattr(yookassa_webhook, "YOOKASSA_TRUST_PROXY", True)
+    payments: dict[str, dict] = {}
+
+    async def fetch_payment(payment_id: str):
+        return payments[payment_id]
+
+    monkeypatch.setattr(yookassa_webhook, "_fetch_payment", fetch_payment)
+    return payments
+
+
+async def _post(bot, body, token: str = SECRET, ip: str = YOOKASSA_IP, raw: str = None) -> int:
+    app = web.Application()
+    yookassa_webhook.setup_routes(app, bot)
+    async with TestClient(TestServer(app)) as client:
+        response = await client.post(
+            yookassa_webhook.YOOKASSA_WEBHOOK_PATH,
+            params={"token": token},
+            headers={"X-Forwarded-For": ip, "Content-Type": "application/json"},
+            json=None if raw is not None else body,
+            data=raw,
+        )
+        return response.status
+
+
+async def _balance(st, user_id: int) -> int:
+    async with st._get_session() as session:
+        result = await session.execute(select(User.balance_analyses).where(User.user_id == user_id))
+        return result.scalar_one()
+
+
+async def test_rejects_foreign_ip_and_bad_token(db, bot, api_payments):
+    assert await _post(bot, _notification(), ip="8.8.8.8") == 403
+    assert await _post(bot, _notification(), token="wrong") == 403
+    # Не-ASCII токен — отказ, а не 500
+    assert await _post(bot, _notification(), token="пароль") == 403
+
+
+@pytest.mark.parametrize("raw", ["not json", "[]", '"x"', '{"event": "payment.succeeded", "object": [1]}'])
+async def test_rejects_malformed_body(db, bot, api_payments, raw):
+    assert await _post(bot, None, raw=raw) == 400
+
+
+async def test_activates_once_and_trusts_api_over_body(db, bot, api_payments):
+    async with db._get_session() as session:
+        session.add(User(user_id=1, username="u1", balance_analyses=0))
+        await session.commit()
+
+    # Тело говорит succeeded, API — нет: поддельное уведомление ничего не начисляет
+    api_payments["pay-1"] = _notification(status="pending")["object"]
+    assert await _post(bot, _notification()) == 200
+    assert await _balance(db, 1) == 0
+
+    api_payments["pay-1"] = _notification()["object"]
+    assert await _post(bot, _notification()) == 200
+    # YooKassa повторяет доставку — второй раз не начисляем
+    assert await _post(bot, _notification()) == 200
+    assert await _balance(db, 1) == 1
+    assert len(bot.sent) == 1
@@ -0,0 +1,86 @@
+"""
+Микро-бенчмарк стадии обработки изображений (handlers/ocr).
+
+Прогоняет каждый файл корпуса (JPG/PNG/WEBP/PDF) через тот же пайплайн, что и бот,
+и печатает CPU-время (мс) и пиковый RSS (МБ) на файл.
+Каждый файл обрабатывается в отдельном процессе, чтобы пиковый RSS не накапливался.
+
+Использование:
+    python tools/bench_imaging.py samples/ --repeat 5
+"""
+
+import argparse
+import io
+import resource
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png", ".webp"}
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss: килобайты в Linux, байты в macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def _bench_one(path: str, repeat: int, model: str, is_document: bool) -> dict:
+    from ai_client import image_policy_for
+    from handlers.ocr import _process_image_sync, _process_pdf_sync
+
+    data = Path(path).read_bytes()
+    is_pdf = path.lower().endswith(".pdf")
+    func = _process_pdf_sync if is_pdf else _process_image_sync
+    policy = image_policy_for(model)
+
+    baseline_rss = _peak_rss_mb()
+    out = None
+    cpu_times = []
+    for _ in range(repeat):
+        started = time.process_time()
+        out = func(io.BytesIO(data), policy, is_document)
+        cpu_times.append((time.process_time() - started) * 1000)
+
+    return {
+        "file": Path(path).name,
+        "in_kb": len(data) / 1024,
+        "out_kb": len(out.data) / 1024 if out and out.data else 0.0,
+        "cpu_ms": min(cpu_times),
+        "peak_rss_mb": _peak_rss_mb(),
+        "rss_delta_mb": _peak_rss_mb() - baseline_rss,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Бенчмарк обработки фото/PDF")
+    parser.add_argument("corpus", help="Папка с примерами фото и PDF")
+    parser.add_argument("--repeat", type=int, default=3, help="Повторов на файл (берется минимум CPU)")
+    parser.add_argument("--model", default="vis-openai/gpt-4o-mini", help="Vision-модель для ImagePolicy")
+    parser.add_argument("--document", action="store_true", help="Обрабатывать фото как сканы документов")
+    args = parser.parse_args()
+
+    files = sorted(
+        str(p) for p in Path(args.corpus).iterdir()
+        if p.suffix.lower() in IMAGE_SUFFIXES or p.suffix.lower() == ".pdf"
+    )
+    if not files:
+        print(f"В папке {args.corpus} нет фото/PDF")
+        sys.exit(1)
+
+    print(f"{'file':40} {'in KB':>9} {'out KB':>9} {'CPU ms':>9} {'peak MB':>9} {'Δ MB':>8}")
+    for path in files:
+        # Новый процесс на каждый файл: ru_maxrss монотонен в пределах процесса
+        with ProcessPoolExecutor(max_workers=1) as pool:
+            r = pool.submit(_bench_one, path, max(1, args.repeat), args.model, args.document).result()
+        print(
+            f"{r['file'][:40]:40} {r['in_kb']:9.1f} {r['out_kb']:9.1f} "
+            f"{r['cpu_ms']:9.1f} {r['peak_rss_mb']:9.1f} {r['rss_delta_mb']:8.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
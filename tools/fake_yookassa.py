@@ -0,0 +1,126 @@
+"""
+Локальный «фейковый» YooKassa для проверки оплаты без реальных денег.
+
+Умеет:
+- POST /v3/payments            — создать платеж (с учетом Idempotence-Key)
+- GET  /v3/payments/{id}       — получить платеж (проверка уведомления)
+- GET  /v3/payments            — список платежей (сверка)
+- POST /_succeed/{id}          — перевести платеж в succeeded и отправить уведомление боту
+
+Использование:
+    python tools/fake_yookassa.py --port 9000 --webhook http://127.0.0.1:8080/yookassa/webhook
+
+    --fail-every N  — каждый N-й запрос к /v3 отвечает 503 (проверка повторов клиента)
+
+В .env бота:
+    YOOKASSA_API_URL=http://127.0.0.1:9000/v3
+    YOOKASSA_WEBHOOK_ALLOWED_IPS=127.0.0.1
+"""
+
+import argparse
+import uuid
+from datetime import datetime, timezone
+
+import aiohttp
+from aiohttp import web
+
+PAYMENTS: dict[str, dict] = {}
+IDEMPOTENCE: dict[str, str] = {}
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+
+
+@web.middleware
+async def fail_every(request: web.Request, handler):
+    n = request.app["fail_every"]
+    if n and request.path.startswith("/v3"):
+        request.app["calls"] += 1
+        if request.app["calls"] % n == 0:
+            return web.json_response({"type": "error", "code": "internal_server_error"}, status=503)
+    return await handler(request)
+
+
+async def create_payment(request: web.Request) -> web.Response:
+    key = request.headers.get("Idempotence-Key")
+    if not key:
+        return web.json_response({"type": "error", "code": "invalid_request"}, status=400)
+    if key in IDEMPOTENCE:
+        return web.json_response(PAYMENTS[IDEMPOTENCE[key]])
+    body = await request.json()
+    payment_id = str(uuid.uuid4())
+    payment = {
+        "id": payment_id,
+        "status": "pending",
+        "paid": False,
+        "amount": body.get("amount"),
+        "description": body.get("description"),
+        "metadata": body.get("metadata") or {},
+        "created_at": _now(),
+        "test": True,
+        "confirmation": {
+            "type": "redirect",
+            "confirmation_url": f"http://{request.host}/_succeed/{payment_id}",
+        },
+    }
+    PAYMENTS[payment_id] = payment
+    IDEMPOTENCE[key] = payment_id
+    return web.json_response(payment)
+
+
+async def get_payment(request: web.Request) -> web.Response:
+    payment = PAYMENTS.get(request.match_info["payment_id"])
+    if not payment:
+        return web.json_response({"type": "error", "code": "not_found"}, status=404)
+    return web.json_response(payment)
+
+
+async def list_payments(request: web.Request) -> web.Response:
+    status = request.query.get("status")
+    limit = int(request.query.get("limit", "10"))
+    since = request.query.get("created_at.gte")
+    offset = int(request.query.get("cursor", "0"))
+    items = [
+        p for p in PAYMENTS.values()
+        if (not status or p["status"] == status) and (not since or p["created_at"] >= since)
+    ]
+    items.sort(key=lambda p: p["created_at"], reverse=True)
+    page = {"type": "list", "items": items[offset:offset + limit]}
+    if offset + limit < len(items):
+        page["next_cursor"] = str(offset + limit)
+    return web.json_response(page)
+
+
+async def succeed_payment(request: web.Request) -> web.Response:
+    payment = PAYMENTS.get(request.match_info["payment_id"])
+    if not payment:
+        return web.Response(status=404, text="unknown payment")
+    payment.update(status="succeeded", paid=True, captured_at=_now())
+
+    notification = {"type": "notification", "event": "payment.succeeded", "object": payment}
+    async with aiohttp.ClientSession() as sess:
+        async with sess.post(request.app["webhook"], json=notification) as r:
+            return web.Response(text=f"payment {payment['id']} succeeded, webhook -> {r.status}\n")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Фейковый YooKassa для локальных проверок")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--webhook", default="http://127.0.0.1:8080/yookassa/webhook")
+    parser.add_argument("--fail-every", type=int, default=0)
+    args = parser.parse_args()
+
+    app = web.Application(middlewares=[fail_every])
+    app["webhook"] = args.webhook
+    app["fail_every"] = args.fail_every
+    app["calls"] = 0
+    app.router.add_post("/v3/payments", create_payment)
+    app.router.add_get("/v3/payments", list_payments)
+    app.router.add_get("/v3/payments/{payment_id}", get_payment)
+    app.router.add_route("*", "/_succeed/{payment_id}", succeed_payment)
+    web.run_app(app, host="127.0.0.1", port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+# worker.py — ВОРКЕР ОЧЕРЕДИ: AI-ОТВЕТЫ И РАЗБОР ФОТО/ДОКУМЕНТОВ (JOB_QUEUE_ENABLED=1)
+
+import asyncio
+import logging
+import signal
+
+from aiogram import Bot
+from aiogram.client.default import DefaultBotProperties
+from dotenv import load_dotenv
+
+import bot as vetbot
+import config
+import storage as st
+from check_env import validate_required_env
+from services.delivery import DeliveryStateMiddleware
+from services.http_server import build_metrics_app, start_http_server
+from services.job_queue import WORKER_CONCURRENCY, run_worker
+from services.loop_monitor import run_loop_monitor
+from services.redis_client import close_redis
+from services.tracing import setup_tracing
+
+logger = logging.getLogger("VetBot.Worker")
+
+
+async def main():
+    load_dotenv()
+    validate_required_env()
+    await st.init_db()
+
+    vetbot.setup_ai()
+    bot = Bot(token=config.TELEGRAM_BOT_TOKEN, default=DefaultBotProperties(parse_mode="Markdown"))
+    bot.session.middleware(DeliveryStateMiddleware())
+    setup_tracing(None, bot)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass
+
+    asyncio.create_task(run_loop_monitor())
+    http_runner = None
+    if config.WORKER_METRICS_PORT:
+        http_runner = await start_http_server(build_metrics_app(), port=config.WORKER_METRICS_PORT)
+    print(f"✅ VET-BOT WORKER ЗАПУЩЕН! (до {WORKER_CONCURRENCY} заданий одновременно)")
+    try:
+        await run_worker(bot, stop)
+    finally:
+        if http_runner is not None:
+            await http_runner.cleanup()
+        await bot.session.close()
+        await close_redis()
+        await st.close_db()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        logger.info("Worker stopped by KeyboardInterrupt")